@@ -0,0 +1,208 @@
+"""
+脚本执行准入控制模块
+限制全局与单客户端的并发执行数，超出部分进入有界 FIFO 队列排队，
+队列已满或排队超时时快速拒绝，避免突发请求拖垮整机
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from app.settings import env_float, env_int
+
+
+class AdmissionRejected(Exception):
+    """准入被拒绝，code 与 BaseResponse.code 对应（429/503）"""
+
+    def __init__(self, code: int, msg: str, reason: str):
+        super().__init__(msg)
+        self.code = code
+        self.msg = msg
+        self.reason = reason
+
+
+@dataclass
+class AdmissionConfig:
+    """准入控制配置"""
+    max_concurrent: int = 8
+    per_client: int = 2
+    max_queue: int = 32
+    per_client_queue: int = 8
+    queue_timeout: float = 15.0
+
+    @classmethod
+    def from_env(cls) -> "AdmissionConfig":
+        """从环境变量读取配置，未设置时使用默认值"""
+        default = cls()
+        return cls(
+            max_concurrent=env_int("SCRIPT_MAX_CONCURRENT", default.max_concurrent),
+            per_client=env_int("SCRIPT_MAX_PER_CLIENT", default.per_client),
+            max_queue=env_int("SCRIPT_MAX_QUEUE", default.max_queue),
+            per_client_queue=env_int("SCRIPT_MAX_QUEUE_PER_CLIENT", default.per_client_queue),
+            queue_timeout=env_float("SCRIPT_QUEUE_TIMEOUT", default.queue_timeout),
+        )
+
+
+class _Waiter:
+    __slots__ = ("client_id", "future", "enqueued_at")
+
+    def __init__(self, client_id: str, future: asyncio.Future):
+        self.client_id = client_id
+        self.future = future
+        self.enqueued_at = time.time()
+
+
+class AdmissionController:
+    """全局 + 单客户端并发限制，按到达顺序公平放行"""
+
+    def __init__(self, config: AdmissionConfig = None):
+        self.config = config or AdmissionConfig.from_env()
+        self.running = 0
+        self.running_by_client: Dict[str, int] = {}
+        self._queue: deque = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _can_run(self, client_id: str) -> bool:
+        if self.running >= self.config.max_concurrent:
+            return False
+        return self.running_by_client.get(client_id, 0) < self.config.per_client
+
+    def _grant(self, client_id: str):
+        self.running += 1
+        self.running_by_client[client_id] = self.running_by_client.get(client_id, 0) + 1
+
+    def _dispatch(self):
+        """按 FIFO 顺序放行可以运行的排队请求（跳过已达单客户端上限者）"""
+        for waiter in list(self._queue):
+            if self.running >= self.config.max_concurrent:
+                break
+            if waiter.future.done():
+                self._queue.remove(waiter)
+                continue
+            if self._can_run(waiter.client_id):
+                self._queue.remove(waiter)
+                self._grant(waiter.client_id)
+                waiter.future.set_result(True)
+
+    def queued_for(self, client_id: str) -> int:
+        return sum(1 for w in self._queue if w.client_id == client_id)
+
+    async def acquire(self, client_id: Optional[str] = None) -> float:
+        """
+        申请执行名额
+
+        Args:
+            client_id (str): 客户端标识，为空时归入匿名客户端
+
+        Returns:
+            float: 排队等待时间（秒）
+
+        Raises:
+            AdmissionRejected: 队列已满(503)、客户端排队过多(429)或排队超时(503)
+        """
+        client_id = client_id or "anonymous"
+        if not self._queue and self._can_run(client_id):
+            self._grant(client_id)
+            self.admitted += 1
+            return 0.0
+
+        if self.queued_for(client_id) >= self.config.per_client_queue:
+            self.rejected += 1
+            raise AdmissionRejected(429, "请求过于频繁，请稍后重试", "client_queue_full")
+        if len(self._queue) >= self.config.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(503, "服务繁忙，执行队列已满", "queue_full")
+
+        waiter = _Waiter(client_id, asyncio.get_running_loop().create_future())
+        self._queue.append(waiter)
+        self._dispatch()
+        if waiter.future.done():
+            # 排在前面的请求都受单客户端上限限制，当前请求可直接执行
+            self.admitted += 1
+            return 0.0
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.config.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.future.done():
+                # 超时的同时恰好被放行，按放行处理
+                pass
+            else:
+                waiter.future.cancel()
+                self._remove(waiter)
+                self.timed_out += 1
+                raise AdmissionRejected(503, f"排队超时 ({self.config.queue_timeout:g}秒)", "queue_timeout")
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(client_id)
+            else:
+                waiter.future.cancel()
+                self._remove(waiter)
+            raise
+
+        wait = time.time() - waiter.enqueued_at
+        self.admitted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        return wait
+
+    def _remove(self, waiter: _Waiter):
+        try:
+            self._queue.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, client_id: Optional[str] = None):
+        """归还执行名额并唤醒排队请求"""
+        client_id = client_id or "anonymous"
+        self.running = max(0, self.running - 1)
+        remaining = self.running_by_client.get(client_id, 0) - 1
+        if remaining > 0:
+            self.running_by_client[client_id] = remaining
+        else:
+            self.running_by_client.pop(client_id, None)
+        self._dispatch()
+
+    def try_acquire(self, client_id: Optional[str], count: int) -> int:
+        """
+        不排队地申请最多 count 个额外名额（有请求在排队时不插队），供一次执行启动多个进程时使用
+
+        Returns:
+            int: 实际获得的名额数，每个名额都需要 release 归还
+        """
+        client_id = client_id or "anonymous"
+        granted = 0
+        while granted < count and not self._queue and self._can_run(client_id):
+            self._grant(client_id)
+            granted += 1
+        return granted
+
+    @asynccontextmanager
+    async def slot(self, client_id: Optional[str] = None):
+        """以上下文管理器形式占用执行名额，返回排队等待时间"""
+        wait = await self.acquire(client_id)
+        try:
+            yield wait
+        finally:
+            self.release(client_id)
+
+    def stats(self) -> dict:
+        """准入控制统计信息"""
+        return {
+            "max_concurrent": self.config.max_concurrent,
+            "per_client": self.config.per_client,
+            "running": self.running,
+            "queued": len(self._queue),
+            "max_queue": self.config.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait": self.total_wait / self.admitted if self.admitted else 0.0,
+            "max_wait": self.max_wait,
+        }
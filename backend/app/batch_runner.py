@@ -0,0 +1,205 @@
+"""
+批量执行模块
+一次提交多个脚本，在并发上限内并行执行并汇总报告；
+预检（清理、编译）在线程池中进行，与已放行脚本的执行重叠，形成流水线
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from app.admission import AdmissionRejected
+from app.preflight import prepare_code
+from app.script_executor import ExecutionResult, ExecutionStatus, ScriptExecutor, get_script_executor
+from app.settings import env_int
+
+
+@dataclass
+class BatchConfig:
+    """批量执行配置"""
+    max_parallel: int = 4
+    max_scripts: int = 100
+    prepare_workers: int = 2
+    slowest: int = 5
+
+    @classmethod
+    def from_env(cls) -> "BatchConfig":
+        """从环境变量读取配置，未设置时使用默认值"""
+        default = cls()
+        return cls(
+            max_parallel=env_int("BATCH_MAX_PARALLEL", default.max_parallel),
+            max_scripts=env_int("BATCH_MAX_SCRIPTS", default.max_scripts),
+            prepare_workers=env_int("BATCH_PREPARE_WORKERS", default.prepare_workers),
+        )
+
+
+@dataclass
+class BatchItem:
+    """批量执行中的单个脚本"""
+    code: str
+    runner: Optional[str] = "python"
+    timeout: int = 30
+    name: Optional[str] = None
+
+
+@dataclass
+class BatchItemResult:
+    """单个脚本的执行结果；预检失败或被拒绝时 result 为空，error/error_code 说明原因"""
+    index: int
+    name: str
+    result: Optional[ExecutionResult] = None
+    error: Optional[str] = None
+    error_code: Optional[int] = None
+
+    @property
+    def passed(self) -> bool:
+        return (self.result is not None
+                and self.result.status == ExecutionStatus.COMPLETED
+                and self.result.exit_code == 0)
+
+
+@dataclass
+class BatchReport:
+    """批量执行汇总报告"""
+    items: List[BatchItemResult]
+    parallelism: int
+    wall_time: float
+    total_execution_time: float = 0.0
+    passed: int = 0
+    failed: int = 0
+    errors: int = 0
+    timeouts: int = 0
+    slowest: List[dict] = field(default_factory=list)
+
+
+class BatchRunner:
+    """在并发上限内批量执行脚本"""
+
+    def __init__(self, executor: ScriptExecutor, config: BatchConfig = None):
+        self.executor = executor
+        self.config = config or BatchConfig.from_env()
+        self._prepare_pool = ThreadPoolExecutor(max_workers=max(1, self.config.prepare_workers),
+                                                thread_name_prefix="batch-prepare")
+
+    def effective_parallelism(self, requested: Optional[int] = None) -> int:
+        """
+        计算实际并发数：不超过配置上限；启用准入控制时不超过单客户端并发上限，
+        避免同一批次的脚本在准入队列里排队超时
+        """
+        parallelism = min(requested or self.config.max_parallel, self.config.max_parallel)
+        if self.executor.admission is not None:
+            parallelism = min(parallelism, self.executor.admission.config.per_client)
+        return max(1, parallelism)
+
+    async def run(
+        self,
+        items: List[BatchItem],
+        parallelism: Optional[int] = None,
+        client_id: Optional[str] = None,
+        use_cache: bool = True
+    ) -> BatchReport:
+        """
+        批量执行脚本
+
+        Raises:
+            ValueError: 脚本数量为 0 或超过上限
+        """
+        if not items:
+            raise ValueError("脚本列表不能为空")
+        if len(items) > self.config.max_scripts:
+            raise ValueError(f"脚本数量超过上限: {len(items)} > {self.config.max_scripts}")
+
+        parallelism = self.effective_parallelism(parallelism)
+        semaphore = asyncio.Semaphore(parallelism)
+        loop = asyncio.get_running_loop()
+        start_time = time.time()
+        print(f"[批量执行] 开始执行 {len(items)} 个脚本，并发数: {parallelism}")
+
+        async def run_one(index: int, item: BatchItem) -> BatchItemResult:
+            outcome = BatchItemResult(index=index, name=item.name or f"script_{index + 1}")
+            # 预检在线程池中进行，不占用执行名额，与其他脚本的执行重叠
+            try:
+                runner, cleaned_code = await loop.run_in_executor(
+                    self._prepare_pool, prepare_code, item.code, item.runner
+                )
+            except SyntaxError as e:
+                outcome.error = f"语法错误: {e.msg} (第{e.lineno}行, 第{e.offset}列)"
+                outcome.error_code = 400
+                return outcome
+            except ValueError as e:
+                outcome.error = f"参数错误: {str(e)}"
+                outcome.error_code = 400
+                return outcome
+
+            async with semaphore:
+                try:
+                    outcome.result = await self.executor.execute_script_async(
+                        code=cleaned_code,
+                        runner=runner,
+                        timeout=item.timeout,
+                        client_id=client_id,
+                        use_cache=use_cache
+                    )
+                except AdmissionRejected as e:
+                    outcome.error = e.msg
+                    outcome.error_code = e.code
+            return outcome
+
+        results = await asyncio.gather(*(run_one(i, item) for i, item in enumerate(items)))
+        report = self._summarize(list(results), parallelism, time.time() - start_time)
+        print(f"[批量执行] 完成 - 通过: {report.passed}, 失败: {report.failed}, "
+              f"错误: {report.errors}, 总耗时: {report.wall_time:.2f}秒")
+        return report
+
+    def _summarize(self, items: List[BatchItemResult], parallelism: int, wall_time: float) -> BatchReport:
+        report = BatchReport(items=items, parallelism=parallelism, wall_time=wall_time)
+        for item in items:
+            if item.result is None:
+                report.errors += 1
+                report.failed += 1
+                continue
+            report.total_execution_time += item.result.execution_time
+            if item.result.status == ExecutionStatus.TIMEOUT:
+                report.timeouts += 1
+            if item.passed:
+                report.passed += 1
+            else:
+                report.failed += 1
+        executed = sorted((i for i in items if i.result is not None),
+                          key=lambda i: i.result.execution_time, reverse=True)
+        report.slowest = [
+            {"index": i.index, "name": i.name, "execution_time": i.result.execution_time,
+             "status": i.result.status.value}
+            for i in executed[:self.config.slowest]
+        ]
+        return report
+
+    def close(self):
+        self._prepare_pool.shutdown(wait=False)
+
+
+# 全局批量执行器实例
+_batch_runner = None
+
+
+def get_batch_runner() -> BatchRunner:
+    """
+    获取全局批量执行器实例
+
+    Returns:
+        BatchRunner: 批量执行器实例
+    """
+    global _batch_runner
+    if _batch_runner is None:
+        _batch_runner = BatchRunner(get_script_executor())
+    return _batch_runner
+
+
+def cleanup_batch_runner():
+    """清理批量执行器资源"""
+    global _batch_runner
+    if _batch_runner:
+        _batch_runner.close()
+        _batch_runner = None
@@ -0,0 +1,166 @@
+"""
+通用缓存组件
+提供带过期时间的内存 LRU 缓存，以及基于 app/redis_client.py 的可选 Redis 缓存层
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+
+class LRUCache:
+    """
+    内存 LRU 缓存，支持 TTL、条目数上限与可选的总大小上限
+    单线程（事件循环）内使用，不加锁
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl: float = 300.0,
+        max_bytes: int = 0,
+        sizeof: Optional[Callable[[Any], int]] = None
+    ):
+        """
+        Args:
+            max_entries (int): 最大条目数
+            ttl (float): 过期时间（秒），0 表示永不过期
+            max_bytes (int): 所有条目估算大小之和的上限，0 表示不限制
+            sizeof (callable): 估算条目大小的函数，设置 max_bytes 时使用
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str, count: bool = True) -> Optional[Any]:
+        """读取缓存，命中时移到最近使用端；过期条目会被删除"""
+        entry = self._data.get(key)
+        if entry is None:
+            if count:
+                self.misses += 1
+            return None
+        value, expires_at, size = entry
+        if expires_at and expires_at < time.time():
+            self._pop(key)
+            self.expirations += 1
+            if count:
+                self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        if count:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """写入缓存，超出上限时淘汰最久未使用的条目"""
+        ttl = self.ttl if ttl is None else ttl
+        size = self.sizeof(value) if self.max_bytes > 0 else 0
+        if self.max_bytes > 0 and size > self.max_bytes:
+            return
+        if key in self._data:
+            self._pop(key)
+        self._data[key] = (value, time.time() + ttl if ttl > 0 else 0, size)
+        self.total_bytes += size
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes > 0 and self.total_bytes > self.max_bytes)
+        ):
+            oldest = next(iter(self._data))
+            self._pop(oldest)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        if key in self._data:
+            self._pop(key)
+
+    def clear(self):
+        self._data.clear()
+        self.total_bytes = 0
+
+    def _pop(self, key: str):
+        _, _, size = self._data.pop(key)
+        self.total_bytes -= size
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class RedisCacheTier:
+    """
+    Redis 缓存层，复用 app/redis_client.py 中的连接
+    redis 不可用时自动停用，调用方继续使用内存缓存；同步客户端调用放到线程中执行，不阻塞事件循环
+    """
+
+    def __init__(self, prefix: str, ttl: float = 300.0):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.client = None
+        self.errors = 0
+        self.hits = 0
+        self.misses = 0
+        try:
+            from app.redis_client import r
+            self.client = r
+        except Exception as e:
+            print(f"[缓存] Redis 不可用，仅使用内存缓存: {e}")
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None
+
+    async def get(self, key: str) -> Optional[str]:
+        if self.client is None:
+            return None
+        try:
+            value = await asyncio.to_thread(self.client.get, self.prefix + key)
+        except Exception as e:
+            self.errors += 1
+            print(f"[缓存] Redis 读取失败: {e}")
+            return None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        if self.client is None:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            await asyncio.to_thread(self.client.set, self.prefix + key, value, ex=int(ttl) if ttl > 0 else None)
+        except Exception as e:
+            self.errors += 1
+            print(f"[缓存] Redis 写入失败: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.available,
+            "prefix": self.prefix,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
@@ -0,0 +1,84 @@
+"""
+脚本结构分析模块
+基于预检阶段 compile() 得到的 AST 一次遍历判断：是否包含 pytest 测试、是否有 __main__ 入口、导入了哪些模块；
+结果随预检结果一起缓存，执行器不再对源码做正则扫描
+"""
+
+import ast
+import re
+from dataclasses import dataclass
+from typing import Tuple
+
+from app.sanitizer import detect_code_language
+
+# 无法解析为 AST 时（直接调用执行器的非法代码）回退到文本匹配，与原判断规则一致
+_PYTEST_TEXT_RE = re.compile(
+    r'^\s*def\s+test_|^\s*class\s+Test|^\s*import\s+pytest|^\s*from\s+pytest\s+import',
+    re.MULTILINE
+)
+
+
+@dataclass(frozen=True)
+class CodeAnalysis:
+    """脚本结构分析结果"""
+    has_pytest_tests: bool
+    has_main_guard: bool
+    imports: Tuple[str, ...]
+    language: str
+    parsed: bool = True
+
+
+def _is_main_guard(node: ast.If) -> bool:
+    """判断是否为 if __name__ == "__main__"（两侧顺序不限）"""
+    test = node.test
+    if not (isinstance(test, ast.Compare) and len(test.ops) == 1 and isinstance(test.ops[0], ast.Eq)):
+        return False
+    sides = (test.left, test.comparators[0])
+    return (any(isinstance(side, ast.Name) and side.id == "__name__" for side in sides)
+            and any(isinstance(side, ast.Constant) and side.value == "__main__" for side in sides))
+
+
+def analyze_tree(tree: ast.AST, code: str) -> CodeAnalysis:
+    """
+    遍历 AST 分析脚本结构
+
+    Args:
+        tree (ast.AST): compile(..., ast.PyCF_ONLY_AST) 得到的语法树
+        code (str): 对应的源码（用于语言检测）
+
+    Returns:
+        CodeAnalysis: 分析结果，imports 为按字母排序的顶层模块名
+    """
+    has_tests = False
+    imports = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            has_tests = has_tests or node.name.startswith("test_")
+        elif isinstance(node, ast.ClassDef):
+            has_tests = has_tests or node.name.startswith("Test")
+        elif isinstance(node, ast.Import):
+            imports.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            imports.add(node.module.split(".")[0])
+    has_main_guard = any(isinstance(node, ast.If) and _is_main_guard(node) for node in getattr(tree, "body", ()))
+    return CodeAnalysis(
+        has_pytest_tests=has_tests or "pytest" in imports,
+        has_main_guard=has_main_guard,
+        imports=tuple(sorted(imports)),
+        language=detect_code_language(code),
+    )
+
+
+def analyze_code(code: str) -> CodeAnalysis:
+    """解析源码并分析结构；存在语法错误时回退到文本匹配判断 pytest 测试"""
+    try:
+        tree = compile(code, "<submitted_code>", "exec", ast.PyCF_ONLY_AST)
+    except (SyntaxError, ValueError):
+        return CodeAnalysis(
+            has_pytest_tests=bool(_PYTEST_TEXT_RE.search(code)),
+            has_main_guard=False,
+            imports=(),
+            language=detect_code_language(code),
+            parsed=False,
+        )
+    return analyze_tree(tree, code)
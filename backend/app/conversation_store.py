@@ -0,0 +1,234 @@
+"""
+会话存储与上下文压缩模块
+按 session_id 在服务端保存 /ai/chat 的对话历史，客户端每次只需发送新增的消息；
+发往上游前对消息做压缩：合并重复的 system 提示、只保留最近若干条消息、按总字符数截断最早的消息，
+被截掉的消息可以交给摘要钩子生成一条摘要，保证上游请求体积有上限；
+会话 ID 只接受服务端生成的 uuid4，每个会话绑定创建时 API Key 的哈希，其他 Key 无法读取、追加或删除
+"""
+
+import hashlib
+import inspect
+import re
+import uuid
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional, Tuple, Union
+
+from app.cache import LRUCache
+from app.settings import env_float, env_int
+
+# 摘要钩子：接收被截掉的消息，返回摘要文本（可以是协程函数，例如调用 LLM 生成摘要）
+Summarizer = Callable[[List[dict]], Union[str, Awaitable[str]]]
+
+SUMMARY_PREFIX = "此前对话摘要："
+
+# new_session_id 生成的格式：uuid4 的 32 位小写十六进制
+_SESSION_ID_RE = re.compile(r'[0-9a-f]{12}4[0-9a-f]{3}[89ab][0-9a-f]{15}')
+
+
+@dataclass
+class ConversationConfig:
+    """会话存储与压缩配置，max_messages / max_chars 为 0 时不限制该项"""
+    ttl: float = 3600.0
+    max_sessions: int = 1000
+    max_messages: int = 40
+    max_chars: int = 32000
+
+    @classmethod
+    def from_env(cls) -> "ConversationConfig":
+        """从环境变量读取配置，未设置时使用默认值"""
+        default = cls()
+        return cls(
+            ttl=env_float("CONVERSATION_TTL", default.ttl),
+            max_sessions=env_int("CONVERSATION_MAX_SESSIONS", default.max_sessions),
+            max_messages=env_int("CONVERSATION_MAX_MESSAGES", default.max_messages),
+            max_chars=env_int("CONVERSATION_MAX_CHARS", default.max_chars),
+        )
+
+
+def message_chars(message: dict) -> int:
+    """消息内容的字符数（兼容 content 为多段列表的格式）"""
+    content = message.get("content") if isinstance(message, dict) else message
+    if isinstance(content, str):
+        return len(content)
+    if isinstance(content, list):
+        return sum(len(part.get("text", "")) if isinstance(part, dict) else len(str(part)) for part in content)
+    return len(str(content or ""))
+
+
+def owner_id(api_key: Optional[str]) -> str:
+    """会话所有者：API Key 的哈希（不保存 Key 本身），未提供 Key 时为 anonymous"""
+    if not api_key:
+        return "anonymous"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def _is_system(message: dict) -> bool:
+    return isinstance(message, dict) and message.get("role") == "system"
+
+
+def dedup_system(messages: List[dict]) -> List[dict]:
+    """去掉与之前内容相同的 system 消息（客户端每轮重复发送的系统提示只保留第一次）"""
+    seen = set()
+    result = []
+    for message in messages:
+        if _is_system(message):
+            key = repr(message.get("content"))
+            if key in seen:
+                continue
+            seen.add(key)
+        result.append(message)
+    return result
+
+
+def split_window(messages: List[dict], max_messages: int, max_chars: int) -> Tuple[List[dict], List[dict]]:
+    """
+    按条数与总字符数截断最早的非 system 消息，system 消息与最后一条消息始终保留
+
+    Returns:
+        Tuple[List[dict], List[dict]]: (保留的消息, 被截掉的消息)，均保持原顺序
+    """
+    conversation = [i for i, message in enumerate(messages) if not _is_system(message)]
+    dropped = set()
+    if max_messages > 0 and len(conversation) > max_messages:
+        dropped.update(conversation[:len(conversation) - max_messages])
+    if max_chars > 0:
+        total = sum(message_chars(message) for i, message in enumerate(messages) if i not in dropped)
+        for i in conversation[:-1]:
+            if total <= max_chars:
+                break
+            if i not in dropped:
+                dropped.add(i)
+                total -= message_chars(messages[i])
+    kept = [message for i, message in enumerate(messages) if i not in dropped]
+    return kept, [messages[i] for i in sorted(dropped)]
+
+
+async def compact_messages(
+    messages: List[dict], config: ConversationConfig, summarizer: Optional[Summarizer] = None
+) -> Tuple[List[dict], int]:
+    """
+    压缩发往上游的消息：去重 system 提示 → 按条数/字符数截断 → 可选的摘要钩子
+    摘要作为一条 system 消息插在保留的对话之前；已有的摘要消息被截掉时会一并交给钩子，实现滚动摘要
+
+    Returns:
+        Tuple[List[dict], int]: (压缩后的消息, 被截掉的消息条数)
+    """
+    messages = dedup_system(messages)
+    kept, dropped = split_window(messages, config.max_messages, config.max_chars)
+    if not dropped or summarizer is None:
+        return kept, len(dropped)
+
+    previous = [m for m in kept if _is_system(m) and str(m.get("content", "")).startswith(SUMMARY_PREFIX)]
+    summary = summarizer(previous + dropped)
+    if inspect.isawaitable(summary):
+        summary = await summary
+    if not summary:
+        return kept, len(dropped)
+    kept = [m for m in kept if not any(m is p for p in previous)]
+    insert_at = next((i for i, m in enumerate(kept) if not _is_system(m)), len(kept))
+    kept.insert(insert_at, {"role": "system", "content": SUMMARY_PREFIX + summary})
+    return kept, len(dropped)
+
+
+class ConversationStore:
+    """
+    内存会话存储（LRU + TTL），保存压缩后的历史，即下一次发往上游的上下文
+    每个会话保存为 (所有者, 消息列表)，读取、追加与删除时按调用方 API Key 的哈希核对所有者
+    需要摘要时给 summarizer 赋值（例如在启动时设置一个调用小模型的协程函数），未设置时被截掉的消息直接丢弃
+    """
+
+    def __init__(self, config: ConversationConfig = None, summarizer: Optional[Summarizer] = None):
+        self.config = config or ConversationConfig.from_env()
+        self.summarizer = summarizer
+        self.sessions = LRUCache(max_entries=self.config.max_sessions, ttl=self.config.ttl)
+        self.compactions = 0
+        self.dropped_messages = 0
+        self.chars_in = 0
+        self.chars_out = 0
+
+    @staticmethod
+    def new_session_id() -> str:
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def valid_session_id(session_id) -> bool:
+        """只接受 new_session_id 生成的格式，客户端不能自选可猜测的会话 ID"""
+        return isinstance(session_id, str) and _SESSION_ID_RE.fullmatch(session_id) is not None
+
+    def accessible(self, session_id: str, api_key: Optional[str] = None) -> bool:
+        """会话不存在（将由该 Key 新建）或属于该 API Key"""
+        entry = self.sessions.get(session_id, count=False)
+        return entry is None or entry[0] == owner_id(api_key)
+
+    def history(self, session_id: str, api_key: Optional[str] = None) -> List[dict]:
+        """会话当前保存的历史，不存在、已过期或不属于该 API Key 时为空"""
+        entry = self.sessions.get(session_id)
+        if entry is None or entry[0] != owner_id(api_key):
+            return []
+        return list(entry[1])
+
+    async def prepare(self, messages: List[dict], session_id: Optional[str] = None,
+                      api_key: Optional[str] = None) -> List[dict]:
+        """
+        拼接会话历史与本次新增的消息并压缩，得到发往上游的消息
+        此时不修改会话，上游调用成功后再由 save 写入，失败的请求重试时不会重复追加
+
+        Args:
+            messages (List[dict]): 本次请求的消息（有会话时为新增部分，无会话时为完整历史）
+            session_id (str): 会话ID
+            api_key (str): 调用方 API Key，只读取属于该 Key 的会话
+        """
+        full = self.history(session_id, api_key) + list(messages) if session_id else list(messages)
+        compacted, dropped = await compact_messages(full, self.config, self.summarizer)
+        chars_in = sum(message_chars(m) for m in full)
+        chars_out = sum(message_chars(m) for m in compacted)
+        self.chars_in += chars_in
+        self.chars_out += chars_out
+        if len(compacted) != len(full):
+            self.compactions += 1
+            self.dropped_messages += dropped
+            print(f"[会话] 压缩上下文: {len(full)} 条 {chars_in} 字符 -> {len(compacted)} 条 {chars_out} 字符")
+        return compacted
+
+    def save(self, session_id: str, messages: List[dict], reply: str, api_key: Optional[str] = None):
+        """上游调用成功后保存会话：本次发往上游的消息加上回复；会话属于其他 API Key 时不写入"""
+        if not self.accessible(session_id, api_key):
+            return
+        self.sessions.set(session_id, (owner_id(api_key), list(messages) + [{"role": "assistant", "content": reply}]))
+
+    def delete(self, session_id: str, api_key: Optional[str] = None) -> bool:
+        """删除属于该 API Key 的会话，会话不存在或属于其他 Key 时返回 False"""
+        entry = self.sessions.get(session_id, count=False)
+        if entry is None or entry[0] != owner_id(api_key):
+            return False
+        self.sessions.delete(session_id)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "sessions": self.sessions.stats(),
+            "max_messages": self.config.max_messages,
+            "max_chars": self.config.max_chars,
+            "summarizer": self.summarizer is not None,
+            "compactions": self.compactions,
+            "dropped_messages": self.dropped_messages,
+            "chars_in": self.chars_in,
+            "chars_out": self.chars_out,
+        }
+
+
+# 全局会话存储实例
+_conversation_store = None
+
+
+def get_conversation_store() -> ConversationStore:
+    """
+    获取全局会话存储实例
+
+    Returns:
+        ConversationStore: 会话存储实例
+    """
+    global _conversation_store
+    if _conversation_store is None:
+        _conversation_store = ConversationStore()
+    return _conversation_store
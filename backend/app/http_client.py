@@ -0,0 +1,84 @@
+"""
+共享异步 HTTP 客户端模块
+整个进程共用一个 httpx.AsyncClient（连接池 + keep-alive，安装 h2 时启用 HTTP/2），
+在应用启动时创建、关闭时释放，调用上游 LLM 接口时不阻塞事件循环
+"""
+
+import importlib.util
+from dataclasses import dataclass
+from typing import Optional
+
+import httpx
+
+from app.settings import env_bool, env_float, env_int
+
+
+def http2_available() -> bool:
+    """是否安装了 HTTP/2 支持（h2 包）"""
+    return importlib.util.find_spec("h2") is not None
+
+
+@dataclass
+class HttpClientConfig:
+    """共享 HTTP 客户端配置"""
+    max_connections: int = 100
+    max_keepalive: int = 20
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 10.0
+    timeout: float = 90.0
+    http2: bool = True
+
+    @classmethod
+    def from_env(cls) -> "HttpClientConfig":
+        """从环境变量读取配置，未设置时使用默认值"""
+        default = cls()
+        return cls(
+            max_connections=env_int("HTTP_MAX_CONNECTIONS", default.max_connections),
+            max_keepalive=env_int("HTTP_MAX_KEEPALIVE", default.max_keepalive),
+            keepalive_expiry=env_float("HTTP_KEEPALIVE_EXPIRY", default.keepalive_expiry),
+            connect_timeout=env_float("HTTP_CONNECT_TIMEOUT", default.connect_timeout),
+            timeout=env_float("HTTP_TIMEOUT", default.timeout),
+            http2=env_bool("HTTP_HTTP2", default.http2),
+        )
+
+
+def create_http_client(config: HttpClientConfig = None) -> httpx.AsyncClient:
+    """按配置创建异步客户端；配置开启 HTTP/2 但未安装 h2 时回退到 HTTP/1.1"""
+    config = config or HttpClientConfig.from_env()
+    return httpx.AsyncClient(
+        http2=config.http2 and http2_available(),
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive,
+            keepalive_expiry=config.keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(config.timeout, connect=config.connect_timeout),
+    )
+
+
+# 全局 HTTP 客户端实例
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    获取全局 HTTP 客户端实例（通常已在启动时创建，未创建时按需创建）
+
+    Returns:
+        httpx.AsyncClient: 共享的异步客户端
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        config = HttpClientConfig.from_env()
+        _http_client = create_http_client(config)
+        print(f"[HTTP客户端] 已创建共享客户端，最大连接数: {config.max_connections}, "
+              f"HTTP/2: {'开启' if config.http2 and http2_available() else '关闭'}")
+    return _http_client
+
+
+async def cleanup_http_client():
+    """关闭全局 HTTP 客户端，释放连接池"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
@@ -0,0 +1,104 @@
+"""
+脚本导入统计模块
+按预检 AST 分析得到的导入模块，统计最近若干次提交中各顶层模块的出现次数，
+供预热工作进程池选择预导入的模块（自适应预加载）。
+候选只限标准库与显式允许的模块，是否可导入按工作进程的 sys.path 判断
+"""
+
+import importlib.machinery
+import sys
+from collections import Counter, deque
+from typing import Dict, Iterable, List, Optional
+
+# 导入时有副作用（打开浏览器、打印内容）的模块，不作为预导入候选
+PRELOAD_DENYLIST = frozenset({"antigravity", "this", "__hello__", "__phello__", "__main__"})
+
+
+class ImportStats:
+    """
+    最近 window 次提交的顶层模块导入计数（滑动窗口）
+
+    Attributes:
+        allow (frozenset): 除标准库外允许作为预导入候选的模块（例如 requests、numpy）
+        search_path (List[str]): 判断是否可导入时使用的模块搜索路径（工作进程的 sys.path），
+            为 None 时使用当前进程的 sys.path
+    """
+
+    def __init__(self, window: int = 500, allow: Iterable[str] = (), search_path: Optional[List[str]] = None):
+        self.window = max(1, window)
+        self.allow = frozenset(allow)
+        self.search_path = search_path
+        self._recent: deque = deque()
+        self.counts: Counter = Counter()
+        self.recorded = 0
+        self._installed: Dict[str, bool] = {}
+
+    def record(self, modules: Iterable[str]):
+        """记录一次提交导入的模块（同一次提交中重复的模块只计一次）"""
+        modules = frozenset(modules)
+        self._recent.append(modules)
+        self.counts.update(modules)
+        self.recorded += 1
+        if len(self._recent) > self.window:
+            for name in self._recent.popleft():
+                self.counts[name] -= 1
+                if self.counts[name] <= 0:
+                    del self.counts[name]
+
+    def set_search_path(self, search_path: List[str]):
+        """更新模块搜索路径（工作进程就绪时上报），路径变化时清空可导入缓存"""
+        search_path = list(search_path)
+        if search_path != self.search_path:
+            self.search_path = search_path
+            self._installed.clear()
+
+    def candidate(self, name: str) -> bool:
+        """模块是否可作为预导入候选：标准库或显式允许，且不在禁用列表中"""
+        if name in PRELOAD_DENYLIST:
+            return False
+        return name in sys.stdlib_module_names or name in self.allow
+
+    def installed(self, name: str) -> bool:
+        """
+        模块在搜索路径上是否可导入（只查找不导入，结果缓存）
+        不使用 importlib.util.find_spec：服务进程的 sys.path 包含 backend/，
+        main、app 等服务端模块在工作进程中并不可导入
+        """
+        if name not in self._installed:
+            if name in sys.builtin_module_names:
+                self._installed[name] = True
+            else:
+                try:
+                    spec = importlib.machinery.PathFinder.find_spec(name, self.search_path)
+                    self._installed[name] = spec is not None
+                except (ImportError, ValueError):
+                    self._installed[name] = False
+        return self._installed[name]
+
+    def top(self, limit: int, min_share: float = 0.0) -> List[str]:
+        """
+        出现比例不低于 min_share 的可导入候选模块，按出现次数从高到低取前 limit 个
+
+        Args:
+            limit (int): 最多返回的模块数
+            min_share (float): 在窗口内提交中的最低出现比例
+        """
+        if limit <= 0 or not self._recent:
+            return []
+        threshold = min_share * len(self._recent)
+        result = []
+        for name, count in self.counts.most_common():
+            if count < threshold or len(result) >= limit:
+                break
+            if self.candidate(name) and self.installed(name):
+                result.append(name)
+        return result
+
+    def stats(self, limit: int = 10) -> dict:
+        return {
+            "window": self.window,
+            "submissions": len(self._recent),
+            "recorded": self.recorded,
+            "allow": sorted(self.allow),
+            "top": dict(self.counts.most_common(limit)),
+        }
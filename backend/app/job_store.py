@@ -0,0 +1,185 @@
+"""
+异步执行任务模块
+提交后立即返回任务ID，后台通过 ScriptExecutor 执行；客户端轮询状态或取消任务，
+已结束任务的结果保存在有界、带过期时间的存储中
+"""
+
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from app.admission import AdmissionRejected
+from app.cache import LRUCache
+from app.script_executor import ExecutionResult, ExecutionStatus, ScriptExecutor, get_script_executor
+from app.settings import env_float, env_int
+
+
+@dataclass
+class JobStoreConfig:
+    """任务存储配置"""
+    max_active: int = 256
+    max_finished: int = 1024
+    result_ttl: float = 600.0
+
+    @classmethod
+    def from_env(cls) -> "JobStoreConfig":
+        """从环境变量读取配置，未设置时使用默认值"""
+        default = cls()
+        return cls(
+            max_active=env_int("SCRIPT_JOBS_MAX_ACTIVE", default.max_active),
+            max_finished=env_int("SCRIPT_JOBS_MAX_FINISHED", default.max_finished),
+            result_ttl=env_float("SCRIPT_JOBS_RESULT_TTL", default.result_ttl),
+        )
+
+
+@dataclass
+class Job:
+    """执行任务"""
+    job_id: str
+    runner: str
+    timeout: int
+    status: ExecutionStatus = ExecutionStatus.PENDING
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    result: Optional[ExecutionResult] = None
+    error_message: Optional[str] = None
+    error_code: Optional[int] = None
+    task: Optional[asyncio.Task] = None
+
+
+class JobManager:
+    """异步执行任务管理器"""
+
+    def __init__(self, executor: ScriptExecutor, config: JobStoreConfig = None):
+        self.executor = executor
+        self.config = config or JobStoreConfig.from_env()
+        self.active: Dict[str, Job] = {}
+        self.finished = LRUCache(max_entries=self.config.max_finished, ttl=self.config.result_ttl)
+        self.submitted = 0
+        self.cancelled = 0
+
+    def submit(
+        self,
+        code: str,
+        runner: str = "python",
+        timeout: int = 30,
+        client_id: Optional[str] = None,
+        use_cache: bool = True,
+        shards: Optional[int] = None
+    ) -> Job:
+        """
+        提交任务并在后台执行
+
+        Raises:
+            AdmissionRejected: 进行中的任务数已达上限
+        """
+        if len(self.active) >= self.config.max_active:
+            raise AdmissionRejected(503, "服务繁忙，进行中的任务过多", "too_many_jobs")
+        job = Job(job_id=uuid.uuid4().hex, runner=runner, timeout=timeout)
+        job.task = asyncio.get_running_loop().create_task(self._run(job, code, client_id, use_cache, shards))
+        self.active[job.job_id] = job
+        self.submitted += 1
+        print(f"[任务管理] 已提交任务: {job.job_id}, Runner: {runner}")
+        return job
+
+    async def _run(self, job: Job, code: str, client_id: Optional[str], use_cache: bool, shards: Optional[int]):
+        try:
+            result = await self.executor.execute_script_async(
+                code=code,
+                runner=job.runner,
+                timeout=job.timeout,
+                client_id=client_id,
+                use_cache=use_cache,
+                execution_id=job.job_id,
+                shards=shards
+            )
+            job.result = result
+            job.status = result.status
+        except AdmissionRejected as e:
+            job.status = ExecutionStatus.ERROR
+            job.error_code = e.code
+            job.error_message = e.msg
+        except asyncio.CancelledError:
+            job.status = ExecutionStatus.CANCELLED
+            job.error_message = "执行已取消"
+        except Exception as e:
+            job.status = ExecutionStatus.ERROR
+            job.error_message = f"执行异常: {str(e)}"
+        finally:
+            job.finished_at = time.time()
+            job.task = None
+            self.active.pop(job.job_id, None)
+            self.finished.set(job.job_id, job)
+            print(f"[任务管理] 任务结束: {job.job_id}, 状态: {job.status.value}")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """查询任务，排队中的任务在进程启动后显示为 RUNNING"""
+        job = self.active.get(job_id)
+        if job is None:
+            return self.finished.get(job_id)
+        if job.status == ExecutionStatus.PENDING and job_id in self.executor.running_processes:
+            job.status = ExecutionStatus.RUNNING
+        return job
+
+    async def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        取消任务：运行中的任务通过执行器终止进程，排队中的任务直接取消
+
+        Returns:
+            Job: 任务不存在时返回 None
+        """
+        job = self.active.get(job_id)
+        if job is None:
+            return self.finished.get(job_id)
+        self.cancelled += 1
+        if not await self.executor.cancel_execution(job_id) and job.task is not None:
+            job.task.cancel()
+        task = job.task
+        if task is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(task), timeout=10)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+        return job
+
+    def cancel_all(self):
+        """取消所有进行中的任务（同步，可在 shutdown 钩子中调用）"""
+        for job in list(self.active.values()):
+            if job.task is not None:
+                job.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self.active),
+            "max_active": self.config.max_active,
+            "finished": len(self.finished),
+            "submitted": self.submitted,
+            "cancelled": self.cancelled,
+        }
+
+
+# 全局任务管理器实例
+_job_manager = None
+
+
+def get_job_manager() -> JobManager:
+    """
+    获取全局任务管理器实例
+
+    Returns:
+        JobManager: 任务管理器实例
+    """
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = JobManager(get_script_executor())
+    return _job_manager
+
+
+def cleanup_job_manager():
+    """清理任务管理器资源"""
+    global _job_manager
+    if _job_manager:
+        _job_manager.cancel_all()
+        _job_manager = None
@@ -0,0 +1,200 @@
+"""
+LLM 响应缓存模块
+按规范化后的 (model, messages) 哈希缓存 /ai/chat 的生成内容：内存 LRU（TTL + 总大小上限）为一级缓存，
+可选 Redis 为二级缓存；相同请求并发到达时只发起一次上游调用，其余请求等待同一结果（single-flight）
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.cache import LRUCache, RedisCacheTier
+from app.settings import env_bool, env_float, env_int
+
+# 词间连续空白（保留行首缩进，消息中的代码缩进不受影响）与行尾空白
+_INLINE_SPACE_RE = re.compile(r'(?<=\S)[ \t]+(?=\S)')
+_TRAILING_SPACE_RE = re.compile(r'[ \t]+\n')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+
+@dataclass
+class LLMCacheConfig:
+    """LLM 响应缓存配置"""
+    enabled: bool = True
+    ttl: float = 3600.0
+    max_entries: int = 512
+    max_bytes: int = 32 * 1024 * 1024
+    redis: bool = False
+
+    @classmethod
+    def from_env(cls) -> "LLMCacheConfig":
+        """从环境变量读取配置，未设置时使用默认值"""
+        default = cls()
+        return cls(
+            enabled=env_bool("LLM_CACHE", default.enabled),
+            ttl=env_float("LLM_CACHE_TTL", default.ttl),
+            max_entries=env_int("LLM_CACHE_SIZE", default.max_entries),
+            max_bytes=env_int("LLM_CACHE_MAX_BYTES", default.max_bytes),
+            redis=env_bool("LLM_CACHE_REDIS", default.redis),
+        )
+
+
+def normalize_text(text: str) -> str:
+    """
+    规范化消息文本：NFKC（全角字母数字与符号转半角）、统一换行、
+    合并词间连续空白、去掉行尾空白与多余空行、去掉首尾空白
+    只影响排版，不改变内容语义，同一需求文本的不同粘贴方式得到相同的缓存键
+    """
+    text = unicodedata.normalize("NFKC", text).replace("\r\n", "\n").replace("\r", "\n")
+    text = _INLINE_SPACE_RE.sub(" ", text)
+    text = _TRAILING_SPACE_RE.sub("\n", text)
+    text = _BLANK_LINES_RE.sub("\n\n", text)
+    return text.strip()
+
+
+def _normalize(value: Any) -> Any:
+    """递归规范化消息结构中的文本（兼容 content 为多段列表的格式）"""
+    if isinstance(value, str):
+        return normalize_text(value)
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    return value
+
+
+def llm_cache_key(model: str, messages: list) -> str:
+    """计算规范化后的 (model, messages) 哈希"""
+    normalized = {
+        "model": model.strip(),
+        "messages": [
+            {**_normalize(message), "role": str(message.get("role", "")).strip().lower()}
+            if isinstance(message, dict) else _normalize(message)
+            for message in messages
+        ],
+    }
+    payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """LLM 响应缓存与并发请求合并"""
+
+    def __init__(self, config: LLMCacheConfig = None):
+        self.config = config or LLMCacheConfig.from_env()
+        self.memory = LRUCache(
+            max_entries=self.config.max_entries,
+            ttl=self.config.ttl,
+            max_bytes=self.config.max_bytes,
+            sizeof=lambda content: len(content.encode("utf-8", errors="replace")),
+        )
+        self.redis = RedisCacheTier("llm-chat:", ttl=self.config.ttl) if self.config.redis else None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.bypassed = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        """读取缓存（内存优先，Redis 命中时回填内存）"""
+        if not self.config.enabled:
+            return None
+        content = self.memory.get(key)
+        if content is None and self.redis is not None:
+            content = await self.redis.get(key)
+            if content is not None:
+                self.memory.set(key, content)
+        return content
+
+    async def set(self, key: str, content: str):
+        """写入缓存，空内容不缓存"""
+        if not self.config.enabled or not content:
+            return
+        self.memory.set(key, content)
+        if self.redis is not None:
+            await self.redis.set(key, content)
+
+    async def get_or_fetch(
+        self, key: str, fetch: Callable[[], Awaitable[str]], bypass: bool = False
+    ) -> Tuple[str, str]:
+        """
+        读取缓存，未命中时调用上游；同一键已有进行中的上游调用时等待其结果
+
+        Args:
+            key (str): llm_cache_key 计算的缓存键
+            fetch (callable): 发起上游调用的协程函数
+            bypass (bool): 为 True 时不读缓存、不合并请求，直接调用上游并用新结果刷新缓存
+
+        Returns:
+            Tuple[str, str]: (内容, 来源) 来源为 hit / miss / coalesced / bypass / disabled
+
+        Raises:
+            UpstreamError: 上游调用失败（合并的请求收到同一异常）
+        """
+        if not self.config.enabled:
+            return await fetch(), "disabled"
+        if bypass:
+            self.bypassed += 1
+            self.upstream_calls += 1
+            content = await fetch()
+            await self.set(key, content)
+            return content, "bypass"
+
+        content = await self.get(key)
+        if content is not None:
+            return content, "hit"
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), "coalesced"
+
+        # 上游调用放在独立任务中：发起请求的客户端断开时，等待同一结果的其他请求不受影响
+        task = asyncio.ensure_future(self._fetch_and_store(key, fetch))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task), "miss"
+
+    async def _fetch_and_store(self, key: str, fetch: Callable[[], Awaitable[str]]) -> str:
+        self.upstream_calls += 1
+        content = await fetch()
+        await self.set(key, content)
+        return content
+
+    def _finish(self, key: str, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 所有等待方都已断开时，避免出现“异常未被获取”的警告
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.config.enabled,
+            "memory": self.memory.stats(),
+            "redis": self.redis.stats() if self.redis is not None else {"enabled": False},
+            "inflight": len(self._inflight),
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+        }
+
+
+# 全局 LLM 响应缓存实例
+_llm_cache = None
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """
+    获取全局 LLM 响应缓存实例
+
+    Returns:
+        LLMResponseCache: LLM 响应缓存实例
+    """
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMResponseCache()
+    return _llm_cache
@@ -0,0 +1,270 @@
+"""
+上游 LLM 调用模块
+封装 OpenAI 兼容接口（OpenRouter / Ollama / 其他兼容服务）的完整响应与流式响应两种调用方式，
+以及上游错误到接口状态码的统一映射；流式调用记录首个 token 的到达时间（TTFB）
+未指定提供方时调用 OpenRouter（使用共享 HTTP 客户端），提供方选择与故障转移见 llm_router
+"""
+
+import json
+import time
+from collections import deque
+from typing import AsyncIterator, List, Optional
+
+import httpx
+
+from app.http_client import get_http_client
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+
+class UpstreamError(Exception):
+    """上游调用失败，code 为 /ai/chat 返回的 HTTP 状态码"""
+
+    def __init__(self, code: int, msg: str):
+        super().__init__(msg)
+        self.code = code
+        self.msg = msg
+
+
+def build_request(api_key: str, model: str, messages: list, stream: bool = False) -> tuple:
+    """构造请求，返回 (url, headers, data)"""
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "http://localhost",
+        "X-Title": "FIRST_MIX"
+    }
+    data = {
+        "model": model,
+        "messages": messages,
+    }
+    if stream:
+        data["stream"] = True
+    return OPENROUTER_URL, headers, data
+
+
+def status_error(status_code: int, body: bytes, label: str = "OpenRouter") -> UpstreamError:
+    """把上游的非 200 响应映射为 UpstreamError，label 为错误信息中的提供方名称"""
+    if status_code == 401:
+        return UpstreamError(401, "API Key 无效或已过期，请检查后重试")
+    if status_code == 403:
+        return UpstreamError(403, "API Key 权限不足或余额不足")
+    if status_code == 429:
+        return UpstreamError(429, "请求过于频繁，请稍后重试")
+    text = body.decode("utf-8", errors="replace")
+    try:
+        error_msg = json.loads(text).get('error', {}).get('message', text)
+    except Exception:
+        error_msg = text
+    return UpstreamError(status_code, f"{label}错误: {error_msg}")
+
+
+def transport_error(e: httpx.HTTPError) -> UpstreamError:
+    """把网络层异常映射为 UpstreamError"""
+    if isinstance(e, httpx.TimeoutException):
+        return UpstreamError(408, "请求超时，请检查网络连接")
+    if isinstance(e, (httpx.NetworkError, httpx.ProxyError)):
+        return UpstreamError(503, "网络连接失败，请检查网络或代理设置")
+    return UpstreamError(500, f"网络请求异常: {str(e)}")
+
+
+def extract_content(response_json: dict, label: str = "OpenRouter") -> str:
+    """从完整响应中安全地提取内容"""
+    if 'choices' not in response_json or not response_json['choices']:
+        raise UpstreamError(500, f"{label}响应格式异常：缺少choices")
+    choice = response_json['choices'][0]
+    if 'message' not in choice or 'content' not in choice['message']:
+        raise UpstreamError(500, f"{label}响应格式异常：缺少message内容")
+    return choice['message']['content']
+
+
+def describe_request(data: dict) -> str:
+    """请求体摘要（模型、消息条数与字符数），日志中不再打印完整的对话内容"""
+    messages = data.get("messages") or []
+    chars = sum(len(m.get("content") or "") if isinstance(m, dict) and isinstance(m.get("content"), str) else 0
+                for m in messages)
+    return f"model={data.get('model')}, messages={len(messages)}, chars={chars}"
+
+
+def _target(provider, api_key: str, model: str, messages: list, stream: bool) -> tuple:
+    """返回 (提供方名称, HTTP 客户端, url, headers, data)；provider 为 None 时调用 OpenRouter"""
+    if provider is None:
+        return ("OpenRouter", get_http_client()) + build_request(api_key, model, messages, stream=stream)
+    return (provider.label, provider.client()) + provider.build_request(api_key, model, messages, stream=stream)
+
+
+async def complete(api_key: Optional[str], model: str, messages: list, provider=None) -> str:
+    """
+    调用上游并等待完整响应
+
+    Args:
+        provider (Provider): llm_router 中的提供方，默认为 OpenRouter
+
+    Raises:
+        UpstreamError: 上游返回错误、网络异常或响应格式异常
+    """
+    label, client, url, headers, data = _target(provider, api_key, model, messages, stream=False)
+    print(f"发送到{label}: {describe_request(data)}")
+    if api_key:
+        print(f"使用API Key: {api_key[:20]}...")
+
+    # 连接池客户端：复用连接，等待上游响应时不阻塞事件循环
+    request_start = time.time()
+    try:
+        response = await client.post(url, headers=headers, json=data)
+    except httpx.HTTPError as e:
+        raise transport_error(e) from e
+
+    print(f"{label}响应状态: {response.status_code}")
+    print(f"响应时间: {time.time() - request_start:.2f}秒")
+    if response.status_code != 200:
+        raise status_error(response.status_code, response.content, label)
+
+    try:
+        response_json = response.json()
+    except ValueError:
+        raise UpstreamError(500, f"{label}响应格式异常：无法解析JSON")
+    content = extract_content(response_json, label)
+    print(f"{label}响应内容长度: {len(content or '')}")
+    return content
+
+
+class StreamMetrics:
+    """流式调用指标：最近 window 次请求的首 token 时间与总耗时；failed 包含上游出错与客户端中途断开"""
+
+    def __init__(self, window: int = 256):
+        self.ttfb = deque(maxlen=window)
+        self.durations = deque(maxlen=window)
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+
+    @staticmethod
+    def _summary(samples) -> dict:
+        if not samples:
+            return {"count": 0, "avg": None, "p50": None, "p95": None, "max": None}
+        ordered = sorted(samples)
+        return {
+            "count": len(ordered),
+            "avg": sum(ordered) / len(ordered),
+            "p50": ordered[len(ordered) // 2],
+            "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            "max": ordered[-1],
+        }
+
+    def stats(self) -> dict:
+        return {
+            "started": self.started,
+            "completed": self.completed,
+            "failed": self.failed,
+            "ttfb": self._summary(self.ttfb),
+            "duration": self._summary(self.durations),
+        }
+
+
+stream_metrics = StreamMetrics()
+
+
+def _delta_content(event: dict, label: str = "OpenRouter") -> Optional[str]:
+    """从一条流式事件中取出增量内容；上游在流中报告错误时抛出 UpstreamError"""
+    if event.get("error"):
+        error = event["error"]
+        message = error.get("message", str(error)) if isinstance(error, dict) else str(error)
+        code = error.get("code") if isinstance(error, dict) else None
+        raise UpstreamError(code if isinstance(code, int) else 500, f"{label}错误: {message}")
+    choices = event.get("choices") or []
+    if not choices:
+        return None
+    return (choices[0].get("delta") or {}).get("content")
+
+
+class ChatStream:
+    """
+    已建立的上游流式响应
+    open_stream 在返回前等待上游响应头，状态码错误仍可按普通 JSON 响应返回；
+    之后通过 deltas() 逐段读取内容
+    """
+
+    def __init__(self, response: httpx.Response, started_at: float, label: str = "OpenRouter"):
+        self.response = response
+        self.started_at = started_at
+        self.label = label
+        self.ttfb: Optional[float] = None
+        self.content: List[str] = []
+
+    async def deltas(self) -> AsyncIterator[str]:
+        """
+        逐段产出上游生成的内容，结束或中途退出时关闭上游连接
+
+        Raises:
+            UpstreamError: 上游在流中报告错误、网络异常或响应格式异常
+        """
+        completed = False
+        try:
+            async for line in self.response.aiter_lines():
+                # SSE：忽略注释行（上游的保活消息）与空行
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == "[DONE]":
+                    break
+                try:
+                    event = json.loads(payload)
+                except ValueError:
+                    raise UpstreamError(500, f"{self.label}响应格式异常：无法解析流式数据")
+                content = _delta_content(event, self.label)
+                if not content:
+                    continue
+                if self.ttfb is None:
+                    self.ttfb = time.time() - self.started_at
+                    stream_metrics.ttfb.append(self.ttfb)
+                    print(f"[AI流式] 首个token耗时: {self.ttfb:.2f}秒")
+                self.content.append(content)
+                yield content
+            completed = True
+        except httpx.HTTPError as e:
+            raise transport_error(e) from e
+        finally:
+            await self.response.aclose()
+            duration = time.time() - self.started_at
+            if completed:
+                stream_metrics.completed += 1
+                stream_metrics.durations.append(duration)
+            else:
+                stream_metrics.failed += 1
+            print(f"[AI流式] 流式响应结束，耗时: {duration:.2f}秒, 内容长度: {len(''.join(self.content))}")
+
+
+async def open_stream(
+    api_key: Optional[str], model: str, messages: list, started_at: Optional[float] = None, provider=None
+) -> ChatStream:
+    """
+    以流式方式调用上游，等待响应头后返回
+
+    Args:
+        started_at (float): 计算 TTFB 的起点（通常为收到请求的时间），默认为调用时刻
+        provider (Provider): llm_router 中的提供方，默认为 OpenRouter
+
+    Raises:
+        UpstreamError: 上游返回非 200 状态码或网络异常
+    """
+    label, client, url, headers, data = _target(provider, api_key, model, messages, stream=True)
+    print(f"发送到{label}(流式): {describe_request(data)}")
+    started_at = started_at or time.time()
+    stream_metrics.started += 1
+    try:
+        response = await client.send(client.build_request("POST", url, headers=headers, json=data), stream=True)
+    except httpx.HTTPError as e:
+        stream_metrics.failed += 1
+        raise transport_error(e) from e
+    print(f"{label}响应状态: {response.status_code}")
+    if response.status_code != 200:
+        try:
+            body = await response.aread()
+        except httpx.HTTPError:
+            body = b""
+        finally:
+            await response.aclose()
+        stream_metrics.failed += 1
+        raise status_error(response.status_code, body, label)
+    return ChatStream(response, started_at, label)
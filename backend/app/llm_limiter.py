@@ -0,0 +1,353 @@
+"""
+上游 LLM 调用限流模块
+在调用上游前按 API Key 与模型两个维度做令牌桶限流（每分钟请求数 + 每分钟 token 数），
+token 数由 messages 估算；额度不足的请求按优先级排队等待而不是直接返回 429，
+突发请求被平滑到上游的速率限制之内，队列已满或排队超时时才拒绝
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from app.sanitizer import count_cjk
+from app.settings import env_bool, env_float, env_int
+
+# 优先级：数值越小越先放行，未知取值按 normal 处理
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+# 每条消息的格式开销（role、分隔符）
+_MESSAGE_OVERHEAD = 4
+
+
+class LLMRateLimited(Exception):
+    """上游调用限流排队失败，code 为 /ai/chat 返回的 HTTP 状态码"""
+
+    def __init__(self, code: int, msg: str, reason: str):
+        super().__init__(msg)
+        self.code = code
+        self.msg = msg
+        self.reason = reason
+
+
+@dataclass
+class LLMLimiterConfig:
+    """上游调用限流配置，各项额度为 0 时不限制该维度"""
+    enabled: bool = True
+    key_rpm: int = 20
+    key_tpm: int = 40000
+    model_rpm: int = 60
+    model_tpm: int = 200000
+    completion_tokens: int = 512
+    max_queue: int = 64
+    queue_timeout: float = 30.0
+
+    @classmethod
+    def from_env(cls) -> "LLMLimiterConfig":
+        """从环境变量读取配置，未设置时使用默认值"""
+        default = cls()
+        return cls(
+            enabled=env_bool("LLM_RATE_LIMIT", default.enabled),
+            key_rpm=env_int("LLM_RATE_KEY_RPM", default.key_rpm),
+            key_tpm=env_int("LLM_RATE_KEY_TPM", default.key_tpm),
+            model_rpm=env_int("LLM_RATE_MODEL_RPM", default.model_rpm),
+            model_tpm=env_int("LLM_RATE_MODEL_TPM", default.model_tpm),
+            completion_tokens=env_int("LLM_RATE_COMPLETION_TOKENS", default.completion_tokens),
+            max_queue=env_int("LLM_RATE_MAX_QUEUE", default.max_queue),
+            queue_timeout=env_float("LLM_RATE_QUEUE_TIMEOUT", default.queue_timeout),
+        )
+
+
+def estimate_text_tokens(text: str) -> int:
+    """估算文本 token 数：汉字约 1 个/字，其他字符约 4 个/token"""
+    if not text:
+        return 0
+    cjk = count_cjk(text)
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_tokens(messages: list) -> int:
+    """估算 messages 的输入 token 数（兼容 content 为多段列表的格式）"""
+    total = 0
+    for message in messages:
+        total += _MESSAGE_OVERHEAD
+        content = message.get("content") if isinstance(message, dict) else message
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+        total += estimate_text_tokens(content if isinstance(content, str) else str(content or ""))
+    return total
+
+
+class TokenBucket:
+    """令牌桶：容量为每分钟额度（允许的突发量），按每秒 capacity / 60 匀速补充"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """距离可以扣除 amount 还需等待的秒数；超过容量的请求只需等到桶满（之后以欠额形式扣除）"""
+        self._refill(now)
+        need = min(amount, self.capacity)
+        return 0.0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+    def consume(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= amount
+
+    def refund(self, amount: float):
+        """按实际用量修正预扣额度（amount 为负时补扣）"""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+@dataclass
+class RateGrant:
+    """已放行的上游调用：预扣的令牌桶与 token 数，调用结束后用 settle 按实际输出修正"""
+    buckets: Tuple[TokenBucket, ...]
+    tokens: int
+    completion_tokens: int
+    wait: float
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "needs", "future", "enqueued_at")
+
+    def __init__(self, priority: int, seq: int, needs: list, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.needs = needs
+        self.future = future
+        self.enqueued_at = time.time()
+
+
+class LLMRateLimiter:
+    """按 API Key 与模型的令牌桶限流，额度不足时按优先级排队"""
+
+    # 令牌桶数量超过该值时清理已补满（空闲）的桶
+    MAX_IDLE_BUCKETS = 1024
+
+    def __init__(self, config: LLMLimiterConfig = None):
+        self.config = config or LLMLimiterConfig.from_env()
+        self.buckets: Dict[Tuple[str, str, str], TokenBucket] = {}
+        self._queue: List[_Waiter] = []
+        self._seq = 0
+        self.waits = deque(maxlen=256)
+        self.admitted = 0
+        self.delayed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @staticmethod
+    def key_id(api_key: Optional[str]) -> str:
+        """统计与桶名中只保留 API Key 的哈希前缀"""
+        if not api_key:
+            return "anonymous"
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+    def _bucket(self, scope: str, name: str, unit: str, per_minute: int) -> TokenBucket:
+        key = (scope, name, unit)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.MAX_IDLE_BUCKETS:
+                self._prune()
+            bucket = self.buckets[key] = TokenBucket(per_minute)
+        return bucket
+
+    def _prune(self):
+        now = time.monotonic()
+        for key, bucket in list(self.buckets.items()):
+            if bucket.wait_time(bucket.capacity, now) == 0.0:
+                del self.buckets[key]
+
+    def _needs(self, api_key: Optional[str], model: str, tokens: int) -> List[Tuple[TokenBucket, int]]:
+        """本次调用需要扣除的 (令牌桶, 数量)"""
+        key_id = self.key_id(api_key)
+        limits = (
+            ("key", key_id, "requests", self.config.key_rpm, 1),
+            ("model", model, "requests", self.config.model_rpm, 1),
+            ("key", key_id, "tokens", self.config.key_tpm, tokens),
+            ("model", model, "tokens", self.config.model_tpm, tokens),
+        )
+        return [(self._bucket(scope, name, unit, per_minute), amount)
+                for scope, name, unit, per_minute, amount in limits if per_minute > 0]
+
+    @staticmethod
+    def _wait_time(needs, now: float) -> float:
+        return max((bucket.wait_time(amount, now) for bucket, amount in needs), default=0.0)
+
+    @staticmethod
+    def _consume(needs, now: float):
+        for bucket, amount in needs:
+            bucket.consume(amount, now)
+
+    def _dispatch(self) -> Optional[float]:
+        """
+        按优先级（同级按到达顺序）放行额度足够的排队请求
+        前面的请求因某个桶额度不足而等待时，后面使用同一个桶的请求不会插队，使用其他桶的请求照常放行
+
+        Returns:
+            Optional[float]: 最早的等待请求还需等待的秒数，没有等待请求时为 None
+        """
+        now = time.monotonic()
+        blocked = set()
+        next_delay = None
+        for waiter in list(self._queue):
+            if waiter.future.done():
+                self._remove(waiter)
+                continue
+            ids = {id(bucket) for bucket, _ in waiter.needs}
+            if blocked & ids:
+                continue
+            wait = self._wait_time(waiter.needs, now)
+            if wait <= 0:
+                self._consume(waiter.needs, now)
+                self._remove(waiter)
+                waiter.future.set_result(True)
+            else:
+                blocked |= ids
+                next_delay = wait if next_delay is None else min(next_delay, wait)
+        return next_delay
+
+    def _remove(self, waiter: _Waiter):
+        try:
+            self._queue.remove(waiter)
+        except ValueError:
+            pass
+
+    def _record(self, wait: float):
+        self.admitted += 1
+        self.waits.append(wait)
+        if wait > 0:
+            self.delayed += 1
+
+    async def acquire(
+        self, api_key: Optional[str], model: str, prompt_tokens: int, priority: str = "normal"
+    ) -> RateGrant:
+        """
+        申请一次上游调用额度，预扣输入 token 与预留的输出 token
+
+        Args:
+            api_key (str): 上游 API Key，为空时归入匿名
+            model (str): 模型名
+            prompt_tokens (int): 估算的输入 token 数（见 estimate_tokens）
+            priority (str): high / normal / low
+
+        Returns:
+            RateGrant: 放行记录，wait 为排队等待时间（秒）
+
+        Raises:
+            LLMRateLimited: 排队已满或排队超时（429）
+        """
+        tokens = prompt_tokens + self.config.completion_tokens
+        if not self.config.enabled:
+            return RateGrant((), tokens, self.config.completion_tokens, 0.0)
+
+        needs = self._needs(api_key, model, tokens)
+        token_keys = (("key", self.key_id(api_key), "tokens"), ("model", model, "tokens"))
+        grant = RateGrant(tuple(self.buckets[key] for key in token_keys if key in self.buckets),
+                          tokens, self.config.completion_tokens, 0.0)
+        now = time.monotonic()
+        if not self._queue and self._wait_time(needs, now) <= 0:
+            self._consume(needs, now)
+            self._record(0.0)
+            return grant
+
+        if len(self._queue) >= self.config.max_queue:
+            self.rejected += 1
+            raise LLMRateLimited(429, "请求过于频繁，上游调用排队已满", "queue_full")
+
+        self._seq += 1
+        waiter = _Waiter(PRIORITIES.get(priority, PRIORITIES["normal"]), self._seq, needs,
+                         asyncio.get_running_loop().create_future())
+        self._queue.append(waiter)
+        self._queue.sort(key=lambda w: (w.priority, w.seq))
+        deadline = time.monotonic() + self.config.queue_timeout
+        try:
+            while not waiter.future.done():
+                delay = self._dispatch()
+                if waiter.future.done():
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    waiter.future.cancel()
+                    self._remove(waiter)
+                    self.timed_out += 1
+                    raise LLMRateLimited(429, f"上游调用排队超时 ({self.config.queue_timeout:g}秒)", "queue_timeout")
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future),
+                                           timeout=min(remaining, delay) if delay is not None else remaining)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if not waiter.future.done():
+                waiter.future.cancel()
+            self._remove(waiter)
+            raise
+
+        grant.wait = time.time() - waiter.enqueued_at
+        self._record(grant.wait)
+        return grant
+
+    def settle(self, grant: RateGrant, completion: str):
+        """按实际输出内容修正预留的输出 token，退回的额度可立即放行排队请求"""
+        difference = grant.completion_tokens - estimate_text_tokens(completion or "")
+        if not difference or not grant.buckets:
+            return
+        for bucket in grant.buckets:
+            bucket.refund(difference)
+        if self._queue:
+            self._dispatch()
+
+    def stats(self) -> dict:
+        waits = sorted(self.waits)
+        queued_by_priority = {name: 0 for name in PRIORITIES}
+        names = {value: name for name, value in PRIORITIES.items()}
+        for waiter in self._queue:
+            queued_by_priority[names[waiter.priority]] += 1
+        return {
+            "enabled": self.config.enabled,
+            "limits": {
+                "key_rpm": self.config.key_rpm,
+                "key_tpm": self.config.key_tpm,
+                "model_rpm": self.config.model_rpm,
+                "model_tpm": self.config.model_tpm,
+            },
+            "queued": len(self._queue),
+            "queued_by_priority": queued_by_priority,
+            "max_queue": self.config.max_queue,
+            "admitted": self.admitted,
+            "delayed": self.delayed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait": {
+                "avg": sum(waits) / len(waits) if waits else 0.0,
+                "p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                "max": waits[-1] if waits else 0.0,
+            },
+            "buckets": len(self.buckets),
+        }
+
+
+# 全局上游调用限流实例
+_llm_limiter = None
+
+
+def get_llm_limiter() -> LLMRateLimiter:
+    """
+    获取全局上游调用限流实例
+
+    Returns:
+        LLMRateLimiter: 限流实例
+    """
+    global _llm_limiter
+    if _llm_limiter is None:
+        _llm_limiter = LLMRateLimiter()
+    return _llm_limiter
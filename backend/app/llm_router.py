@@ -0,0 +1,385 @@
+"""
+上游 LLM 路由模块
+/ai/chat 背后的多提供方抽象：OpenRouter、本地 Ollama 与其他 OpenAI 兼容服务，每个提供方使用独立的连接池；
+按 (提供方, 模型) 统计最近若干次调用的延迟与失败，请求优先发往最快的健康提供方，
+遇到 429 / 5xx / 超时等可重试错误时自动切换到下一个提供方，并可在首选提供方响应过慢时发起对冲请求
+"""
+
+import asyncio
+import fnmatch
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from app import llm_client
+from app.http_client import HttpClientConfig, create_http_client, get_http_client
+from app.llm_client import UpstreamError
+from app.settings import env_float, env_int, env_list
+
+PROVIDER_KINDS = ("openrouter", "ollama", "openai")
+
+# 各类提供方的默认接口地址（OpenAI 兼容的 /chat/completions）
+DEFAULT_URLS = {
+    "openrouter": llm_client.OPENROUTER_URL,
+    "ollama": "http://localhost:11434/v1/chat/completions",
+    "openai": "https://api.openai.com/v1/chat/completions",
+}
+
+LABELS = {"openrouter": "OpenRouter", "ollama": "Ollama", "openai": "OpenAI"}
+
+
+def is_retryable(code: int) -> bool:
+    """
+    是否换一个提供方重试：限流、超时、服务端错误，以及 404（该提供方没有这个模型）
+    401 / 403 / 400 等请求本身的问题换提供方也无济于事，直接返回
+    """
+    return code in (404, 408, 429) or code >= 500
+
+
+@dataclass
+class ProviderConfig:
+    """单个提供方配置"""
+    name: str
+    kind: str = "openai"
+    url: str = ""
+    api_key: Optional[str] = None
+    models: Tuple[str, ...] = ("*",)
+    max_connections: int = 20
+
+    @classmethod
+    def from_env(cls, name: str) -> "ProviderConfig":
+        """
+        从 LLM_PROVIDER_<名称>_* 环境变量读取配置
+        KIND 默认与名称相同（openrouter / ollama），其他名称视为 OpenAI 兼容服务；
+        URL 可以只写到 /v1，会自动补全 /chat/completions；MODELS 为逗号分隔的模型名通配符
+        """
+        prefix = f"LLM_PROVIDER_{name.upper()}_"
+        kind = env_list(prefix + "KIND", [name.lower() if name.lower() in PROVIDER_KINDS else "openai"])[0]
+        if kind not in PROVIDER_KINDS:
+            kind = "openai"
+        url = env_list(prefix + "URL", [DEFAULT_URLS[kind]])[0]
+        if not url.rstrip("/").endswith("/chat/completions"):
+            url = url.rstrip("/") + "/chat/completions"
+        api_key = env_list(prefix + "KEY", [])
+        return cls(
+            name=name.lower(),
+            kind=kind,
+            url=url,
+            api_key=api_key[0] if api_key else None,
+            models=tuple(env_list(prefix + "MODELS", ["*"])),
+            max_connections=env_int(prefix + "MAX_CONNECTIONS", cls.max_connections),
+        )
+
+
+@dataclass
+class RouterConfig:
+    """路由配置"""
+    providers: List[ProviderConfig] = field(default_factory=lambda: [ProviderConfig.from_env("openrouter")])
+    window: int = 50
+    failure_threshold: int = 3
+    cooldown: float = 30.0
+    hedge_delay: float = 0.0
+
+    @classmethod
+    def from_env(cls) -> "RouterConfig":
+        """从环境变量读取配置，LLM_PROVIDERS 的顺序为延迟数据不足时的默认优先级"""
+        default = cls()
+        names = env_list("LLM_PROVIDERS", ["openrouter"]) or ["openrouter"]
+        return cls(
+            providers=[ProviderConfig.from_env(name) for name in names],
+            window=env_int("LLM_ROUTER_WINDOW", default.window),
+            failure_threshold=env_int("LLM_ROUTER_FAILURE_THRESHOLD", default.failure_threshold),
+            cooldown=env_float("LLM_ROUTER_COOLDOWN", default.cooldown),
+            hedge_delay=env_float("LLM_HEDGE_DELAY", default.hedge_delay),
+        )
+
+
+class Provider:
+    """上游提供方：构造请求并持有自己的连接池"""
+
+    def __init__(self, config: ProviderConfig):
+        self.config = config
+        self.name = config.name
+        self.label = LABELS[config.kind] if config.name == config.kind else config.name
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def shared_pool(self) -> bool:
+        """默认地址的 OpenRouter 直接使用进程共享的 HTTP 客户端"""
+        return self.config.kind == "openrouter" and self.config.url == llm_client.OPENROUTER_URL
+
+    def client(self) -> httpx.AsyncClient:
+        """获取该提供方的连接池客户端（按需创建）"""
+        if self.shared_pool:
+            return get_http_client()
+        if self._client is None or self._client.is_closed:
+            config = HttpClientConfig.from_env()
+            config.max_connections = self.config.max_connections
+            config.max_keepalive = min(config.max_keepalive, self.config.max_connections)
+            self._client = create_http_client(config)
+        return self._client
+
+    def api_key(self, request_key: Optional[str]) -> Optional[str]:
+        """OpenRouter 优先使用请求携带的 Key，其他提供方使用配置的 Key"""
+        if self.config.kind == "openrouter":
+            return request_key or self.config.api_key
+        return self.config.api_key
+
+    def available(self, request_key: Optional[str]) -> bool:
+        """OpenRouter 必须有 Key，Ollama 与其他兼容服务可以不配置"""
+        return self.config.kind != "openrouter" or bool(self.api_key(request_key))
+
+    def serves(self, model: str) -> bool:
+        return any(fnmatch.fnmatchcase(model, pattern) for pattern in self.config.models)
+
+    def build_request(self, api_key: Optional[str], model: str, messages: list, stream: bool = False) -> tuple:
+        """构造请求，返回 (url, headers, data)"""
+        if self.config.kind == "openrouter":
+            _, headers, data = llm_client.build_request(api_key, model, messages, stream=stream)
+            return self.config.url, headers, data
+        headers = {"Content-Type": "application/json"}
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        data = {"model": model, "messages": messages}
+        if stream:
+            data["stream"] = True
+        return self.config.url, headers, data
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class RouteStats:
+    """单个 (提供方, 模型) 的滚动统计：最近 window 次成功调用的延迟与最近 window 次调用的结果"""
+
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+
+    def record_failure(self, threshold: int, cooldown: float):
+        """连续失败达到阈值后冷却一段时间；冷却结束后再失败一次会重新冷却"""
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= threshold:
+            self.cooldown_until = time.time() + cooldown
+
+    def healthy(self) -> bool:
+        return time.time() >= self.cooldown_until
+
+    def latency(self) -> Optional[float]:
+        """平均延迟，没有成功记录时为 None"""
+        return sum(self.latencies) / len(self.latencies) if self.latencies else None
+
+    def error_rate(self) -> Optional[float]:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else None
+
+    def stats(self) -> dict:
+        return {
+            "calls": len(self.outcomes),
+            "latency": self.latency(),
+            "error_rate": self.error_rate(),
+            "healthy": self.healthy(),
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class LLMRouter:
+    """按延迟与健康状况选择提供方，失败时切换，慢时对冲"""
+
+    def __init__(self, config: RouterConfig = None):
+        self.config = config or RouterConfig.from_env()
+        self.providers: Dict[str, Provider] = {}
+        for provider_config in self.config.providers:
+            self.providers.setdefault(provider_config.name, Provider(provider_config))
+        self.routes: Dict[Tuple[str, str], RouteStats] = {}
+        self.failovers = 0
+        self.hedged = 0
+
+    def route(self, provider: Provider, model: str) -> RouteStats:
+        key = (provider.name, model)
+        if key not in self.routes:
+            self.routes[key] = RouteStats(self.config.window)
+        return self.routes[key]
+
+    def candidates(self, model: str, api_key: Optional[str], provider: Optional[str] = None) -> List[Provider]:
+        """
+        按优先级排列可处理该模型的提供方：健康的在前，其中平均延迟低的在前；
+        还没有延迟数据的提供方视为 0，保证每个提供方都会被尝试到；冷却中的提供方只作为最后的备选
+
+        Args:
+            provider (str): 指定提供方名称时只使用该提供方
+
+        Raises:
+            UpstreamError: 没有提供方支持该模型，或支持该模型的提供方都缺少 API Key（400）
+        """
+        if provider:
+            if provider.lower() not in self.providers:
+                raise UpstreamError(400, f"未配置的提供方: {provider}")
+            providers = [self.providers[provider.lower()]]
+        else:
+            providers = [p for p in self.providers.values() if p.serves(model)]
+            if not providers:
+                raise UpstreamError(400, f"没有可用的提供方支持模型 {model}")
+        providers = [p for p in providers if p.available(api_key)]
+        if not providers:
+            raise UpstreamError(400, "API Key 未提供")
+
+        def priority(p: Provider):
+            route = self.route(p, model)
+            return (not route.healthy(), route.latency() or 0.0)
+
+        return sorted(providers, key=priority)
+
+    async def _attempt(self, provider: Provider, api_key: Optional[str], model: str, messages: list) -> str:
+        route = self.route(provider, model)
+        start = time.time()
+        try:
+            content = await llm_client.complete(provider.api_key(api_key), model, messages, provider=provider)
+        except UpstreamError as e:
+            if is_retryable(e.code):
+                route.record_failure(self.config.failure_threshold, self.config.cooldown)
+            raise
+        route.record_success(time.time() - start)
+        return content
+
+    async def complete(
+        self, api_key: Optional[str], model: str, messages: list, provider: Optional[str] = None
+    ) -> str:
+        """
+        调用上游并等待完整响应
+        首选提供方返回可重试错误时立即切换到下一个；配置 hedge_delay 时，
+        首选提供方超过该时间仍未响应会同时向下一个提供方发起请求，先成功的结果生效，其余请求被取消
+
+        Raises:
+            UpstreamError: 不可重试的错误，或所有提供方都失败（返回最后一个错误）
+        """
+        candidates = self.candidates(model, api_key, provider)
+        pending = set()
+        next_index = 0
+        last_error = None
+
+        def launch():
+            nonlocal next_index
+            candidate = candidates[next_index]
+            next_index += 1
+            pending.add(asyncio.ensure_future(self._attempt(candidate, api_key, model, messages)))
+
+        launch()
+        try:
+            while pending:
+                hedge = self.config.hedge_delay > 0 and next_index < len(candidates)
+                done, _ = await asyncio.wait(
+                    pending, timeout=self.config.hedge_delay if hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    self.hedged += 1
+                    print(f"[LLM路由] {candidates[next_index - 1].name} 响应超过 {self.config.hedge_delay}秒，"
+                          f"对冲请求 {candidates[next_index].name}")
+                    launch()
+                    continue
+                for task in done:
+                    pending.discard(task)
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                    if not isinstance(error, UpstreamError) or not is_retryable(error.code):
+                        raise error
+                    last_error = error
+                if not pending and next_index < len(candidates):
+                    self.failovers += 1
+                    print(f"[LLM路由] {last_error.msg}，切换到 {candidates[next_index].name}")
+                    launch()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def open_stream(
+        self, api_key: Optional[str], model: str, messages: list,
+        started_at: Optional[float] = None, provider: Optional[str] = None
+    ) -> llm_client.ChatStream:
+        """
+        以流式方式调用上游，建立连接（收到响应头）前遇到可重试错误时切换提供方；
+        流开始后不再切换，已推送给客户端的内容无法撤回
+
+        Raises:
+            UpstreamError: 不可重试的错误，或所有提供方都失败
+        """
+        last_error = None
+        for candidate in self.candidates(model, api_key, provider):
+            if last_error is not None:
+                self.failovers += 1
+                print(f"[LLM路由] {last_error.msg}，切换到 {candidate.name}")
+            route = self.route(candidate, model)
+            start = time.time()
+            try:
+                stream = await llm_client.open_stream(
+                    candidate.api_key(api_key), model, messages, started_at=started_at, provider=candidate
+                )
+            except UpstreamError as e:
+                if not is_retryable(e.code):
+                    raise
+                route.record_failure(self.config.failure_threshold, self.config.cooldown)
+                last_error = e
+                continue
+            route.record_success(time.time() - start)
+            return stream
+        raise last_error
+
+    def stats(self) -> dict:
+        providers = {
+            name: {"kind": p.config.kind, "url": p.config.url, "models": list(p.config.models), "routes": {}}
+            for name, p in self.providers.items()
+        }
+        for (name, model), route in self.routes.items():
+            providers[name]["routes"][model] = route.stats()
+        return {
+            "providers": providers,
+            "failovers": self.failovers,
+            "hedged": self.hedged,
+            "hedge_delay": self.config.hedge_delay,
+        }
+
+    async def close(self):
+        """关闭各提供方自己的连接池（共享客户端由 http_client 模块负责）"""
+        for provider in self.providers.values():
+            await provider.close()
+
+
+# 全局 LLM 路由实例
+_llm_router = None
+
+
+def get_llm_router() -> LLMRouter:
+    """
+    获取全局 LLM 路由实例
+
+    Returns:
+        LLMRouter: LLM 路由实例
+    """
+    global _llm_router
+    if _llm_router is None:
+        _llm_router = LLMRouter()
+        print(f"[LLM路由] 已配置提供方: {', '.join(_llm_router.providers)}")
+    return _llm_router
+
+
+async def cleanup_llm_router():
+    """关闭全局 LLM 路由的连接池"""
+    global _llm_router
+    if _llm_router is not None:
+        await _llm_router.close()
+        _llm_router = None
@@ -0,0 +1,68 @@
+"""
+输出截断缓冲模块
+按字节上限保留输出的开头与结尾，中间部分丢弃并计数，
+保证单次执行占用的内存与脚本打印量无关
+"""
+
+
+class OutputBuffer:
+    """
+    头尾截断缓冲区
+    开头部分原样透传（可直接流式转发），超出后只在环形尾部缓冲中保留最后的字节
+    """
+
+    def __init__(self, limit: int):
+        """
+        Args:
+            limit (int): 字节上限，头尾各占一半；0 表示不限制
+        """
+        self.limit = limit
+        self.head_limit = limit - limit // 2 if limit > 0 else 0
+        self.tail_limit = limit // 2 if limit > 0 else 0
+        self.head_size = 0
+        self.tail = bytearray()
+        self.total = 0
+
+    @property
+    def bytes_dropped(self) -> int:
+        return self.total - self.head_size - len(self.tail)
+
+    @property
+    def truncated(self) -> bool:
+        return self.bytes_dropped > 0
+
+    def feed(self, chunk: bytes) -> bytes:
+        """
+        写入一块输出
+
+        Returns:
+            bytes: 落在头部、可以立即转发的部分
+        """
+        self.total += len(chunk)
+        if self.limit <= 0:
+            self.head_size += len(chunk)
+            return chunk
+
+        room = self.head_limit - self.head_size
+        if room > 0:
+            passthrough = chunk[:room]
+            self.head_size += len(passthrough)
+            chunk = chunk[room:]
+        else:
+            passthrough = b""
+
+        if chunk and self.tail_limit > 0:
+            self.tail += chunk
+            overflow = len(self.tail) - self.tail_limit
+            if overflow > 0:
+                del self.tail[:overflow]
+        return passthrough
+
+    def finish(self) -> bytes:
+        """
+        输出结束后取出尾部缓冲中的剩余内容，发生截断时在前面加上省略提示
+        """
+        if not self.truncated:
+            return bytes(self.tail)
+        marker = f"\n... [输出过长，已省略 {self.bytes_dropped} 字节] ...\n".encode("utf-8")
+        return marker + bytes(self.tail)
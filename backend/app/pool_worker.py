@@ -0,0 +1,197 @@
+"""
+预热工作进程入口
+由 WorkerPool 预先启动并常驻，启动时预导入常用模块；
+每个任务 fork 出独立会话的子进程执行脚本，执行器通过 UNIX 套接字下发任务并接收退出码。
+本模块只依赖标准库，除同目录的 script_runner 外不导入 app 包内的其他模块。
+"""
+
+import importlib
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from script_runner import run_source
+
+
+def _send(sock: socket.socket, message: dict):
+    """发送一条以换行分隔的 JSON 消息"""
+    sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+
+def _rss_bytes() -> int:
+    """获取当前工作进程的常驻内存（字节）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+def _preload(modules):
+    """
+    预导入常用模块，fork 出的子进程直接复用
+    返回成功导入的模块及各自的导入耗时（秒；已被先前模块间接导入的部分不重复计入）
+    """
+    times = {}
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception:
+            continue
+        times[name] = time.perf_counter() - start
+    return times
+
+
+def _apply_rlimits(limits: dict):
+    """在子进程中设置资源限制，硬限制不超过当前值（非特权进程不能调高）"""
+    import resource
+    for name, (soft, hard) in limits.items():
+        resource_id = getattr(resource, name, None)
+        if resource_id is None:
+            continue
+        _, current_hard = resource.getrlimit(resource_id)
+        if current_hard != resource.RLIM_INFINITY:
+            hard = min(hard, current_hard)
+            soft = min(soft, hard)
+        resource.setrlimit(resource_id, (soft, hard))
+
+
+def _usage(rusage) -> dict:
+    """wait4 返回的资源用量：CPU 时间（秒）与峰值常驻内存（字节）"""
+    maxrss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    return {"utime": rusage.ru_utime, "stime": rusage.ru_stime, "maxrss": maxrss}
+
+
+def _exit_code_from(exc: SystemExit) -> int:
+    """按解释器规则把 SystemExit 转换为退出码"""
+    code = exc.code
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def _run_job(job: dict) -> int:
+    """在子进程中执行脚本，行为与 python script.py / python -m pytest 保持一致"""
+    script_path = job["script_path"]
+    cwd = job["cwd"]
+    os.chdir(cwd)
+
+    if job["runner"] == "pytest":
+        import pytest
+        sys.argv = ["pytest"] + (job.get("args") or [script_path, "-v", "--tb=short"])
+        sys.path[0] = cwd
+        return int(pytest.main(sys.argv[1:]))
+
+    # 源码通过标准输入传入（执行器下发的 memfd），不读取磁盘文件
+    if job.get("stdin"):
+        source = sys.stdin.buffer.read()
+    else:
+        with open(script_path, "rb") as f:
+            source = f.read()
+    return run_source(source, script_path)
+
+
+def _child_main(sock: socket.socket, job: dict, fds: list):
+    """fork 后的子进程：独立会话、重定向输入输出、执行完毕直接退出"""
+    code = 1
+    try:
+        os.setsid()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        sock.close()
+        # fds 依次为 stdout、stderr 与可选的 stdin
+        for target, fd in zip((1, 2, 0), fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        if job.get("rlimits"):
+            _apply_rlimits(job["rlimits"])
+        try:
+            code = _run_job(job)
+        except SystemExit as e:
+            code = _exit_code_from(e)
+        try:
+            import atexit
+            atexit._run_exitfuncs()
+        except BaseException:
+            pass
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except BaseException:
+                pass
+        os._exit(code & 0xFF)
+
+
+def _handle_run(sock: socket.socket, job: dict, fds: list, jobs_done: int):
+    """执行一个任务：fork 子进程并等待其退出"""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        _child_main(sock, job, fds)
+    for fd in fds:
+        os.close(fd)
+    _send(sock, {"event": "started", "pid": pid})
+    _, status, rusage = os.wait4(pid, 0)
+    _send(sock, {
+        "event": "exit",
+        "returncode": os.waitstatus_to_exitcode(status),
+        "rusage": _usage(rusage),
+        "rss": _rss_bytes(),
+        "jobs": jobs_done + 1,
+    })
+
+
+def main():
+    sock = socket.socket(fileno=int(sys.argv[1]))
+    preload = [name for name in sys.argv[2].split(",") if name] if len(sys.argv) > 2 else []
+    times = _preload(preload)
+    _send(sock, {"event": "ready", "pid": os.getpid(), "preloaded": list(times), "preload_times": times,
+                 "rss": _rss_bytes(), "sys_path": sys.path})
+
+    buffer = b""
+    pending_fds = []
+    jobs_done = 0
+    while True:
+        try:
+            data, fds, _flags, _addr = socket.recv_fds(sock, 65536, 3)
+        except InterruptedError:
+            continue
+        except OSError:
+            break
+        if not data:
+            break
+        buffer += data
+        pending_fds.extend(fds)
+
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            message = json.loads(line)
+            cmd = message.get("cmd")
+            if cmd == "run":
+                count = 3 if message.get("stdin") else 2
+                job_fds, pending_fds = pending_fds[:count], pending_fds[count:]
+                _handle_run(sock, message, job_fds, jobs_done)
+                jobs_done += 1
+            elif cmd == "ping":
+                _send(sock, {"event": "pong", "rss": _rss_bytes(), "jobs": jobs_done})
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
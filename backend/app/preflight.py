@@ -0,0 +1,195 @@
+"""
+代码执行预检模块
+执行前的参数校验、中文字符比例检查、代码清理与预编译，供各执行接口共用；
+预检结果按原始代码的哈希缓存在有界 LRU 中，重复提交同一脚本时跳过正则清理与编译；
+编译时得到的 AST 同时用于脚本结构分析（app/code_analysis.py），分析结果按清理后代码的哈希缓存，供执行器查询
+"""
+
+import ast
+import copy
+import hashlib
+import sys
+import threading
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from app.cache import LRUCache
+from app.code_analysis import CodeAnalysis, analyze_code, analyze_tree
+from app.sanitizer import clean_code_content, validate_chinese_ratio
+from app.settings import env_int
+
+SUPPORTED_RUNNERS = ("python", "pytest")
+
+
+@dataclass
+class PreflightConfig:
+    """预检缓存配置"""
+    max_entries: int = 1024
+    max_bytes: int = 64 * 1024 * 1024
+
+    @classmethod
+    def from_env(cls) -> "PreflightConfig":
+        """从环境变量读取配置，未设置时使用默认值"""
+        default = cls()
+        return cls(
+            max_entries=env_int("PREFLIGHT_CACHE_SIZE", default.max_entries),
+            max_bytes=env_int("PREFLIGHT_CACHE_MAX_BYTES", default.max_bytes),
+        )
+
+
+@dataclass
+class PreflightResult:
+    """一次预检的结果；未通过时 error 为需要抛出的异常（中文比例过高或语法错误）"""
+    cleaned_code: str
+    chinese_ratio: float
+    error: Optional[Exception] = None
+    analysis: Optional[CodeAnalysis] = None
+
+
+def preflight_key(code: str) -> str:
+    """按代码内容计算缓存键（预检结果用原始代码，结构分析用清理后代码）"""
+    return hashlib.sha256(code.encode("utf-8", errors="surrogatepass")).hexdigest()
+
+
+def run_preflight(code: str) -> PreflightResult:
+    """执行中文比例检查、清理与预编译（不使用缓存）"""
+    is_valid, chinese_ratio = validate_chinese_ratio(code)
+    print(f"[代码预检] 中文字符比例检查: {chinese_ratio:.2%} ({'通过' if is_valid else '未通过'})")
+    if not is_valid:
+        return PreflightResult("", chinese_ratio, ValueError(f"代码中中文字符比例过高: {chinese_ratio:.2%}"))
+
+    # 写入文件前先清理代码
+    cleaned_code = clean_code_content(code)
+    print(f"[代码预检] 代码清理完成，清理后长度: {len(cleaned_code)} 字符")
+    print(f"[代码预检] 清理后代码预览: {cleaned_code[:200]}...")
+
+    # 预编译检查语法错误，提前给出明确提示；先解析出 AST 供结构分析复用，再从 AST 编译（只记录是否通过）
+    try:
+        tree = compile(cleaned_code, "<submitted_code>", "exec", ast.PyCF_ONLY_AST)
+        analysis = analyze_tree(tree, cleaned_code)
+        compile(tree, "<submitted_code>", "exec")
+    except SyntaxError as e:
+        print(f"[代码预检] 预编译失败: 语法错误: {e.msg} (第{e.lineno}行, 第{e.offset}列)")
+        return PreflightResult(cleaned_code, chinese_ratio, e.with_traceback(None))
+    return PreflightResult(cleaned_code, chinese_ratio, analysis=analysis)
+
+
+class PreflightCache:
+    """
+    预检结果缓存，按条目数与清理后代码的总大小限制内存
+    批量执行会在线程池中并发预检，读写加锁
+    """
+
+    def __init__(self, config: PreflightConfig = None):
+        self.config = config or PreflightConfig.from_env()
+        self.memory = LRUCache(
+            max_entries=self.config.max_entries,
+            ttl=0,
+            max_bytes=self.config.max_bytes,
+            sizeof=lambda result: sys.getsizeof(result.cleaned_code),
+        )
+        self.analyses = LRUCache(max_entries=self.config.max_entries, ttl=0)
+        self._lock = threading.Lock()
+
+    def prepare(self, code: str) -> Tuple[PreflightResult, bool]:
+        """
+        读取缓存的预检结果，未命中时执行预检并写入缓存
+
+        Returns:
+            Tuple[PreflightResult, bool]: (预检结果, 是否命中缓存)
+        """
+        if self.config.max_entries <= 0:
+            return run_preflight(code), False
+        key = preflight_key(code)
+        with self._lock:
+            result = self.memory.get(key)
+        if result is not None:
+            return result, True
+        result = run_preflight(code)
+        with self._lock:
+            self.memory.set(key, result)
+            if result.analysis is not None:
+                self.analyses.set(preflight_key(result.cleaned_code), result.analysis)
+        return result, False
+
+    def analysis(self, cleaned_code: str) -> CodeAnalysis:
+        """
+        查询清理后代码的结构分析结果；未经过预检（或已被淘汰）时现场解析一次并缓存
+        """
+        if self.config.max_entries <= 0:
+            return analyze_code(cleaned_code)
+        key = preflight_key(cleaned_code)
+        with self._lock:
+            analysis = self.analyses.get(key)
+        if analysis is None:
+            analysis = analyze_code(cleaned_code)
+            with self._lock:
+                self.analyses.set(key, analysis)
+        return analysis
+
+    def clear(self):
+        with self._lock:
+            self.memory.clear()
+            self.analyses.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"enabled": self.config.max_entries > 0, **self.memory.stats(),
+                    "analysis": self.analyses.stats()}
+
+
+# 全局预检缓存实例
+_preflight_cache = None
+
+
+def get_preflight_cache() -> PreflightCache:
+    """
+    获取全局预检缓存实例
+
+    Returns:
+        PreflightCache: 预检缓存实例
+    """
+    global _preflight_cache
+    if _preflight_cache is None:
+        _preflight_cache = PreflightCache()
+    return _preflight_cache
+
+
+def prepare_code(
+    code: str,
+    runner: Optional[str] = "python",
+    cache: Optional[PreflightCache] = None
+) -> Tuple[str, str]:
+    """
+    执行前的预检步骤
+
+    Args:
+        code (str): 原始代码
+        runner (str): 执行器类型，为空时使用 python
+        cache (PreflightCache): 预检缓存，为空时使用全局实例
+
+    Returns:
+        Tuple[str, str]: (runner, 清理后的代码)
+
+    Raises:
+        ValueError: 参数不合法或中文字符比例过高
+        SyntaxError: 清理后的代码存在语法错误
+    """
+    # 参数验证
+    if not code or not code.strip():
+        raise ValueError("代码内容不能为空")
+
+    runner = runner or "python"
+    if runner not in SUPPORTED_RUNNERS:
+        raise ValueError(f"不支持的执行器: {runner}")
+
+    print(f"[代码预检] 原始代码长度: {len(code)} 字符, 执行器类型: {runner}")
+
+    result, hit = (cache or get_preflight_cache()).prepare(code)
+    if hit:
+        print(f"[代码预检] 命中预检缓存，跳过比例检查、清理与编译 (中文字符比例: {result.chinese_ratio:.2%})")
+    if result.error is not None:
+        # 抛出副本，避免多个请求共用同一个异常对象的回溯
+        raise copy.copy(result.error)
+
+    return runner, result.cleaned_code
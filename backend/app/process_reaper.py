@@ -0,0 +1,216 @@
+"""
+进程组清理模块
+每次执行的子进程都是独立会话的组长（pgid == pid），终止时按进程组发送信号，连同脚本派生的子进程一起结束；
+SessionReaper 记录执行创建的会话，定期清理执行结束后仍有残留进程的会话；
+登记时记下组长的会话 ID 与启动时间，发送信号前重新核对，避免 pid 复用后误杀无关进程
+"""
+
+import asyncio
+import os
+import signal
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from app.settings import env_float
+
+GROUP_KILL_SUPPORTED = hasattr(os, "killpg")
+
+
+def signal_group(pgid: int, sig: int) -> bool:
+    """
+    向进程组发送信号
+
+    Returns:
+        bool: 进程组存在且信号已发送
+    """
+    try:
+        os.killpg(pgid, sig)
+        return True
+    except (ProcessLookupError, PermissionError):
+        return False
+
+
+def _read_stat_fields(pid) -> Optional[List[bytes]]:
+    """读取 /proc/<pid>/stat 中 comm 之后的字段（从第 3 个字段 state 开始）；进程不存在或无 /proc 时返回 None"""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # 格式: pid (comm) state ppid pgrp ...，comm 中可能含空格与括号
+    return stat[stat.rfind(b")") + 2:].split()
+
+
+def process_identity(pid: int) -> Optional[Tuple[int, int]]:
+    """
+    进程身份：(会话ID, 启动时间)，即 /proc/<pid>/stat 的第 6 与第 22 个字段
+    pid 被复用后启动时间必然不同；进程不存在或无 /proc 时返回 None
+    """
+    fields = _read_stat_fields(pid)
+    if fields is None or len(fields) < 20:
+        return None
+    return int(fields[3]), int(fields[19])
+
+
+def process_groups() -> Dict[int, List[int]]:
+    """读取 /proc，返回 {进程组ID: [存活进程ID]}（跳过僵尸进程）；无 /proc 时返回空字典"""
+    groups: Dict[int, List[int]] = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return groups
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        fields = _read_stat_fields(entry)
+        if fields is None or len(fields) < 3 or fields[0] == b"Z":
+            continue
+        groups.setdefault(int(fields[2]), []).append(int(entry))
+    return groups
+
+
+@dataclass
+class ReaperConfig:
+    """进程清理配置"""
+    interval: float = 30.0
+    kill_grace: float = 5.0
+
+    @classmethod
+    def from_env(cls) -> "ReaperConfig":
+        """从环境变量读取配置，未设置时使用默认值"""
+        default = cls()
+        return cls(
+            interval=env_float("SCRIPT_REAPER_INTERVAL", default.interval),
+            kill_grace=env_float("SCRIPT_KILL_GRACE", default.kill_grace),
+        )
+
+
+class SessionReaper:
+    """记录执行创建的会话，清理执行结束后残留的进程"""
+
+    def __init__(self, config: ReaperConfig = None):
+        self.config = config or ReaperConfig.from_env()
+        # 会话（进程组）ID -> 执行结束时间，执行中为 None
+        self.sessions: Dict[int, Optional[float]] = {}
+        # 会话 ID -> 登记时组长的 (会话ID, 启动时间)
+        self.identities: Dict[int, Optional[Tuple[int, int]]] = {}
+        self.sweeps = 0
+        self.reclaimed = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return GROUP_KILL_SUPPORTED
+
+    def track(self, pgid: int):
+        """登记执行中的会话"""
+        if self.enabled:
+            self.sessions[pgid] = None
+            self.identities[pgid] = process_identity(pgid)
+
+    def release(self, pgid: int):
+        """执行结束，会话中仍存活的进程将在下次清理时被终止"""
+        if pgid in self.sessions:
+            self.sessions[pgid] = time.time()
+
+    def _forget(self, pgid: int):
+        self.sessions.pop(pgid, None)
+        self.identities.pop(pgid, None)
+
+    def owned(self, pgid: int) -> bool:
+        """
+        进程组是否仍属于登记的会话
+        组长已退出时进程组 ID 在组内还有成员期间不会被复用，视为仍属于该会话；
+        组长存在但会话 ID 或启动时间与登记时不同，说明 pid 已被复用
+        """
+        identity = process_identity(pgid)
+        return identity is None or identity == self.identities.get(pgid)
+
+    def sweep(self) -> int:
+        """
+        终止已结束执行的会话中残留的进程
+
+        Returns:
+            int: 本次清理的进程数
+        """
+        finished = [pgid for pgid, finished_at in self.sessions.items() if finished_at is not None]
+        if not finished:
+            return 0
+        self.sweeps += 1
+        groups = process_groups()
+        reclaimed = 0
+        for pgid in finished:
+            members = groups.get(pgid)
+            if members is None and groups:
+                # /proc 中已没有该进程组，会话已完全退出
+                self._forget(pgid)
+                continue
+            if not self.owned(pgid):
+                print(f"[进程清理] 进程组 {pgid} 的组长已不是登记的进程（pid 已复用），跳过")
+                self._forget(pgid)
+                continue
+            if signal_group(pgid, signal.SIGKILL):
+                reclaimed += len(members) if members else 1
+            else:
+                self._forget(pgid)
+        if reclaimed:
+            self.reclaimed += reclaimed
+            print(f"[进程清理] 已清理残留进程 {reclaimed} 个")
+        return reclaimed
+
+    def start(self):
+        """在当前事件循环中启动定期清理（重复调用安全）"""
+        if not self.enabled or self.config.interval <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task is not None and not self._task.done():
+            return
+        self._loop = loop
+        self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.config.interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[进程清理] 清理异常: {e}")
+
+    def close(self):
+        """
+        关闭：向所有登记的会话发送 SIGTERM，宽限期内未退出的强杀（同步，可在 shutdown 钩子中调用）
+        """
+        if self._task is not None:
+            try:
+                self._task.cancel()
+            except RuntimeError:
+                pass
+            self._task = None
+        alive = [pgid for pgid in self.sessions if self.owned(pgid) and signal_group(pgid, signal.SIGTERM)]
+        deadline = time.time() + self.config.kill_grace
+        while alive and time.time() < deadline:
+            time.sleep(0.05)
+            alive = self._alive(alive)
+        for pgid in alive:
+            if self.owned(pgid) and signal_group(pgid, signal.SIGKILL):
+                self.reclaimed += 1
+        self.sessions.clear()
+        self.identities.clear()
+
+    @staticmethod
+    def _alive(pgids: List[int]) -> List[int]:
+        """仍有存活进程的进程组（优先读取 /proc，忽略尚未回收的僵尸进程）"""
+        groups = process_groups()
+        if groups:
+            return [pgid for pgid in pgids if pgid in groups]
+        return [pgid for pgid in pgids if signal_group(pgid, 0)]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "tracked": len(self.sessions),
+            "sweeps": self.sweeps,
+            "reclaimed": self.reclaimed,
+        }
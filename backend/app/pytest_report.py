@@ -0,0 +1,84 @@
+"""
+pytest 结果解析模块
+从 --junitxml 生成的 JUnit XML 中提取每个测试用例的 nodeid、结果、耗时与失败信息，
+客户端无需再从 -v 文本输出中解析测试结果
+"""
+
+import os
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+OUTCOMES = ("passed", "failed", "error", "skipped")
+
+
+@dataclass
+class TestCaseResult:
+    """单个测试用例的执行结果"""
+    __test__ = False  # 名称以 Test 开头，避免被 pytest 当作测试类收集
+
+    nodeid: str
+    outcome: str
+    duration: float
+    message: Optional[str] = None
+
+
+def _nodeid(classname: str, name: str, file_name: str) -> str:
+    """由 JUnit 的 classname/name 还原 pytest nodeid（脚本为单个模块文件）"""
+    module = os.path.splitext(file_name)[0]
+    parts = classname.split(".") if classname else []
+    if parts and parts[0] == module:
+        parts = parts[1:]
+    return "::".join([file_name] + parts + [name])
+
+
+def parse_junit_xml(path: str, file_name: str) -> List[TestCaseResult]:
+    """
+    解析 JUnit XML 报告
+
+    Args:
+        path (str): XML 文件路径
+        file_name (str): 被测脚本文件名，用于还原 nodeid
+
+    Returns:
+        List[TestCaseResult]: 测试用例结果；文件不存在或格式错误时返回空列表
+    """
+    try:
+        root = ET.parse(path).getroot()
+    except (OSError, ET.ParseError):
+        return []
+
+    results = []
+    for case in root.iter("testcase"):
+        outcome = "passed"
+        message = None
+        for child in case:
+            if child.tag in ("failure", "error", "skipped"):
+                outcome = "failed" if child.tag == "failure" else child.tag
+                # 失败时文本为 --tb=short 格式的回溯；跳过时文本带有源码位置，取 message 属性中的原因
+                if child.tag == "skipped":
+                    message = child.get("message") or (child.text or "").strip()
+                else:
+                    message = (child.text or "").strip() or child.get("message")
+                break
+        try:
+            duration = float(case.get("time", 0) or 0)
+        except ValueError:
+            duration = 0.0
+        results.append(TestCaseResult(
+            nodeid=_nodeid(case.get("classname", ""), case.get("name", ""), file_name),
+            outcome=outcome,
+            duration=duration,
+            message=message,
+        ))
+    return results
+
+
+def summarize_results(results: List[TestCaseResult]) -> Dict[str, float]:
+    """按结果统计用例数量与总耗时"""
+    summary = {outcome: 0 for outcome in OUTCOMES}
+    for result in results:
+        summary[result.outcome] = summary.get(result.outcome, 0) + 1
+    summary["total"] = len(results)
+    summary["duration"] = sum(result.duration for result in results)
+    return summary
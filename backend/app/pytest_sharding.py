@@ -0,0 +1,154 @@
+"""
+pytest 分片执行模块
+收集测试用例后，按历史耗时把用例分配到 K 个 pytest 进程并行执行（最长处理时间优先的贪心分配）
+"""
+
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+from app.cache import LRUCache
+from app.settings import env_int
+
+
+@dataclass
+class ShardingConfig:
+    """分片执行配置"""
+    default_shards: int = 1
+    max_shards: int = 4
+    min_tests: int = 4
+    history_size: int = 4096
+
+    @classmethod
+    def from_env(cls) -> "ShardingConfig":
+        """从环境变量读取配置，未设置时使用默认值"""
+        default = cls()
+        return cls(
+            default_shards=env_int("PYTEST_SHARDS", default.default_shards),
+            max_shards=env_int("PYTEST_MAX_SHARDS", default.max_shards),
+            min_tests=env_int("PYTEST_SHARD_MIN_TESTS", default.min_tests),
+        )
+
+
+def parse_collected_ids(output: str, file_name: str) -> List[str]:
+    """解析 pytest --collect-only -q 的输出，提取属于被测脚本的测试 nodeid"""
+    ids = []
+    for line in output.splitlines():
+        line = line.strip()
+        path, sep, _ = line.partition("::")
+        if sep and os.path.basename(path) == file_name:
+            ids.append(line)
+    return ids
+
+
+def _history_key(nodeid: str) -> str:
+    """历史耗时按去掉文件名的测试路径记录，临时文件名变化不影响匹配"""
+    return nodeid.split("::", 1)[1] if "::" in nodeid else nodeid
+
+
+class ProcessGroup:
+    """
+    一组分片进程，对外提供与 asyncio.subprocess.Process 一致的等待/终止接口，
+    可放入 running_processes 供取消与停止使用；退出码取各分片中的最大值
+    """
+
+    def __init__(self, processes: list):
+        self.processes = processes
+
+    @property
+    def pid(self) -> int:
+        return self.processes[0].pid
+
+    @property
+    def returncode(self) -> Optional[int]:
+        codes = [p.returncode for p in self.processes]
+        if any(code is None for code in codes):
+            return None
+        return max(codes)
+
+    @property
+    def rusage(self) -> Optional[dict]:
+        """各分片资源用量汇总：CPU 时间求和，峰值内存取最大值"""
+        usages = [getattr(p, "rusage", None) for p in self.processes]
+        if not usages or any(usage is None for usage in usages):
+            return None
+        return {
+            "utime": sum(usage["utime"] for usage in usages),
+            "stime": sum(usage["stime"] for usage in usages),
+            "maxrss": max(usage["maxrss"] for usage in usages),
+        }
+
+    async def wait(self) -> int:
+        await asyncio.gather(*(p.wait() for p in self.processes))
+        return self.returncode
+
+    def terminate(self):
+        for p in self.processes:
+            if p.returncode is None:
+                try:
+                    p.terminate()
+                except ProcessLookupError:
+                    pass
+
+    def kill(self):
+        for p in self.processes:
+            if p.returncode is None:
+                try:
+                    p.kill()
+                except ProcessLookupError:
+                    pass
+
+
+class PytestSharder:
+    """记录测试耗时并生成分片计划"""
+
+    def __init__(self, config: ShardingConfig = None):
+        self.config = config or ShardingConfig.from_env()
+        self.history = LRUCache(max_entries=self.config.history_size, ttl=0)
+
+    def shard_count(self, requested: Optional[int], test_count: int) -> int:
+        """确定实际分片数，用例太少时不分片"""
+        shards = requested if requested is not None else self.config.default_shards
+        shards = min(shards, self.config.max_shards, test_count)
+        if test_count < self.config.min_tests:
+            return 1
+        return max(1, shards)
+
+    def estimate(self, nodeid: str, default: float) -> float:
+        duration = self.history.get(_history_key(nodeid), count=False)
+        return duration if duration is not None else default
+
+    def plan(self, nodeids: List[str], shards: int) -> List[List[str]]:
+        """
+        生成分片计划：按估计耗时从大到小依次放入当前总耗时最小的分片
+        没有历史数据的用例按已知耗时的平均值估计
+        """
+        known = [d for d in (self.history.get(_history_key(n), count=False) for n in nodeids) if d is not None]
+        default = sum(known) / len(known) if known else 1.0
+        ordered = sorted(nodeids, key=lambda n: self.estimate(n, default), reverse=True)
+
+        buckets = [[] for _ in range(shards)]
+        loads = [0.0] * shards
+        for nodeid in ordered:
+            target = loads.index(min(loads))
+            buckets[target].append(nodeid)
+            loads[target] += self.estimate(nodeid, default)
+        # 保持每个分片内用例的原始顺序
+        position = {nodeid: i for i, nodeid in enumerate(nodeids)}
+        return [sorted(bucket, key=position.get) for bucket in buckets if bucket]
+
+    def stats(self) -> dict:
+        return {
+            "default_shards": self.config.default_shards,
+            "max_shards": self.config.max_shards,
+            "history": len(self.history),
+        }
+
+    def record(self, results):
+        """记录本次执行的用例耗时（指数加权平均）"""
+        for result in results:
+            key = _history_key(result.nodeid)
+            previous = self.history.get(key, count=False)
+            duration = result.duration if previous is None else previous * 0.5 + result.duration * 0.5
+            self.history.set(key, duration)
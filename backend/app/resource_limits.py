@@ -0,0 +1,87 @@
+"""
+脚本资源限制模块
+为每次执行的子进程设置 rlimit（CPU 时间、地址空间、打开文件数、进程数），
+并根据退出状态、CPU 用量与输出中的错误特征判断是否触发了限制
+"""
+
+import signal
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from app.settings import env_int
+
+# 触发限制时脚本输出中出现的错误特征（CPU 限制通过信号判断）
+LIMIT_MARKERS = {
+    "memory": "MemoryError",
+    "open_files": "Too many open files",
+    "processes": "Resource temporarily unavailable",
+}
+
+
+@dataclass
+class ResourceLimitsConfig:
+    """资源限制配置，0 表示不限制"""
+    cpu_seconds: int = 0
+    memory_mb: int = 0
+    open_files: int = 0
+    processes: int = 0
+
+    @classmethod
+    def from_env(cls) -> "ResourceLimitsConfig":
+        """从环境变量读取配置，未设置时使用默认值"""
+        default = cls()
+        return cls(
+            cpu_seconds=env_int("SCRIPT_LIMIT_CPU_SECONDS", default.cpu_seconds),
+            memory_mb=env_int("SCRIPT_LIMIT_MEMORY_MB", default.memory_mb),
+            open_files=env_int("SCRIPT_LIMIT_OPEN_FILES", default.open_files),
+            processes=env_int("SCRIPT_LIMIT_PROCESSES", default.processes),
+        )
+
+    def rlimits(self) -> Dict[str, List[int]]:
+        """
+        转换为 {资源名: [软限制, 硬限制]}，由工作进程在 fork 出的子进程中设置
+        CPU 硬限制比软限制多 1 秒：软限制先发送 SIGXCPU，脚本忽略该信号时再由硬限制强杀
+        """
+        limits = {}
+        if self.cpu_seconds > 0:
+            limits["RLIMIT_CPU"] = [self.cpu_seconds, self.cpu_seconds + 1]
+        if self.memory_mb > 0:
+            limits["RLIMIT_AS"] = [self.memory_mb * 1024 * 1024] * 2
+        if self.open_files > 0:
+            limits["RLIMIT_NOFILE"] = [self.open_files] * 2
+        if self.processes > 0:
+            # RLIMIT_NPROC 按用户计数，包含同一用户下已有的进程
+            limits["RLIMIT_NPROC"] = [self.processes] * 2
+        return limits
+
+    def markers(self) -> Dict[str, str]:
+        """已启用限制对应的输出错误特征"""
+        enabled = {
+            "memory": self.memory_mb > 0,
+            "open_files": self.open_files > 0,
+            "processes": self.processes > 0,
+        }
+        return {name: marker for name, marker in LIMIT_MARKERS.items() if enabled[name]}
+
+    def exceeded(self, returncode: Optional[int], cpu_time: Optional[float], seen: Iterable[str]) -> Optional[str]:
+        """
+        判断触发了哪项限制
+
+        Args:
+            returncode (int): 进程退出码，被信号终止时为负的信号值
+            cpu_time (float): 用户态与内核态 CPU 时间之和，未知时为 None
+            seen (Iterable[str]): 输出中出现过错误特征的限制名
+
+        Returns:
+            str: 限制名（cpu/memory/open_files/processes），未触发时返回 None
+        """
+        if self.cpu_seconds > 0 and returncode is not None:
+            if returncode == -signal.SIGXCPU:
+                return "cpu"
+            if returncode == -signal.SIGKILL and cpu_time is not None and cpu_time >= self.cpu_seconds:
+                return "cpu"
+        if returncode:
+            for name in LIMIT_MARKERS:
+                if name in seen:
+                    return name
+        return None
@@ -0,0 +1,115 @@
+"""
+执行结果缓存模块
+按 (清理后代码, runner, Python 版本, 超时档位) 的哈希缓存 ExecutionResult，
+重复提交同一确定性脚本时直接返回缓存结果；内存 LRU 为一级缓存，可选 Redis 为二级缓存
+"""
+
+import hashlib
+import json
+import sys
+from dataclasses import asdict, dataclass, replace
+
+from app.cache import LRUCache, RedisCacheTier
+from app.pytest_report import TestCaseResult
+from app.settings import env_bool, env_float, env_int
+
+# 超时时间按档位归并，避免 29 秒和 30 秒的相同脚本生成不同的缓存键
+TIMEOUT_BUCKETS = (10, 30, 60, 120, 300)
+
+
+def timeout_bucket(timeout: int) -> int:
+    for bucket in TIMEOUT_BUCKETS:
+        if timeout <= bucket:
+            return bucket
+    return TIMEOUT_BUCKETS[-1]
+
+
+def result_cache_key(cleaned_code: str, runner: str, timeout: int) -> str:
+    """计算内容寻址的缓存键"""
+    digest = hashlib.sha256()
+    for part in (cleaned_code, runner, sys.version, str(timeout_bucket(timeout))):
+        digest.update(part.encode("utf-8", errors="replace"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def result_size(result) -> int:
+    """估算缓存结果占用的内存：捕获的 stdout/stderr 字节数"""
+    return sum(len(text.encode("utf-8", errors="replace")) for text in (result.stdout, result.stderr) if text)
+
+
+@dataclass
+class ResultCacheConfig:
+    """执行结果缓存配置，max_bytes 为内存缓存中输出内容的总字节数上限（0 不限制）"""
+    enabled: bool = False
+    ttl: float = 300.0
+    max_entries: int = 256
+    max_bytes: int = 64 * 1024 * 1024
+    redis: bool = False
+
+    @classmethod
+    def from_env(cls) -> "ResultCacheConfig":
+        """从环境变量读取配置，未设置时使用默认值"""
+        default = cls()
+        return cls(
+            enabled=env_bool("SCRIPT_RESULT_CACHE", default.enabled),
+            ttl=env_float("SCRIPT_RESULT_CACHE_TTL", default.ttl),
+            max_entries=env_int("SCRIPT_RESULT_CACHE_SIZE", default.max_entries),
+            max_bytes=env_int("SCRIPT_RESULT_CACHE_MAX_BYTES", default.max_bytes),
+            redis=env_bool("SCRIPT_RESULT_CACHE_REDIS", default.redis),
+        )
+
+
+class ResultCache:
+    """执行结果缓存，只缓存正常结束（COMPLETED）的结果"""
+
+    def __init__(self, config: ResultCacheConfig = None):
+        self.config = config or ResultCacheConfig.from_env()
+        self.memory = LRUCache(
+            max_entries=self.config.max_entries,
+            ttl=self.config.ttl,
+            max_bytes=self.config.max_bytes,
+            sizeof=result_size,
+        )
+        self.redis = RedisCacheTier("run-code:", ttl=self.config.ttl) if self.config.redis else None
+
+    async def get(self, key: str):
+        """
+        读取缓存
+
+        Returns:
+            ExecutionResult: 命中时返回副本（cached=True），未命中返回 None
+        """
+        from app.script_executor import ExecutionResult, ExecutionStatus
+
+        result = self.memory.get(key)
+        if result is None and self.redis is not None:
+            raw = await self.redis.get(key)
+            if raw is not None:
+                data = json.loads(raw)
+                data["status"] = ExecutionStatus(data["status"])
+                if data.get("test_results") is not None:
+                    data["test_results"] = [TestCaseResult(**case) for case in data["test_results"]]
+                result = ExecutionResult(**data)
+                self.memory.set(key, result)
+        if result is None:
+            return None
+        return replace(result, cached=True, queue_wait_time=0.0)
+
+    async def set(self, key: str, result):
+        from app.script_executor import ExecutionStatus
+
+        if result.status != ExecutionStatus.COMPLETED:
+            return
+        self.memory.set(key, result)
+        if self.redis is not None:
+            data = asdict(result)
+            data["status"] = result.status.value
+            await self.redis.set(key, json.dumps(data, ensure_ascii=False))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": True,
+            "memory": self.memory.stats(),
+            "redis": self.redis.stats() if self.redis is not None else {"enabled": False},
+        }
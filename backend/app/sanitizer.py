@@ -1,11 +1,99 @@
 """
 代码清理和验证工具模块
-提供代码内容清理和中文字符比例验证功能
+提供代码内容清理（含按块流式清理）和中文字符比例验证功能
 与前端保持一致的清理逻辑
 """
 
 import re
-from typing import Tuple
+from typing import Iterable, Iterator, Tuple
+
+
+# 代码块标记：行首的 ```lang 及其后的空白，以及任意位置剩余的 ``` 与可选换行
+# 两条规则合并为一次扫描，结果与依次执行两次 re.sub 相同（行首匹配优先）
+_FENCE_RE = re.compile(r'^```\w*\s*\n?|```\n?', re.MULTILINE)
+
+# 流式清理时未结束的代码块标记：行首的 ```lang 之后直到缓存末尾都是空白。
+# 此时 \s* 可能继续匹配后续内容开头的空白，不能在这里切分；其余情况下任意换行之后都可以切分，
+# 切分后的片段开头仍是行首，分段替换与整体替换结果相同
+_PENDING_FENCE_RE = re.compile(r'^```\w*\s*\Z', re.MULTILINE)
+
+# AI生成建议的模式（合并为一个交替模式，一次搜索）
+AI_SUGGESTION_PATTERNS = (
+    r'这段代码',
+    r'以上代码',
+    r'这个.*实现了',
+    r'注意.*事项',
+    r'建议.*使用',
+    r'可以.*优化',
+    r'推荐.*方式',
+    r'另外.*可以',
+    r'如果.*需要',
+    r'当.*时候',
+    r'为了.*安全',
+    r'确保.*正确',
+    r'避免.*问题',
+)
+_AI_SUGGESTION_RE = re.compile('|'.join(AI_SUGGESTION_PATTERNS))
+
+# 常用汉字 U+4E00-U+9FFF 在 UTF-16-BE 编码中高位字节为 0x4E-0x9F；代理对的高位字节为 0xD8-0xDF，不会误计
+_NON_CJK_HIGH_BYTES = bytes(b for b in range(256) if not 0x4E <= b <= 0x9F)
+
+# 只保留可打印 ASCII、常用汉字与 \t\n\r；控制字符、零宽字符、编码问题字符等都不在保留范围内，
+# 原先依次执行的四次删除等价于这一次
+_DISALLOWED_RE = re.compile(r'[^\x20-\x7E\u4e00-\u9fff\t\n\r]')
+# 纯 ASCII 行只需删除控制字符（多数行不含控制字符，先搜索再删除）
+_ASCII_CONTROL_RE = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]')
+
+
+def count_cjk(text: str) -> int:
+    """
+    统计常用汉字（U+4E00-U+9FFF）数量
+    编码为 UTF-16-BE 后取每个码元的高位字节，删除非汉字字节后的长度即为汉字数，
+    全程在 C 层处理连续缓冲区，不像 re.findall 那样为每个匹配字符创建对象；纯 ASCII 文本直接返回 0
+    """
+    if text.isascii():
+        return 0
+    return len(text.encode('utf-16-be', 'surrogatepass')[::2].translate(None, _NON_CJK_HIGH_BYTES))
+
+
+def _iter_clean_lines(lines: Iterable[str]) -> Iterator[str]:
+    """
+    逐行清理，每行只做一遍处理：跳过空行、AI建议行与纯中文说明行，删除问题字符，
+    连续空行只保留一行（等价于合并后把 3 个以上的连续换行替换为 2 个）
+    """
+    previous_empty = False
+    for line in lines:
+        stripped_line = line.strip()
+        
+        # 跳过空行
+        if not stripped_line:
+            continue
+        
+        if line.isascii():
+            # 纯 ASCII 行不含中文，只需删除控制字符
+            if _ASCII_CONTROL_RE.search(line):
+                line = _ASCII_CONTROL_RE.sub('', line)
+        else:
+            # 跳过AI生成的建议行（中文字符占比超过30%且包含建议模式）
+            chinese_chars = count_cjk(stripped_line)
+            if chinese_chars > len(stripped_line) * 0.3:
+                if _AI_SUGGESTION_RE.search(stripped_line):
+                    continue
+                
+                # 跳过纯中文注释行（中文字符占比超过60%的行）
+                if chinese_chars > len(stripped_line) * 0.6 and not stripped_line.startswith('#'):
+                    continue
+            
+            # 移除不可见字符、控制字符和非打印字符（保留常用空白字符）
+            line = _DISALLOWED_RE.sub('', line)
+        
+        if not line:
+            if previous_empty:
+                continue
+            previous_empty = True
+        else:
+            previous_empty = False
+        yield line
 
 
 def clean_code_content(code: str) -> str:
@@ -23,68 +111,70 @@ def clean_code_content(code: str) -> str:
         return ""
     
     # 移除代码块标记（```html, ```python等）
-    code = re.sub(r'^```\w*\s*\n?', '', code, flags=re.MULTILINE)
-    # 修复未闭合的正则：删除任意位置的 ``` 及后续可选换行
-    code = re.sub(r'```\n?', '', code)
-    
-    lines = code.split('\n')
-    cleaned_lines = []
-    
-    # AI生成建议的模式
-    ai_suggestion_patterns = [
-        r'这段代码',
-        r'以上代码',
-        r'这个.*实现了',
-        r'注意.*事项',
-        r'建议.*使用',
-        r'可以.*优化',
-        r'推荐.*方式',
-        r'另外.*可以',
-        r'如果.*需要',
-        r'当.*时候',
-        r'为了.*安全',
-        r'确保.*正确',
-        r'避免.*问题'
-    ]
+    code = _FENCE_RE.sub('', code)
     
-    for line in lines:
-        stripped_line = line.strip()
-        
-        # 跳过空行
-        if not stripped_line:
+    # 合并行并移除首尾空白
+    return '\n'.join(_iter_clean_lines(code.split('\n'))).strip()
+
+
+def _iter_unfenced_lines(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    逐块读入原始代码，在每块最后一个换行处分段移除代码块标记，按行产出结果；
+    只缓存最后一个不完整的行，以及行首代码块标记之后尚未出现非空白字符的部分
+    """
+    parts = []      # 尚未移除代码块标记的原始文本
+    partial = ''    # 已处理文本中最后一个换行之后的部分
+    for chunk in chunks:
+        if not chunk:
             continue
-        
-        # 跳过AI生成的建议行（中文字符占比超过30%且包含建议模式）
-        chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', stripped_line))
-        if chinese_chars > len(stripped_line) * 0.3:
-            # 检查是否包含AI建议模式
-            if any(re.search(pattern, stripped_line) for pattern in ai_suggestion_patterns):
+        cut = chunk.rfind('\n') + 1
+        if not cut:
+            parts.append(chunk)
+            continue
+        parts.append(chunk[:cut])
+        text = ''.join(parts)
+        if _PENDING_FENCE_RE.search(text):
+            parts = [text, chunk[cut:]]
+            continue
+        lines = (partial + _FENCE_RE.sub('', text)).split('\n')
+        partial = lines.pop()
+        parts = [chunk[cut:]]
+        yield from lines
+    yield from (partial + _FENCE_RE.sub('', ''.join(parts))).split('\n')
+
+
+def iter_clean_code(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    clean_code_content 的流式版本：输入任意切分的文本块（或带换行的行），逐段产出清理结果，
+    产出内容拼接后与 clean_code_content(''.join(chunks)) 完全一致
+    内存占用只与最长的一行（及代码块标记之后连续的空白）有关，与代码总长度和缩进层级无关
+
+    Args:
+        chunks (Iterable[str]): 原始代码文本块
+
+    Yields:
+        str: 清理后的代码片段
+    """
+    started = False
+    held = []   # 末尾的空白内容，后面出现非空白内容时才输出（等价于 strip）
+    for line in _iter_clean_lines(_iter_unfenced_lines(chunks)):
+        if started:
+            piece = '\n' + line
+        else:
+            piece = line.lstrip()
+            if not piece:
                 continue
-        
-        # 跳过纯中文注释行（中文字符占比超过60%的行）
-        if chinese_chars > len(stripped_line) * 0.6 and not stripped_line.startswith('#'):
+            started = True
+        body = piece.rstrip()
+        if not body:
+            held.append(piece)
             continue
-        
-        # 移除不可见字符和问题字符（保留常用空白字符）
-        # 移除控制字符
-        cleaned_line = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', line)
-        # 移除零宽字符和其他问题字符
-        cleaned_line = re.sub(r'[\u200B-\u200D\uFEFF\u00A0\u2000-\u200A\u2028\u2029]', '', cleaned_line)
-        # 移除可能导致编码问题的字符
-        cleaned_line = re.sub(r'[\uFFFD\uFFFE\uFFFF]', '', cleaned_line)
-        # 移除非打印字符（除了常见的空白字符）
-        cleaned_line = re.sub(r'[^\x20-\x7E\u4e00-\u9fff\t\n\r]', '', cleaned_line)
-        
-        cleaned_lines.append(cleaned_line)
-    
-    # 合并行并移除多余的连续空行
-    result = '\n'.join(cleaned_lines)
-    result = re.sub(r'\n{3,}', '\n\n', result)
-    
-    # 移除首尾空白
-    result = result.strip()
-    
-    return result
+        if held:
+            yield ''.join(held)
+            held = []
+        yield body
+        if len(body) < len(piece):
+            held.append(piece[len(body):])
 
 
 def validate_chinese_ratio(code: str, max_ratio: float = 0.1) -> Tuple[bool, float]:
@@ -102,7 +192,7 @@ def validate_chinese_ratio(code: str, max_ratio: float = 0.1) -> Tuple[bool, flo
         return True, 0.0
     
     # 计算中文字符数量
-    chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', code))
+    chinese_chars = count_cjk(code)
     total_chars = len(code)
     
     if total_chars == 0:
@@ -139,6 +229,27 @@ def sanitize_input(text: str) -> str:
     return sanitized
 
 
+# Python 特征
+_PYTHON_PATTERNS = tuple(re.compile(p) for p in (
+    r'\bimport\s+\w+',
+    r'\bfrom\s+\w+\s+import',
+    r'\bdef\s+\w+\s*\(',
+    r'\bclass\s+\w+\s*\(',
+    r'\bif\s+__name__\s*==\s*["\']__main__["\']',
+    r'\bprint\s*\(',
+))
+
+# JavaScript 特征
+_JS_PATTERNS = tuple(re.compile(p) for p in (
+    r'\bfunction\s+\w+\s*\(',
+    r'\bvar\s+\w+\s*=',
+    r'\blet\s+\w+\s*=',
+    r'\bconst\s+\w+\s*=',
+    r'\bconsole\.log\s*\(',
+    r'=>',
+))
+
+
 def detect_code_language(code: str) -> str:
     """
     检测代码语言类型
@@ -152,28 +263,8 @@ def detect_code_language(code: str) -> str:
     if not code:
         return 'unknown'
     
-    # Python 特征
-    python_patterns = [
-        r'\bimport\s+\w+',
-        r'\bfrom\s+\w+\s+import',
-        r'\bdef\s+\w+\s*\(',
-        r'\bclass\s+\w+\s*\(',
-        r'\bif\s+__name__\s*==\s*["\']__main__["\']',
-        r'\bprint\s*\(',
-    ]
-    
-    # JavaScript 特征
-    js_patterns = [
-        r'\bfunction\s+\w+\s*\(',
-        r'\bvar\s+\w+\s*=',
-        r'\blet\s+\w+\s*=',
-        r'\bconst\s+\w+\s*=',
-        r'\bconsole\.log\s*\(',
-        r'=>',
-    ]
-    
-    python_score = sum(1 for pattern in python_patterns if re.search(pattern, code))
-    js_score = sum(1 for pattern in js_patterns if re.search(pattern, code))
+    python_score = sum(1 for pattern in _PYTHON_PATTERNS if pattern.search(code))
+    js_score = sum(1 for pattern in _JS_PATTERNS if pattern.search(code))
     
     if python_score > js_score:
         return 'python'
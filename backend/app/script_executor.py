@@ -1,18 +1,72 @@
 """
 脚本执行器模块
 提供异步代码执行功能，支持Python和pytest
+POSIX 平台优先使用预热工作进程池执行，池中无空闲进程时回退到冷启动子进程
+python 脚本源码经内存文件（memfd）作为标准输入交给解释器，不落盘；
+pytest 脚本写入进程内复用的 tmpfs 临时目录
 """
 
 import asyncio
+import codecs
+import signal
 import subprocess
 import tempfile
 import os
+import shutil
 import time
 from enum import Enum
 from dataclasses import dataclass
-from typing import Optional, Tuple
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
 import uuid
 
+from app.admission import AdmissionController, AdmissionConfig
+from app.output_buffer import OutputBuffer
+from app.preflight import get_preflight_cache
+from app.pytest_report import TestCaseResult, parse_junit_xml
+from app.process_reaper import GROUP_KILL_SUPPORTED, ReaperConfig, SessionReaper, signal_group
+from app.pytest_sharding import ProcessGroup, PytestSharder, ShardingConfig, parse_collected_ids
+from app.resource_limits import ResourceLimitsConfig
+from app.result_cache import ResultCache, ResultCacheConfig, result_cache_key
+from app.settings import env_int
+from app.worker_pool import PooledProcess, WorkerPool, WorkerPoolConfig
+
+
+# 流式读取输出的块大小与缓冲队列长度
+OUTPUT_CHUNK_SIZE = 64 * 1024
+OUTPUT_QUEUE_SIZE = 64
+# 每个输出流默认保留的最大字节数（头尾各一半）
+DEFAULT_MAX_OUTPUT_BYTES = 1024 * 1024
+# 从标准输入读取源码执行的入口脚本
+SCRIPT_RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "script_runner.py")
+
+
+def default_scratch_dir() -> str:
+    """
+    脚本临时目录：优先使用 SCRIPT_SCRATCH_DIR，其次 /dev/shm（tmpfs），否则系统临时目录；
+    按进程区分子目录，同一进程内反复复用
+    """
+    configured = os.getenv("SCRIPT_SCRATCH_DIR")
+    if configured:
+        return configured
+    base = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+    return os.path.join(base, f"ai_test_scripts_{os.getpid()}")
+
+
+def open_source_file(code: Union[str, Iterable[str]]):
+    """
+    把源码写入内存文件（Linux 使用 memfd，其他平台使用已删除的临时文件），返回定位到开头的文件对象
+    code 也可以是文本块的迭代器（如 sanitizer.iter_clean_code 的输出），逐块写入，不拼接完整字符串
+    """
+    if hasattr(os, "memfd_create"):
+        source = os.fdopen(os.memfd_create("script", os.MFD_CLOEXEC), "w+b")
+    else:
+        source = tempfile.TemporaryFile()
+    for chunk in ((code,) if isinstance(code, str) else code):
+        source.write(chunk.encode('utf-8', errors='replace'))
+    source.flush()
+    source.seek(0)
+    return source
+
 
 class ExecutionStatus(Enum):
     """执行状态枚举"""
@@ -21,6 +75,7 @@ class ExecutionStatus(Enum):
     COMPLETED = "completed"
     TIMEOUT = "timeout"
     ERROR = "error"
+    CANCELLED = "cancelled"
 
 
 @dataclass
@@ -35,126 +90,526 @@ class ExecutionResult:
     execution_time: float
     status: ExecutionStatus
     error_message: Optional[str] = None
+    queue_wait_time: float = 0.0
+    truncated: bool = False
+    bytes_dropped: int = 0
+    cached: bool = False
+    shards: int = 1
+    test_results: Optional[List[TestCaseResult]] = None
+    cpu_user_time: Optional[float] = None
+    cpu_system_time: Optional[float] = None
+    peak_rss: Optional[int] = None
+    limit_exceeded: Optional[str] = None
+    import_time_saved: Optional[float] = None
+
+
+@dataclass
+class OutputChunk:
+    """流式执行时产出的输出片段"""
+    stream: str
+    text: str
 
 
 class ScriptExecutor:
     """脚本执行器类"""
     
-    def __init__(self, temp_dir: str = None):
+    def __init__(
+        self,
+        temp_dir: str = None,
+        pool_config: WorkerPoolConfig = None,
+        admission_config: AdmissionConfig = None,
+        output_limits: Optional[Dict[str, int]] = None,
+        result_cache_config: ResultCacheConfig = None,
+        sharding_config: ShardingConfig = None,
+        resource_limits: ResourceLimitsConfig = None,
+        reaper_config: ReaperConfig = None
+    ):
         """
         初始化脚本执行器
         
         Args:
-            temp_dir (str): 临时文件目录，默认使用系统临时目录
+            temp_dir (str): 临时文件目录，默认见 default_scratch_dir()
+            pool_config (WorkerPoolConfig): 预热工作进程池配置，默认从环境变量读取，size 为 0 时不预热（冷启动仍经临时工作进程）
+            admission_config (AdmissionConfig): 准入控制配置，默认从环境变量读取，max_concurrent 为 0 时不限流
+            output_limits (dict): 各输出流的字节上限，如 {"stdout": 1048576, "stderr": 1048576}，0 表示不限制
+            result_cache_config (ResultCacheConfig): 执行结果缓存配置，默认从环境变量读取（默认关闭）
+            sharding_config (ShardingConfig): pytest 分片执行配置，默认从环境变量读取（默认不分片）
+            resource_limits (ResourceLimitsConfig): 子进程资源限制，默认从环境变量读取（默认不限制）
+            reaper_config (ReaperConfig): 残留进程清理配置，默认从环境变量读取
         """
-        self.temp_dir = temp_dir or tempfile.gettempdir()
+        self.temp_dir = temp_dir or default_scratch_dir()
+        self._owns_temp_dir = temp_dir is None
+        os.makedirs(self.temp_dir, exist_ok=True)
         self.running_processes = {}
+        self._cancelled = set()
+        pool_config = pool_config or WorkerPoolConfig.from_env()
+        self.worker_pool = WorkerPool(pool_config) if WorkerPool.supported() else None
+        admission_config = admission_config or AdmissionConfig.from_env()
+        self.admission = AdmissionController(admission_config) if admission_config.max_concurrent > 0 else None
+        self.output_limits = output_limits if output_limits is not None else {
+            "stdout": env_int("SCRIPT_MAX_STDOUT_BYTES", DEFAULT_MAX_OUTPUT_BYTES),
+            "stderr": env_int("SCRIPT_MAX_STDERR_BYTES", DEFAULT_MAX_OUTPUT_BYTES),
+        }
+        result_cache_config = result_cache_config or ResultCacheConfig.from_env()
+        self.result_cache = ResultCache(result_cache_config) if result_cache_config.enabled else None
+        self.sharder = PytestSharder(sharding_config)
+        self.resource_limits = resource_limits or ResourceLimitsConfig.from_env()
+        self.reaper = SessionReaper(reaper_config)
+    
+    async def start(self):
+        """预热工作进程池（可选，首次执行时也会自动启动）"""
+        if self.worker_pool is not None:
+            await self.worker_pool.start()
+    
+    async def _start_process(self, cmd: list, runner: str, script_path: str, stdin=None):
+        """
+        启动执行进程：优先交给空闲的预热工作进程，否则冷启动
+        POSIX 平台冷启动也经临时工作进程 fork 执行，以便设置资源限制并通过 wait4 统计用量；
+        临时工作进程启动失败或其他平台直接创建子进程（不限制资源、不统计用量）
+        
+        Args:
+            stdin: 作为子进程标准输入的文件对象（python 脚本源码），为空时不提供输入
+        
+        Returns:
+            进程对象，接口与 asyncio.subprocess.Process 一致
+        """
+        cwd = os.path.dirname(script_path)
+        if self.worker_pool is not None:
+            await self.worker_pool.start()
+            job = {
+                # pytest 的命令行参数原样交给工作进程（cmd 形如 python -m pytest ...）
+                "args": cmd[3:] if runner == "pytest" else None,
+                "stdin_fd": stdin.fileno() if stdin is not None else None,
+                "rlimits": self.resource_limits.rlimits(),
+            }
+            worker = self.worker_pool.acquire()
+            if worker is not None:
+                try:
+                    process = await self.worker_pool.run(worker, runner, script_path, cwd, **job)
+                    print(f"[脚本执行器] 使用预热工作进程 pid={worker.pid}, 任务进程 pid={process.pid}")
+                    return process
+                except Exception as e:
+                    print(f"[脚本执行器] 预热工作进程不可用，回退到冷启动: {e}")
+                    self.worker_pool.discard(worker)
+            try:
+                return await self.worker_pool.run_once(runner, script_path, cwd, **job)
+            except Exception as e:
+                print(f"[脚本执行器] 临时工作进程不可用，直接创建子进程: {e}")
+        
+        # 执行命令（非阻塞，禁用交互输入，按平台创建进程组）
+        return await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=stdin if stdin is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd,
+            creationflags=(subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0),
+            start_new_session=(os.name != 'nt')
+        )
     
     async def execute_script_async(
         self, 
         code: str, 
         runner: str = "python", 
-        timeout: int = 30
+        timeout: int = 30,
+        client_id: Optional[str] = None,
+        use_cache: bool = True,
+        execution_id: Optional[str] = None,
+        shards: Optional[int] = None
     ) -> ExecutionResult:
         """
-        异步执行脚本代码
+        异步执行脚本代码（缓冲模式，基于流式执行核心汇总输出）
         
         Args:
             code (str): 要执行的代码
             runner (str): 执行器类型 ("python" 或 "pytest")
             timeout (int): 超时时间（秒）
+            client_id (str): 客户端标识，用于单客户端并发限制
+            use_cache (bool): 是否允许使用执行结果缓存（缓存启用时生效）
+            execution_id (str): 执行标识，作为 running_processes 的键，可用于 cancel_execution；默认随机生成
+            shards (int): pytest 分片进程数，默认使用 PYTEST_SHARDS 配置
             
         Returns:
-            ExecutionResult: 执行结果
+            ExecutionResult: 执行结果，queue_wait_time 为排队时间，不计入 execution_time；
+                命中缓存时 cached 为 True；取消或超时时 stdout/stderr 为已产出的部分输出
+            
+        Raises:
+            AdmissionRejected: 执行队列已满或排队超时
+        """
+        cache_key = None
+        if use_cache and self.result_cache is not None:
+            cache_key = result_cache_key(code, runner, timeout)
+            cached = await self.result_cache.get(cache_key)
+            if cached is not None:
+                print(f"[脚本执行器] 命中执行结果缓存: {cache_key[:12]}")
+                return cached
+        
+        stdout_parts = []
+        stderr_parts = []
+        result = None
+        async for item in self.stream_script_async(code, runner, timeout, client_id, execution_id, shards):
+            if isinstance(item, OutputChunk):
+                (stdout_parts if item.stream == "stdout" else stderr_parts).append(item.text)
+            else:
+                result = item
+        
+        if result.status in (ExecutionStatus.COMPLETED, ExecutionStatus.CANCELLED, ExecutionStatus.TIMEOUT):
+            # 取消与超时的任务同样保留已产出的部分输出，超时说明附在错误输出之后
+            stderr = "".join(stderr_parts)
+            if result.stderr:
+                stderr += ("\n" if stderr and not stderr.endswith("\n") else "") + result.stderr
+            result.stdout = "".join(stdout_parts)
+            result.stderr = stderr
+            print(f"[脚本执行器] STDOUT前200字符: {result.stdout[:200]}")
+            print(f"[脚本执行器] STDERR前200字符: {result.stderr[:200]}")
+            if cache_key is not None:
+                await self.result_cache.set(cache_key, result)
+        return result
+    
+    async def stream_script_async(
+        self,
+        code: str,
+        runner: str = "python",
+        timeout: int = 30,
+        client_id: Optional[str] = None,
+        execution_id: Optional[str] = None,
+        shards: Optional[int] = None
+    ) -> AsyncIterator[Union[OutputChunk, ExecutionResult]]:
         """
+        流式执行脚本代码，进程运行期间逐块产出输出
+        
+        Args:
+            code (str): 要执行的代码
+            runner (str): 执行器类型 ("python" 或 "pytest")
+            timeout (int): 超时时间（秒）
+            client_id (str): 客户端标识，用于单客户端并发限制
+            execution_id (str): 执行标识，默认随机生成
+            shards (int): pytest 分片进程数，大于 1 时收集用例后分配到多个进程并行执行，输出按块交错
+            
+        Yields:
+            OutputChunk: stdout/stderr 输出片段
+            ExecutionResult: 最后一项为执行结果；正常结束时其 stdout/stderr 为空（输出已通过片段产出）
+            
+        Raises:
+            AdmissionRejected: 执行队列已满或排队超时
+        """
+        queue_wait_time = 0.0
+        if self.admission is not None:
+            queue_wait_time = await self.admission.acquire(client_id)
+            if queue_wait_time > 0:
+                print(f"[脚本执行器] 排队等待 {queue_wait_time:.2f}秒后开始执行")
+        stream = self._stream_script(code, runner, timeout, execution_id, shards, client_id)
+        try:
+            async for item in stream:
+                if isinstance(item, ExecutionResult):
+                    item.queue_wait_time = queue_wait_time
+                yield item
+        finally:
+            # 显式关闭内层生成器，确保消费方提前退出时立即终止进程并清理文件
+            await stream.aclose()
+            if self.admission is not None:
+                self.admission.release(client_id)
+    
+    async def _pump_output(
+        self, reader: asyncio.StreamReader, stream: str, queue: asyncio.Queue, limit: Optional[int] = None
+    ) -> OutputBuffer:
+        """
+        按块读取进程输出并增量解码，读到 EOF 后放入 None 作为结束标记
+        超过字节上限的部分只保留开头与结尾，中间丢弃（管道仍持续读空，避免子进程阻塞）
+        """
+        buffer = OutputBuffer(self.output_limits.get(stream, 0) if limit is None else limit)
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        try:
+            while True:
+                chunk = await reader.read(OUTPUT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                passthrough = buffer.feed(chunk)
+                text = decoder.decode(passthrough) if passthrough else ""
+                if text:
+                    await queue.put(OutputChunk(stream, text))
+            rest = buffer.finish()
+            if buffer.truncated:
+                tail = decoder.decode(b'', final=True) + rest.decode('utf-8', errors='replace')
+            else:
+                tail = decoder.decode(rest, final=True)
+            if tail:
+                await queue.put(OutputChunk(stream, tail))
+        finally:
+            await queue.put(None)
+        return buffer
+    
+    @staticmethod
+    def _usage(process) -> dict:
+        """进程资源用量（工作进程通过 wait4 上报），直接创建的子进程没有用量数据"""
+        rusage = getattr(process, "rusage", None)
+        if not rusage:
+            return {"cpu_user_time": None, "cpu_system_time": None, "peak_rss": None}
+        return {
+            "cpu_user_time": rusage["utime"],
+            "cpu_system_time": rusage["stime"],
+            "peak_rss": rusage["maxrss"],
+        }
+    
+    def _import_time_saved(self, processes: list, imports) -> Optional[float]:
+        """估算本次执行因预导入节省的导入耗时（各执行进程之和）；直接创建的子进程返回 None"""
+        if self.worker_pool is None or not all(isinstance(proc, PooledProcess) for proc in processes):
+            return None
+        saved = sum(self.worker_pool.import_time_saved_for(proc, imports) for proc in processes)
+        if saved > 0:
+            print(f"[脚本执行器] 预导入模块节省导入耗时: {saved * 1000:.1f}毫秒")
+        return saved
+    
+    def _kill_group(self, process, force: bool = False):
+        """
+        终止执行进程所在的整个进程组，脚本派生的子进程一并收到信号
+        （执行进程都以独立会话启动，pgid 即其 pid）；force 为 True 时发送 SIGKILL。
+        不支持进程组的平台只终止进程本身
+        """
+        if isinstance(process, ProcessGroup):
+            for proc in process.processes:
+                self._kill_group(proc, force)
+            return
+        if GROUP_KILL_SUPPORTED:
+            signal_group(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+            return
+        try:
+            if force:
+                process.kill()
+            else:
+                os.kill(process.pid, signal.CTRL_BREAK_EVENT)
+        except OSError:
+            pass
+    
+    async def _terminate(self, process):
+        """按进程组优雅终止，宽限期后强杀；主进程退出后强杀组内残留的子进程"""
+        self._kill_group(process)
+        try:
+            await asyncio.wait_for(process.wait(), timeout=self.reaper.config.kill_grace)
+        except asyncio.TimeoutError:
+            self._kill_group(process, force=True)
+            await process.wait()
+        self._kill_group(process, force=True)
+    
+    async def _plan_shards(
+        self, script_path: str, shards: Optional[int], deadline: float, client_id: Optional[str] = None
+    ) -> Tuple[Optional[List[List[str]]], int]:
+        """
+        收集 pytest 用例并生成分片计划
+        每个分片进程占用一个执行名额：当前执行已持有一个，其余名额不排队地申请，
+        申请不到时减少分片数或不分片，保证并发进程数不超过准入控制的全局与单客户端上限
+
+        Returns:
+            tuple: (每个分片的 nodeid 列表（路径为绝对路径），额外持有的名额数)；
+                不需要分片或收集失败时为 (None, 0)；额外名额由调用方在执行结束后 release
+        """
+        requested = shards if shards is not None else self.sharder.config.default_shards
+        requested = min(requested, self.sharder.config.max_shards)
+        if requested <= 1:
+            return None, 0
+        extra = 0
+        if self.admission is not None:
+            extra = self.admission.try_acquire(client_id, requested - 1)
+            if extra == 0:
+                print("[脚本执行器] 没有空闲的执行名额，不分片执行")
+                return None, 0
+            requested = extra + 1
+
+        plan = None
+        try:
+            plan = await self._collect_plan(script_path, requested, deadline)
+        finally:
+            held = len(plan) - 1 if plan else 0
+            # 归还多申请的名额（用例数少于分片数或收集失败时）
+            for _ in range(extra - held):
+                self.admission.release(client_id)
+        return plan, held if self.admission is not None else 0
+
+    async def _collect_plan(self, script_path: str, requested: int, deadline: float) -> Optional[List[List[str]]]:
+        """执行 pytest --collect-only 并按 requested 个分片生成计划，不需要分片或收集失败时返回 None"""
+        cmd = ["python", "-m", "pytest", script_path, "--collect-only", "-q", "-p", "no:cacheprovider"]
+        process = await self._start_process(cmd, "pytest", script_path)
+        self.reaper.track(process.pid)
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout=max(0, deadline - time.time()))
+        except asyncio.TimeoutError:
+            self._kill_group(process, force=True)
+            await process.wait()
+            print("[脚本执行器] 收集pytest用例超时，不分片执行")
+            return None
+        finally:
+            self.reaper.release(process.pid)
+        if process.returncode != 0:
+            print(f"[脚本执行器] 收集pytest用例失败 (退出码: {process.returncode})，不分片执行")
+            return None
+
+        nodeids = parse_collected_ids(stdout.decode("utf-8", errors="replace"), os.path.basename(script_path))
+        count = self.sharder.shard_count(requested, len(nodeids))
+        if count <= 1:
+            return None
+        # 收集结果中的路径相对于 rootdir，改为脚本绝对路径，避免受执行目录影响
+        nodeids = [f"{script_path}::{nodeid.split('::', 1)[1]}" for nodeid in nodeids]
+        plan = self.sharder.plan(nodeids, count)
+        print(f"[脚本执行器] pytest分片执行 - 用例数: {len(nodeids)}, 分片数: {len(plan)}")
+        return plan
+    
+    async def _stream_script(
+        self, code: str, runner: str, timeout: int, execution_id: Optional[str] = None,
+        shards: Optional[int] = None, client_id: Optional[str] = None
+    ) -> AsyncIterator[Union[OutputChunk, ExecutionResult]]:
+        """流式执行核心（准入名额由调用方申请，分片执行时在这里申请并归还额外名额）"""
         start_time = time.time()
+        deadline = start_time + timeout
         
         # 生成唯一的文件名
-        script_id = str(uuid.uuid4())[:8]
+        script_id = execution_id or str(uuid.uuid4())[:8]
         file_extension = ".py"
         script_filename = f"script_{script_id}{file_extension}"
         script_path = os.path.join(self.temp_dir, script_filename)
         
         print(f"[脚本执行器] 开始执行 - ID: {script_id}, Runner: {runner}, 超时: {timeout}秒")
+        self.reaper.start()
         print(f"[脚本执行器] 临时文件路径: {script_path}")
         
+        process = None
+        processes = []
+        pumps = []
+        junit_paths = []
+        source = None
+        extra_slots = 0
         try:
-            # 写入代码到临时文件，使用严格的编码处理
-            with open(script_path, 'w', encoding='utf-8', errors='replace') as f:
-                # 确保代码内容是有效的UTF-8
-                clean_code = code.encode('utf-8', errors='replace').decode('utf-8')
-                f.write(clean_code)
-            print(f"[脚本执行器] 代码已写入文件，大小: {len(code)} 字符")
-            
             # 根据runner类型构建命令（新增：pytest测试检测与回退）
+            analysis = get_preflight_cache().analysis(code)
             if runner == "pytest":
-                if not self._contains_pytest_tests(code):
+                if not analysis.has_pytest_tests:
                     print("[脚本执行器] 未检测到pytest测试，自动改用python运行")
                     runner = "python"
+            # pytest 执行时 pytest 本身也由子进程导入
+            imports = set(analysis.imports) | ({"pytest"} if runner == "pytest" else set())
+            if self.worker_pool is not None:
+                self.worker_pool.record_imports(analysis.imports)
+            
             if runner == "pytest":
-                cmd = ["python", "-m", "pytest", script_path, "-v", "--tb=short"]
+                # pytest 需要按路径收集用例，写入临时目录（目录可能已在清理时移除）
+                os.makedirs(self.temp_dir, exist_ok=True)
+                with open(script_path, 'w', encoding='utf-8', errors='replace') as f:
+                    # 确保代码内容是有效的UTF-8
+                    clean_code = code.encode('utf-8', errors='replace').decode('utf-8')
+                    f.write(clean_code)
+                print(f"[脚本执行器] 代码已写入文件，大小: {len(code)} 字符")
             else:
-                cmd = ["python", script_path]
+                # python 脚本经内存文件作为标准输入传入，script_path 仅用于回溯与结果中的文件名
+                source = open_source_file(code)
             
-            print(f"[脚本执行器] 执行命令: {' '.join(cmd)}")
+            plan = None
+            if runner == "pytest":
+                plan, extra_slots = await self._plan_shards(script_path, shards, deadline, client_id)
+            if plan:
+                junit_paths = [f"{script_path[:-3]}_shard{i}.xml" for i in range(len(plan))]
+                cmds = [
+                    ["python", "-m", "pytest", *nodeids, "-v", "--tb=short", "-p", "no:cacheprovider",
+                     f"--junitxml={junit_path}"]
+                    for nodeids, junit_path in zip(plan, junit_paths)
+                ]
+            elif runner == "pytest":
+                junit_paths = [f"{script_path[:-3]}.xml"]
+                cmds = [["python", "-m", "pytest", script_path, "-v", "--tb=short", "-p", "no:cacheprovider",
+                         f"--junitxml={junit_paths[0]}"]]
+            else:
+                cmds = [["python", SCRIPT_RUNNER, script_path]]
             
-            # 执行命令（非阻塞，禁用交互输入，按平台创建进程组）
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdin=asyncio.subprocess.DEVNULL,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=os.path.dirname(script_path),
-                creationflags=(subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0),
-                start_new_session=(os.name != 'nt')
-            )
+            if plan:
+                process = ProcessGroup(processes)
+                for cmd in cmds:
+                    processes.append(await self._start_process(cmd, runner, script_path))
+                    self.reaper.track(processes[-1].pid)
+            else:
+                print(f"[脚本执行器] 执行命令: {' '.join(cmds[0])}")
+                process = await self._start_process(cmds[0], runner, script_path, stdin=source)
+                processes.append(process)
+                self.reaper.track(process.pid)
             self.running_processes[script_id] = process
+            import_time_saved = self._import_time_saved(processes, imports)
+            
+            # 有界队列：消费方跟不上时读取暂停，由管道对子进程施加背压
+            # 分片执行时各进程输出交错写入同一队列，字节上限按分片数均分
+            queue = asyncio.Queue(maxsize=OUTPUT_QUEUE_SIZE)
+            for proc in processes:
+                for stream in ("stdout", "stderr"):
+                    limit = self.output_limits.get(stream, 0) // len(processes)
+                    pumps.append(asyncio.ensure_future(
+                        self._pump_output(getattr(proc, stream), stream, queue, limit)
+                    ))
+            
+            # 启用内存/文件数/进程数限制时，记录输出中出现的触发特征
+            markers = self.resource_limits.markers()
+            limits_seen = set()
             
             try:
-                # 等待执行完成或超时
-                stdout, stderr = await asyncio.wait_for(
-                    process.communicate(), 
-                    timeout=timeout
-                )
+                # 逐块产出输出，直到两个输出流都结束且进程退出，或超时
+                open_streams = len(pumps)
+                while open_streams:
+                    item = await asyncio.wait_for(queue.get(), timeout=max(0, deadline - time.time()))
+                    if item is None:
+                        open_streams -= 1
+                    else:
+                        if markers:
+                            limits_seen.update(name for name, marker in markers.items() if marker in item.text)
+                        yield item
+                await asyncio.wait_for(process.wait(), timeout=max(0, deadline - time.time()))
                 
                 execution_time = time.time() - start_time
+                print(f"[脚本执行器] 执行完成 - 退出码: {process.returncode}, 耗时: {execution_time:.2f}秒")
                 
-                # 解码输出
-                stdout_str = stdout.decode('utf-8', errors='replace') if stdout else ""
-                stderr_str = stderr.decode('utf-8', errors='replace') if stderr else ""
+                buffers = await asyncio.gather(*pumps)
+                bytes_dropped = sum(buffer.bytes_dropped for buffer in buffers)
+                if bytes_dropped:
+                    print(f"[脚本执行器] 输出超过上限，已省略 {bytes_dropped} 字节")
                 
-                # 详细日志输出
-                print(f"[脚本执行器] 执行完成 - 退出码: {process.returncode}, 耗时: {execution_time:.2f}秒")
-                print(f"[脚本执行器] STDOUT前200字符: {stdout_str[:200]}")
-                print(f"[脚本执行器] STDERR前200字符: {stderr_str[:200]}")
+                test_results = None
+                if junit_paths:
+                    test_results = []
+                    for junit_path in junit_paths:
+                        test_results.extend(parse_junit_xml(junit_path, script_filename))
+                    self.sharder.record(test_results)
+                
+                usage = self._usage(process)
+                cpu_time = None
+                if usage["cpu_user_time"] is not None:
+                    cpu_time = usage["cpu_user_time"] + usage["cpu_system_time"]
+                limit_exceeded = self.resource_limits.exceeded(process.returncode, cpu_time, limits_seen)
+                if limit_exceeded:
+                    print(f"[脚本执行器] 触发资源限制: {limit_exceeded}")
                 
-                return ExecutionResult(
-                    stdout=stdout_str,
-                    stderr=stderr_str,
+                cancelled = script_id in self._cancelled
+                result = ExecutionResult(
+                    stdout="",
+                    stderr="",
                     exit_code=process.returncode,
                     runner=runner,
                     file_path=script_path,
                     timeout=timeout,
                     execution_time=execution_time,
-                    status=ExecutionStatus.COMPLETED
+                    status=ExecutionStatus.CANCELLED if cancelled else ExecutionStatus.COMPLETED,
+                    error_message="执行已取消" if cancelled else None,
+                    truncated=bytes_dropped > 0,
+                    bytes_dropped=bytes_dropped,
+                    shards=len(processes),
+                    test_results=test_results,
+                    limit_exceeded=limit_exceeded,
+                    import_time_saved=import_time_saved,
+                    **usage
                 )
                 
             except asyncio.TimeoutError:
                 # 超时处理，按平台优雅终止，失败后强杀
-                try:
-                    if os.name == 'nt':
-                        import signal
-                        os.kill(process.pid, signal.CTRL_BREAK_EVENT)
-                    else:
-                        process.terminate()
-                    await asyncio.wait_for(process.wait(), timeout=5)
-                except asyncio.TimeoutError:
-                    process.kill()
-                    await process.wait()
+                for pump in pumps:
+                    pump.cancel()
+                await self._terminate(process)
                 
                 execution_time = time.time() - start_time
                 
-                return ExecutionResult(
+                result = ExecutionResult(
                     stdout="",
                     stderr=f"执行超时 ({timeout}秒)",
                     exit_code=-1,
@@ -163,19 +618,23 @@ class ScriptExecutor:
                     timeout=timeout,
                     execution_time=execution_time,
                     status=ExecutionStatus.TIMEOUT,
-                    error_message=f"执行超时 ({timeout}秒)"
+                    error_message=f"执行超时 ({timeout}秒)",
+                    limit_exceeded="wall",
+                    import_time_saved=import_time_saved,
+                    **self._usage(process)
                 )
             
             finally:
                 # 清理进程记录
                 self.running_processes.pop(script_id, None)
+                self._cancelled.discard(script_id)
         
         except Exception as e:
             execution_time = time.time() - start_time
             error_msg = f"执行异常: {str(e)}"
             print(f"[脚本执行器] {error_msg}")
             
-            return ExecutionResult(
+            result = ExecutionResult(
                 stdout="",
                 stderr=error_msg,
                 exit_code=-1,
@@ -188,37 +647,78 @@ class ScriptExecutor:
             )
         
         finally:
+            # 消费方提前退出（如客户端断开）时，终止仍在运行的进程
+            for pump in pumps:
+                pump.cancel()
+            if process is not None and process.returncode is None:
+                try:
+                    self._kill_group(process, force=True)
+                    print(f"[脚本执行器] 消费方已断开，强制终止进程: {script_id}")
+                    await asyncio.wait_for(process.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+                self.running_processes.pop(script_id, None)
+            for proc in processes:
+                self.reaper.release(proc.pid)
+            for _ in range(extra_slots):
+                self.admission.release(client_id)
+            
             # 清理临时文件
+            if source is not None:
+                source.close()
             try:
                 if os.path.exists(script_path):
                     os.remove(script_path)
                     print(f"[脚本执行器] 临时文件已清理: {script_path}")
+                for junit_path in junit_paths:
+                    if os.path.exists(junit_path):
+                        os.remove(junit_path)
             except Exception as e:
                 print(f"[脚本执行器] 清理临时文件失败: {e}")
+        
+        yield result
+    
+    async def cancel_execution(self, execution_id: str) -> bool:
+        """
+        终止指定的正在运行的执行，结果状态为 CANCELLED
+        
+        Returns:
+            bool: 找到并终止了进程返回 True
+        """
+        process = self.running_processes.get(execution_id)
+        if process is None or process.returncode is not None:
+            return False
+        self._cancelled.add(execution_id)
+        print(f"[脚本执行器] 取消执行: {execution_id}")
+        await self._terminate(process)
+        return True
     
     def stop_all_processes(self):
-        """停止所有正在运行的进程"""
+        """停止所有正在运行的进程（按进程组终止，宽限期后强杀残留进程）"""
         for process_id, process in self.running_processes.items():
             try:
-                if os.name == 'nt':
-                    import signal
-                    os.kill(process.pid, signal.CTRL_BREAK_EVENT)
-                else:
-                    process.terminate()
+                self._kill_group(process)
                 print(f"[脚本执行器] 已终止进程: {process_id}")
             except Exception as e:
                 print(f"[脚本执行器] 终止进程失败 {process_id}: {e}")
         self.running_processes.clear()
+        self.reaper.close()
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+        if self._owns_temp_dir:
+            # 进程专属的临时目录（可能位于 /dev/shm）连同残留文件一并移除，避免占用内存
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
     
-    def _contains_pytest_tests(self, code: str) -> bool:
-        import re
-        patterns = [
-            r'^\s*def\s+test_',          # 测试函数
-            r'^\s*class\s+Test',         # 测试类
-            r'^\s*import\s+pytest',      # 显式导入pytest
-            r'^\s*from\s+pytest\s+import'
-        ]
-        return any(re.search(p, code, re.MULTILINE) for p in patterns)
+    def get_stats(self) -> dict:
+        """获取执行器运行统计"""
+        return {
+            "running": len(self.running_processes),
+            "admission": self.admission.stats() if self.admission is not None else {"enabled": False},
+            "result_cache": self.result_cache.stats() if self.result_cache is not None else {"enabled": False},
+            "worker_pool": self.worker_pool.stats() if self.worker_pool is not None else {"enabled": False},
+            "pytest_sharding": self.sharder.stats(),
+            "reaper": self.reaper.stats(),
+        }
 
 
 # 全局脚本执行器实例
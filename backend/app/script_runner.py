@@ -0,0 +1,49 @@
+"""
+脚本执行入口
+从标准输入读取脚本源码并以 __main__ 执行，不落盘；
+script_path 只作为 __file__ 与回溯中的文件名，源码登记到 linecache 以便回溯显示代码行。
+用法: python script_runner.py <script_path>（源码通过 stdin 传入）
+本模块只依赖标准库，同时被预热工作进程导入使用。
+"""
+
+import linecache
+import os
+import sys
+import traceback
+import types
+
+
+def run_source(source: bytes, script_path: str) -> int:
+    """
+    以 __main__ 模块执行源码，行为与 python script.py 保持一致
+
+    Returns:
+        int: 退出码；未捕获异常时打印回溯并返回 1，SystemExit 原样抛出
+    """
+    sys.argv = [script_path]
+    sys.path[0] = os.path.dirname(script_path)
+    main_module = types.ModuleType("__main__")
+    main_module.__file__ = script_path
+    sys.modules["__main__"] = main_module
+
+    text = source.decode("utf-8", errors="replace")
+    linecache.cache[script_path] = (len(text), None, text.splitlines(True), script_path)
+    try:
+        exec(compile(source, script_path, "exec"), main_module.__dict__)
+    except SystemExit:
+        raise
+    except BaseException:
+        exc_type, exc_value, exc_tb = sys.exc_info()
+        # 跳过本函数所在栈帧，使回溯与直接运行脚本时一致
+        exc_value = exc_value.with_traceback(exc_tb.tb_next)
+        if sys.excepthook is sys.__excepthook__:
+            # 默认钩子直接读取磁盘文件显示代码行，源码不在磁盘上，改用读取 linecache 的 traceback 模块
+            traceback.print_exception(exc_type, exc_value, exc_value.__traceback__)
+        else:
+            sys.excepthook(exc_type, exc_value, exc_value.__traceback__)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_source(sys.stdin.buffer.read(), sys.argv[1]))
@@ -0,0 +1,39 @@
+"""
+环境变量配置读取工具
+各模块的配置类通过这些函数读取环境变量，未设置或格式错误时回退到默认值
+"""
+
+import os
+from typing import List
+
+
+def env_int(name: str, default: int) -> int:
+    """读取整数配置"""
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """读取浮点数配置"""
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    """读取布尔配置（1/true/yes/on 视为开启）"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_list(name: str, default: List[str]) -> List[str]:
+    """读取逗号分隔的列表配置"""
+    value = os.environ.get(name)
+    if value is None:
+        return list(default)
+    return [item.strip() for item in value.split(",") if item.strip()]
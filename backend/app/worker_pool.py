@@ -0,0 +1,500 @@
+"""
+预热工作进程池模块
+预先启动若干常驻 Python 解释器（见 pool_worker.py），执行脚本时直接 fork，
+省去每次请求的解释器启动与常用模块导入开销。
+支持按任务数/内存回收工作进程，并定期做健康检查。仅支持 POSIX 平台。
+除配置的预导入模块外，按近期提交脚本的导入统计自适应追加预导入模块（见 import_stats.py）。
+冷启动同样通过临时工作进程执行（run_once），资源限制与用量统计与预热执行一致。
+"""
+
+import asyncio
+import json
+import os
+import signal
+import socket
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from app.import_stats import ImportStats
+from app.settings import env_float, env_int, env_list
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pool_worker.py")
+
+
+@dataclass
+class WorkerPoolConfig:
+    """工作进程池配置"""
+    size: int = 2
+    max_jobs: int = 100
+    max_rss_mb: int = 512
+    health_interval: float = 30.0
+    start_timeout: float = 10.0
+    python: str = "python"
+    preload: List[str] = field(default_factory=lambda: ["json", "requests", "pytest"])
+    adaptive_preload: int = 8
+    preload_min_share: float = 0.2
+    preload_allow: List[str] = field(default_factory=lambda: ["requests", "pytest"])
+    import_window: int = 500
+
+    @classmethod
+    def from_env(cls) -> "WorkerPoolConfig":
+        """从环境变量读取配置，未设置时使用默认值"""
+        default = cls()
+        return cls(
+            size=env_int("SCRIPT_POOL_SIZE", default.size),
+            max_jobs=env_int("SCRIPT_POOL_MAX_JOBS", default.max_jobs),
+            max_rss_mb=env_int("SCRIPT_POOL_MAX_RSS_MB", default.max_rss_mb),
+            health_interval=env_float("SCRIPT_POOL_HEALTH_INTERVAL", default.health_interval),
+            preload=env_list("SCRIPT_POOL_PRELOAD", default.preload),
+            adaptive_preload=env_int("SCRIPT_POOL_ADAPTIVE_PRELOAD", default.adaptive_preload),
+            preload_min_share=env_float("SCRIPT_POOL_PRELOAD_MIN_SHARE", default.preload_min_share),
+            preload_allow=env_list("SCRIPT_POOL_PRELOAD_ALLOW", default.preload_allow),
+            import_window=env_int("SCRIPT_POOL_IMPORT_WINDOW", default.import_window),
+        )
+
+
+class PooledProcess:
+    """
+    工作进程中运行的一次任务
+    接口与 asyncio.subprocess.Process 保持一致（pid/returncode/communicate/wait/terminate/kill），
+    执行器的超时与终止逻辑无需区分冷启动与预热执行
+    """
+
+    def __init__(self, worker: "PoolWorker", pid: int, stdout: asyncio.StreamReader,
+                 stderr: asyncio.StreamReader, transports: list):
+        self.worker = worker
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self._transports = transports
+        self._exit = asyncio.get_running_loop().create_future()
+        # 退出后由工作进程通过 wait4 上报：{"utime", "stime", "maxrss"}
+        self.rusage: Optional[dict] = None
+
+    @property
+    def returncode(self) -> Optional[int]:
+        if self._exit.done() and not self._exit.exception():
+            return self._exit.result()
+        return None
+
+    def _set_exit(self, returncode: Optional[int], error: Optional[BaseException] = None,
+                  rusage: Optional[dict] = None):
+        if self._exit.done():
+            return
+        self.rusage = rusage
+        if error is not None:
+            self._exit.set_exception(error)
+        else:
+            self._exit.set_result(returncode)
+
+    def _close_pipes(self):
+        for transport in self._transports:
+            transport.close()
+
+    async def wait(self) -> int:
+        return await asyncio.shield(self._exit)
+
+    async def communicate(self):
+        try:
+            stdout, stderr, _ = await asyncio.gather(self.stdout.read(), self.stderr.read(), self.wait())
+            return stdout, stderr
+        except asyncio.CancelledError:
+            # 超时被取消时不再读取剩余输出，避免管道泄漏
+            self._close_pipes()
+            raise
+
+    def send_signal(self, sig: int):
+        if self.returncode is not None:
+            return
+        try:
+            os.kill(self.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class PoolWorker:
+    """执行器一侧持有的工作进程句柄"""
+
+    def __init__(self, process: asyncio.subprocess.Process, sock: socket.socket):
+        self.process = process
+        self.sock = sock
+        self.pid = process.pid
+        self.jobs = 0
+        self.rss = 0
+        self.busy = False
+        self.retired = False
+        self.requested: List[str] = []
+        self.preloaded: List[str] = []
+        self.preload_times: Dict[str, float] = {}
+        self.started_at = time.time()
+        self._buffer = b""
+
+    @property
+    def alive(self) -> bool:
+        return not self.retired and self.process.returncode is None
+
+    async def recv(self) -> dict:
+        """读取一条 JSON 消息"""
+        loop = asyncio.get_running_loop()
+        while b"\n" not in self._buffer:
+            data = await loop.sock_recv(self.sock, 65536)
+            if not data:
+                raise ConnectionError("工作进程已断开")
+            self._buffer += data
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return json.loads(line)
+
+    async def send(self, message: dict):
+        loop = asyncio.get_running_loop()
+        await loop.sock_sendall(self.sock, (json.dumps(message) + "\n").encode("utf-8"))
+
+    async def ping(self, timeout: float) -> bool:
+        """健康检查：发送 ping 并等待 pong"""
+        try:
+            await self.send({"cmd": "ping"})
+            message = await asyncio.wait_for(self.recv(), timeout=timeout)
+        except (OSError, ConnectionError, asyncio.TimeoutError, ValueError):
+            return False
+        if message.get("event") != "pong":
+            return False
+        self.rss = message.get("rss", self.rss)
+        return True
+
+    async def start_job(
+        self, runner: str, script_path: str, cwd: str, timeout: float,
+        args: Optional[List[str]] = None, stdin_fd: Optional[int] = None,
+        rlimits: Optional[Dict[str, List[int]]] = None
+    ) -> PooledProcess:
+        """
+        下发任务，返回与子进程接口一致的 PooledProcess
+        args 为 pytest 命令行参数（默认执行整个脚本）；stdin_fd 为脚本源码所在的文件描述符，
+        传入时子进程从标准输入读取源码，不读取 script_path；rlimits 为子进程的资源限制
+        """
+        loop = asyncio.get_running_loop()
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        message = {"cmd": "run", "runner": runner, "script_path": script_path, "cwd": cwd}
+        if args:
+            message["args"] = args
+        if rlimits:
+            message["rlimits"] = rlimits
+        fds = [out_w, err_w]
+        if stdin_fd is not None:
+            message["stdin"] = True
+            fds.append(stdin_fd)
+        try:
+            try:
+                socket.send_fds(self.sock, [(json.dumps(message) + "\n").encode("utf-8")], fds)
+            finally:
+                os.close(out_w)
+                os.close(err_w)
+            started = await asyncio.wait_for(self.recv(), timeout=timeout)
+            if started.get("event") != "started":
+                raise ConnectionError(f"工作进程响应异常: {started}")
+        except BaseException:
+            os.close(out_r)
+            os.close(err_r)
+            raise
+
+        readers = []
+        transports = []
+        for fd in (out_r, err_r):
+            reader = asyncio.StreamReader()
+            transport, _ = await loop.connect_read_pipe(
+                lambda r=reader: asyncio.StreamReaderProtocol(r), os.fdopen(fd, "rb", 0)
+            )
+            readers.append(reader)
+            transports.append(transport)
+        return PooledProcess(self, started["pid"], readers[0], readers[1], transports)
+
+    def close(self):
+        """退役：关闭套接字，工作进程读到 EOF 后自行退出"""
+        self.retired = True
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        if self.process.returncode is None:
+            try:
+                os.kill(self.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+class WorkerPool:
+    """预热工作进程池"""
+
+    def __init__(self, config: WorkerPoolConfig = None):
+        self.config = config or WorkerPoolConfig.from_env()
+        self.workers: List[PoolWorker] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._health_task: Optional[asyncio.Task] = None
+        self._spawning = 0
+        self.spawned = 0
+        self.recycled = 0
+        self.failures = 0
+        self.jobs_served = 0
+        self.cold_starts = 0
+        self.import_time_saved = 0.0
+        # 工作进程就绪前不知道其 sys.path，此时不把任何非内置模块判定为可导入
+        self.import_stats = ImportStats(self.config.import_window, self.config.preload_allow, search_path=[])
+        self._one_shot: Set[PoolWorker] = set()
+
+    @staticmethod
+    def supported() -> bool:
+        return os.name != "nt" and hasattr(os, "fork") and hasattr(socket, "send_fds")
+
+    @property
+    def started(self) -> bool:
+        return self._loop is not None and not self._loop.is_closed()
+
+    async def start(self):
+        """启动进程池并预热到配置的大小（重复调用安全）"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        if self._loop is not None:
+            # 事件循环已更换（例如测试中多次 asyncio.run），丢弃旧循环上的工作进程
+            self.close()
+        self._loop = loop
+        await self._fill()
+        if self.config.size > 0:
+            if self.config.health_interval > 0:
+                self._health_task = loop.create_task(self._health_loop())
+            print(f"[工作进程池] 已启动 {len(self.workers)} 个预热工作进程")
+
+    def preload_modules(self) -> List[str]:
+        """新工作进程的预导入模块：配置的模块加上近期提交中最常导入的模块"""
+        modules = list(self.config.preload)
+        for name in self.import_stats.top(self.config.adaptive_preload, self.config.preload_min_share):
+            if name not in modules:
+                modules.append(name)
+        return modules
+
+    def record_imports(self, modules):
+        """记录一次提交导入的顶层模块，用于自适应预导入"""
+        if self.config.adaptive_preload > 0:
+            self.import_stats.record(modules)
+
+    def import_time_saved_for(self, process: PooledProcess, modules) -> float:
+        """
+        估算一次任务因预导入节省的导入耗时（秒）：脚本需要且工作进程已预导入的模块的导入耗时之和
+        冷启动（临时工作进程不预导入）为 0
+        """
+        times = process.worker.preload_times
+        saved = sum(times.get(name, 0.0) for name in set(modules))
+        self.import_time_saved += saved
+        return saved
+
+    async def _spawn_worker(self, preload: Optional[List[str]] = None) -> Optional[PoolWorker]:
+        preload = self.preload_modules() if preload is None else preload
+        parent_sock, child_sock = socket.socketpair()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.config.python, WORKER_SCRIPT, str(child_sock.fileno()), ",".join(preload),
+                stdin=asyncio.subprocess.DEVNULL,
+                pass_fds=(child_sock.fileno(),),
+                start_new_session=True,
+            )
+        except Exception as e:
+            parent_sock.close()
+            self.failures += 1
+            print(f"[工作进程池] 启动工作进程失败: {e}")
+            return None
+        finally:
+            child_sock.close()
+
+        parent_sock.setblocking(False)
+        worker = PoolWorker(process, parent_sock)
+        try:
+            ready = await asyncio.wait_for(worker.recv(), timeout=self.config.start_timeout)
+        except (OSError, ConnectionError, asyncio.TimeoutError, ValueError) as e:
+            self.failures += 1
+            print(f"[工作进程池] 工作进程未就绪: {e}")
+            worker.close()
+            return None
+        worker.requested = list(preload)
+        worker.preloaded = ready.get("preloaded", [])
+        worker.preload_times = ready.get("preload_times", {})
+        worker.rss = ready.get("rss", 0)
+        if "sys_path" in ready:
+            self.import_stats.set_search_path(ready["sys_path"])
+        self.spawned += 1
+        return worker
+
+    async def _fill(self):
+        """补足工作进程数量"""
+        self.workers = [w for w in self.workers if w.alive]
+        missing = self.config.size - len(self.workers) - self._spawning
+        if missing <= 0:
+            return
+        self._spawning += missing
+        try:
+            new_workers = await asyncio.gather(*(self._spawn_worker() for _ in range(missing)))
+        finally:
+            self._spawning -= missing
+        self.workers.extend(w for w in new_workers if w is not None)
+
+    def _schedule_fill(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._loop is loop:
+            loop.create_task(self._fill())
+
+    def acquire(self) -> Optional[PoolWorker]:
+        """取一个空闲工作进程；没有空闲时返回 None，由调用方回退到冷启动"""
+        if not self.started:
+            return None
+        for worker in self.workers:
+            if not worker.busy and worker.alive:
+                worker.busy = True
+                return worker
+        return None
+
+    def release(self, worker: PoolWorker, returncode_message: Optional[dict] = None):
+        """归还工作进程，超过任务数或内存上限时回收并补充新进程"""
+        worker.busy = False
+        if returncode_message:
+            worker.jobs = returncode_message.get("jobs", worker.jobs + 1)
+            worker.rss = returncode_message.get("rss", worker.rss)
+            self.jobs_served += 1
+        if worker.alive and not self._should_recycle(worker):
+            return
+        self.discard(worker, recycled=worker.alive)
+
+    def discard(self, worker: PoolWorker, recycled: bool = False):
+        """移除工作进程（异常或回收），并异步补充"""
+        if worker in self.workers:
+            self.workers.remove(worker)
+        if recycled:
+            self.recycled += 1
+            print(f"[工作进程池] 回收工作进程 pid={worker.pid}, 已执行任务: {worker.jobs}, "
+                  f"内存: {worker.rss / 1024 / 1024:.1f}MB")
+        else:
+            self.failures += 1
+        worker.close()
+        self._schedule_fill()
+
+    def _should_recycle(self, worker: PoolWorker) -> bool:
+        if self.config.max_jobs > 0 and worker.jobs >= self.config.max_jobs:
+            return True
+        if self.config.max_rss_mb > 0 and worker.rss > self.config.max_rss_mb * 1024 * 1024:
+            return True
+        return False
+
+    async def run(self, worker: PoolWorker, runner: str, script_path: str, cwd: str, **job) -> PooledProcess:
+        """在指定工作进程上启动任务，并在后台等待退出消息；job 为 start_job 的可选参数"""
+        process = await worker.start_job(runner, script_path, cwd, timeout=self.config.start_timeout, **job)
+        self._loop.create_task(self._watch_exit(worker, process))
+        return process
+
+    async def run_once(self, runner: str, script_path: str, cwd: str, **job) -> PooledProcess:
+        """
+        冷启动执行：临时启动一个不预导入模块的工作进程执行单个任务，任务结束后关闭；
+        与预热执行共用 fork/wait4 路径，资源限制与用量统计保持一致
+        """
+        worker = await self._spawn_worker(preload=[])
+        if worker is None:
+            raise ConnectionError("冷启动工作进程失败")
+        self._one_shot.add(worker)
+        try:
+            process = await worker.start_job(runner, script_path, cwd, timeout=self.config.start_timeout, **job)
+        except BaseException:
+            self._one_shot.discard(worker)
+            worker.close()
+            raise
+        self.cold_starts += 1
+        asyncio.get_running_loop().create_task(self._watch_exit(worker, process, one_shot=True))
+        return process
+
+    async def _watch_exit(self, worker: PoolWorker, process: PooledProcess, one_shot: bool = False):
+        try:
+            message = await worker.recv()
+        except Exception as e:
+            message = None
+            process._set_exit(None, ConnectionError(f"工作进程异常退出: {e}"))
+        else:
+            process._set_exit(message.get("returncode", -1), rusage=message.get("rusage"))
+        if one_shot:
+            self._one_shot.discard(worker)
+            worker.close()
+        elif message is None:
+            self.discard(worker)
+        else:
+            self.release(worker, message)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.config.health_interval)
+            try:
+                await self.check_health()
+            except Exception as e:
+                print(f"[工作进程池] 健康检查异常: {e}")
+
+    async def check_health(self) -> int:
+        """
+        检查所有空闲工作进程，替换失去响应的进程，返回被替换数量；
+        每次最多回收一个预导入模块已过时的空闲进程，由新进程按当前导入统计预导入
+        """
+        replaced = 0
+        desired = set(self.preload_modules())
+        refreshed = False
+        for worker in list(self.workers):
+            if worker.busy:
+                continue
+            worker.busy = True
+            healthy = worker.alive and await worker.ping(timeout=self.config.start_timeout)
+            worker.busy = False
+            if not healthy:
+                print(f"[工作进程池] 工作进程 pid={worker.pid} 健康检查失败，已替换")
+                self.discard(worker)
+                replaced += 1
+            elif self._should_recycle(worker):
+                self.discard(worker, recycled=True)
+            elif not refreshed and not desired.issubset(worker.requested):
+                print(f"[工作进程池] 工作进程 pid={worker.pid} 的预导入模块已过时，替换为: {sorted(desired)}")
+                self.discard(worker, recycled=True)
+                refreshed = True
+        await self._fill()
+        return replaced
+
+    def stats(self) -> dict:
+        """进程池统计信息"""
+        return {
+            "enabled": self.config.size > 0,
+            "size": self.config.size,
+            "workers": len(self.workers),
+            "busy": sum(1 for w in self.workers if w.busy),
+            "spawned": self.spawned,
+            "recycled": self.recycled,
+            "failures": self.failures,
+            "jobs_served": self.jobs_served,
+            "cold_starts": self.cold_starts,
+            "preload": list(self.config.preload),
+            "adaptive_preload": self.preload_modules(),
+            "import_time_saved": self.import_time_saved,
+            "imports": self.import_stats.stats(),
+        }
+
+    def close(self):
+        """关闭所有工作进程（同步，可在 shutdown 钩子中调用）"""
+        if self._health_task is not None:
+            try:
+                self._health_task.cancel()
+            except RuntimeError:
+                pass
+            self._health_task = None
+        for worker in self.workers + list(self._one_shot):
+            worker.close()
+        self.workers = []
+        self._one_shot.clear()
+        self._loop = None
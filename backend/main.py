@@ -6,24 +6,36 @@ import subprocess
 import tempfile
 import textwrap
 import shutil
-import requests
 import sys
 import os
+from dataclasses import asdict
 from datetime import datetime
-from typing import Any, Optional
+from typing import Any, List, Optional
 from concurrent.futures import ThreadPoolExecutor
 import time
 
 from fastapi import FastAPI, HTTPException, APIRouter, Request, Body, Header
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
 # 添加 backend 目录到模块搜索路径，支持从项目根目录启动
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 # 导入自定义清理工具模块
-from app.sanitizer import clean_code_content, validate_chinese_ratio
-from app.script_executor import get_script_executor, ExecutionStatus, cleanup_executor
+from app import preflight
+from app.script_executor import get_script_executor, ExecutionStatus, OutputChunk, cleanup_executor
+from app.admission import AdmissionRejected
+from app.job_store import get_job_manager, cleanup_job_manager
+from app.batch_runner import BatchItem, get_batch_runner, cleanup_batch_runner
+from app.pytest_report import summarize_results
+from app.http_client import get_http_client, cleanup_http_client
+from app import llm_client
+from app.llm_router import get_llm_router, cleanup_llm_router
+from app.llm_limiter import LLMRateLimited, estimate_tokens, get_llm_limiter
+from app.conversation_store import get_conversation_store
+from app.llm_cache import get_llm_cache, llm_cache_key
+from app.settings import env_int
+from app.sanitizer import clean_code_content
 
 app = FastAPI()
 
@@ -54,6 +66,32 @@ class CodeRunRequest(BaseModel):
     code: str
     runner: Optional[str] = "python"
     timeout: Optional[int] = 20
+    use_cache: Optional[bool] = True  # 为 False 时跳过执行结果缓存
+    shards: Optional[int] = None  # pytest 分片进程数，为空时使用 PYTEST_SHARDS 配置
+    include_output: Optional[bool] = True  # 为 False 且有结构化用例结果时不返回 stdout，减小大测试集的响应体
+
+class BatchScript(BaseModel):
+    code: str
+    runner: Optional[str] = "python"
+    timeout: Optional[int] = 20
+    name: Optional[str] = None
+
+class BatchRunRequest(BaseModel):
+    scripts: List[BatchScript]
+    parallelism: Optional[int] = None
+    use_cache: Optional[bool] = True
+
+class PipelineRequest(BaseModel):
+    model: str
+    messages: List[dict]
+    api_key: Optional[str] = None
+    provider: Optional[str] = None
+    priority: Optional[str] = "normal"
+    variants: Optional[int] = 1  # 并发生成并执行的候选脚本数，上限为 PIPELINE_MAX_VARIANTS
+    runner: Optional[str] = "pytest"  # 未检测到 pytest 测试时执行器自动改用 python
+    timeout: Optional[int] = 20
+    use_cache: Optional[bool] = True
+    include_output: Optional[bool] = True
 
 # ============== 六、路由蓝图 ==============
 core_router = APIRouter(tags=["core"])
@@ -63,9 +101,80 @@ core_router = APIRouter(tags=["core"])
 async def root():
     return BaseResponse(data={"hello": "world"})
 
+def prepare_code(req: CodeRunRequest):
+    """执行前的预检步骤，返回 (runner, 清理后的代码)"""
+    print(f"[run_code接口] 开始处理代码执行请求，超时设置: {req.timeout or 30} 秒")
+    return preflight.prepare_code(req.code, req.runner)
+
+
+def syntax_error_response(e: SyntaxError) -> BaseResponse:
+    err_msg = f"语法错误: {e.msg} (第{e.lineno}行, 第{e.offset}列)"
+    return BaseResponse(code=400, msg=err_msg, data={
+        "stdout": "",
+        "stderr": e.text or "",
+        "exit_code": -1,
+        "status": "error"
+    })
+
+
+def error_response(code: int, msg: str, stderr: str, error: str, status: str = "error") -> BaseResponse:
+    return BaseResponse(code=code, msg=msg, data={
+        "stdout": "",
+        "stderr": stderr,
+        "exit_code": -1,
+        "error": error,
+        "status": status
+    })
+
+
+def execution_response(result, timeout_value: int, include_output: bool = True) -> BaseResponse:
+    """根据执行结果构建统一响应；pytest 执行附带结构化的用例结果与统计"""
+    response_data = {
+        "stdout": result.stdout if include_output or result.test_results is None else "",
+        "stderr": result.stderr,
+        "exit_code": result.exit_code,
+        "runner": result.runner,
+        "file_path": result.file_path,
+        "timeout": result.timeout,
+        "execution_time": result.execution_time,
+        "queue_wait_time": result.queue_wait_time,
+        "truncated": result.truncated,
+        "bytes_dropped": result.bytes_dropped,
+        "cached": result.cached,
+        "shards": result.shards,
+        "test_results": [asdict(case) for case in result.test_results] if result.test_results is not None else None,
+        "test_summary": summarize_results(result.test_results) if result.test_results is not None else None,
+        "cpu_user_time": result.cpu_user_time,
+        "cpu_system_time": result.cpu_system_time,
+        "peak_rss": result.peak_rss,
+        "limit_exceeded": result.limit_exceeded,
+        "import_time_saved": result.import_time_saved,
+        "status": result.status.value
+    }
+
+    # 根据执行状态返回不同的响应
+    if result.status == ExecutionStatus.COMPLETED:
+        if result.exit_code == 0:
+            print(f"[run_code接口] 返回成功响应")
+            return BaseResponse(data=response_data, msg="执行成功")
+        else:
+            print(f"[run_code接口] 返回失败响应 (退出码: {result.exit_code})")
+            return BaseResponse(code=400, data=response_data, msg="执行失败")
+    elif result.status == ExecutionStatus.TIMEOUT:
+        print(f"[run_code接口] 返回超时响应")
+        return BaseResponse(code=408, data=response_data, msg=f"执行超时 ({timeout_value}秒)")
+    else:
+        print(f"[run_code接口] 返回异常响应: {result.error_message}")
+        return BaseResponse(code=500, data=response_data, msg=f"执行异常: {result.error_message}")
+
+
+def resolve_client_id(request: Request, x_client_id: Optional[str]) -> Optional[str]:
+    return x_client_id or (request.client.host if request.client else None)
+
+
 # 代码执行路由 - 使用异步非阻塞执行器
 @core_router.post("/run-code", response_model=BaseResponse)
-async def run_code(req: CodeRunRequest):
+async def run_code(req: CodeRunRequest, request: Request, x_client_id: Optional[str] = Header(None)):
     """
     异步执行代码接口
     使用线程池隔离执行，避免主进程阻塞
@@ -73,42 +182,10 @@ async def run_code(req: CodeRunRequest):
     try:
         print(f"[代码执行] 收到执行请求: runner={req.runner}, timeout={req.timeout}")
 
-        # 参数验证
-        if not req.code or not req.code.strip():
-            raise ValueError("代码内容不能为空")
-
-        runner = req.runner or "python"
-        if runner not in ["python", "pytest"]:
-            raise ValueError(f"不支持的执行器: {runner}")
-
-        print(f"[run_code接口] 开始处理代码执行请求")
-        print(f"[run_code接口] 原始代码长度: {len(req.code)} 字符")
-        print(f"[run_code接口] 执行器类型: {runner}")
-        print(f"[run_code接口] 超时设置: {req.timeout or 30} 秒")
-
-        # 检查代码中的中文字符比例
-        is_valid, chinese_ratio = validate_chinese_ratio(req.code)
-        print(f"[run_code接口] 中文字符比例检查: {chinese_ratio:.2%} ({'通过' if is_valid else '未通过'})")
-        if not is_valid:
-            raise ValueError(f"代码中中文字符比例过高: {chinese_ratio:.2%}")
-
-        # 写入文件前先清理代码
-        cleaned_code = clean_code_content(req.code)
-        print(f"[run_code接口] 代码清理完成，清理后长度: {len(cleaned_code)} 字符")
-        print(f"[run_code接口] 清理后代码预览: {cleaned_code[:200]}...")
-
-        # 预编译检查语法错误，提前给出明确提示
         try:
-            compile(cleaned_code, "<submitted_code>", "exec")
+            runner, cleaned_code = prepare_code(req)
         except SyntaxError as e:
-            err_msg = f"语法错误: {e.msg} (第{e.lineno}行, 第{e.offset}列)"
-            print(f"[run_code接口] 预编译失败: {err_msg}")
-            return BaseResponse(code=400, msg=err_msg, data={
-                "stdout": "",
-                "stderr": e.text or "",
-                "exit_code": -1,
-                "status": "error"
-            })
+            return syntax_error_response(e)
 
         # 获取脚本执行器
         script_executor = get_script_executor()
@@ -120,86 +197,397 @@ async def run_code(req: CodeRunRequest):
         result = await script_executor.execute_script_async(
             code=cleaned_code,
             runner=runner,
-            timeout=timeout_value
+            timeout=timeout_value,
+            client_id=resolve_client_id(request, x_client_id),
+            use_cache=req.use_cache is not False,
+            shards=req.shards
         )
 
         print(f"[run_code接口] 执行完成总结:")
         print(f"  - 状态: {result.status.value}")
         print(f"  - 退出码: {result.exit_code}")
         print(f"  - 执行时间: {result.execution_time:.2f}秒")
+        print(f"  - 排队时间: {result.queue_wait_time:.2f}秒")
+        print(f"  - 命中缓存: {'是' if result.cached else '否'}")
         print(f"  - 文件路径: {result.file_path}")
         print(f"  - STDOUT前200字符: {result.stdout[:200]}")
         print(f"  - STDERR前200字符: {result.stderr[:200]}")
 
-        # 构建返回结果
-        response_data = {
-            "stdout": result.stdout,
-            "stderr": result.stderr,
-            "exit_code": result.exit_code,
-            "runner": result.runner,
-            "file_path": result.file_path,
-            "timeout": result.timeout,
-            "execution_time": result.execution_time,
-            "status": result.status.value
-        }
-
-        # 根据执行状态返回不同的响应
-        if result.status == ExecutionStatus.COMPLETED:
-            if result.exit_code == 0:
-                print(f"[run_code接口] 返回成功响应")
-                return BaseResponse(data=response_data, msg="执行成功")
-            else:
-                print(f"[run_code接口] 返回失败响应 (退出码: {result.exit_code})")
-                return BaseResponse(code=400, data=response_data, msg="执行失败")
-        elif result.status == ExecutionStatus.TIMEOUT:
-            print(f"[run_code接口] 返回超时响应")
-            return BaseResponse(code=408, data=response_data, msg=f"执行超时 ({timeout_value}秒)")
-        else:
-            print(f"[run_code接口] 返回异常响应: {result.error_message}")
-            return BaseResponse(code=500, data=response_data, msg=f"执行异常: {result.error_message}")
+        return execution_response(result, timeout_value, req.include_output is not False)
 
+    except AdmissionRejected as e:
+        print(f"[run_code接口] 准入拒绝: {e.msg}")
+        return error_response(e.code, e.msg, e.msg, e.reason, status="rejected")
     except (ValueError, IOError) as e:
         error_msg = f"参数错误: {str(e)}"
         print(f"[run_code接口] 参数错误: {error_msg}")
-        return BaseResponse(code=400, msg=error_msg, data={
-            "stdout": "",
-            "stderr": str(e),
-            "exit_code": -1,
-            "error": "parameter_error",
-            "status": "error"
-        })
+        return error_response(400, error_msg, str(e), "parameter_error")
     except Exception as e:
         error_msg = f"执行失败: {str(e)}"
         print(f"[代码执行] 异常错误: {error_msg}")
         import traceback
         print(f"[代码执行] 异常堆栈: {traceback.format_exc()}")
+        return error_response(500, error_msg, str(e), "execution_error")
+
+
+def sse_event(event: str, data: Any) -> str:
+    """格式化一条 SSE 事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# 流式代码执行路由 - 以 SSE 逐块推送 stdout/stderr，最后推送与 /run-code 相同结构的结果
+@core_router.post("/run-code/stream")
+async def run_code_stream(req: CodeRunRequest, request: Request, x_client_id: Optional[str] = Header(None)):
+    """
+    流式执行代码接口
+    事件类型: stdout / stderr（data 为 {"text": ...}），result（data 为统一响应结构）
+    """
+    print(f"[代码执行] 收到流式执行请求: runner={req.runner}, timeout={req.timeout}")
+    client_id = resolve_client_id(request, x_client_id)
+
+    async def event_stream():
+        try:
+            try:
+                runner, cleaned_code = prepare_code(req)
+            except SyntaxError as e:
+                yield sse_event("result", syntax_error_response(e).dict())
+                return
+
+            timeout_value = max(5, req.timeout or 30)
+            async for item in get_script_executor().stream_script_async(
+                code=cleaned_code,
+                runner=runner,
+                timeout=timeout_value,
+                client_id=client_id,
+                shards=req.shards
+            ):
+                if isinstance(item, OutputChunk):
+                    yield sse_event(item.stream, {"text": item.text})
+                else:
+                    yield sse_event("result", execution_response(item, timeout_value).dict())
+        except AdmissionRejected as e:
+            yield sse_event("result", error_response(e.code, e.msg, e.msg, e.reason, status="rejected").dict())
+        except (ValueError, IOError) as e:
+            yield sse_event("result", error_response(400, f"参数错误: {str(e)}", str(e), "parameter_error").dict())
+        except Exception as e:
+            print(f"[代码执行] 流式执行异常: {e}")
+            yield sse_event("result", error_response(500, f"执行失败: {str(e)}", str(e), "execution_error").dict())
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# 批量执行路由 - 并发执行多个脚本并返回汇总报告
+@core_router.post("/run-code/batch", response_model=BaseResponse)
+async def run_code_batch(req: BatchRunRequest, request: Request, x_client_id: Optional[str] = Header(None)):
+    try:
+        items = [
+            BatchItem(code=s.code, runner=s.runner, timeout=max(5, s.timeout or 30), name=s.name)
+            for s in req.scripts
+        ]
+        report = await get_batch_runner().run(
+            items,
+            parallelism=req.parallelism,
+            client_id=resolve_client_id(request, x_client_id),
+            use_cache=req.use_cache is not False
+        )
+    except ValueError as e:
+        return BaseResponse(code=400, msg=f"参数错误: {str(e)}")
+
+    results = []
+    for item in report.items:
+        if item.result is not None:
+            response = execution_response(item.result, item.result.timeout)
+        else:
+            response = error_response(item.error_code or 500, item.error, item.error, "batch_item_error")
+        results.append({"index": item.index, "name": item.name, "passed": item.passed, **response.dict()})
+
+    data = {
+        "total": len(report.items),
+        "passed": report.passed,
+        "failed": report.failed,
+        "errors": report.errors,
+        "timeouts": report.timeouts,
+        "parallelism": report.parallelism,
+        "wall_time": report.wall_time,
+        "total_execution_time": report.total_execution_time,
+        "slowest": report.slowest,
+        "results": results
+    }
+    msg = "全部通过" if report.failed == 0 else f"{report.failed} 个脚本未通过"
+    return BaseResponse(data=data, msg=msg)
+
+
+def job_response(job) -> BaseResponse:
+    """构建任务状态响应，已结束的任务附带与 /run-code 相同结构的执行结果"""
+    data = {
+        "job_id": job.job_id,
+        "status": job.status.value,
+        "runner": job.runner,
+        "timeout": job.timeout,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+        "result": None
+    }
+    if job.result is not None:
+        data["result"] = execution_response(job.result, job.timeout).dict()
+    elif job.error_message:
+        data["result"] = error_response(job.error_code or 500, job.error_message, job.error_message,
+                                        "job_error", status=job.status.value).dict()
+    return BaseResponse(data=data)
+
+
+# 异步任务路由 - 提交后立即返回任务ID，避免长时间占用连接
+@core_router.post("/jobs", response_model=BaseResponse)
+async def submit_job(req: CodeRunRequest, request: Request, x_client_id: Optional[str] = Header(None)):
+    try:
+        print(f"[任务接口] 收到任务提交: runner={req.runner}, timeout={req.timeout}")
+        try:
+            runner, cleaned_code = prepare_code(req)
+        except SyntaxError as e:
+            return syntax_error_response(e)
 
-        return BaseResponse(code=500, msg=error_msg, data={
-            "stdout": "",
-            "stderr": str(e),
-            "exit_code": -1,
-            "error": "execution_error",
-            "status": "error"
-        })
+        job = get_job_manager().submit(
+            code=cleaned_code,
+            runner=runner,
+            timeout=max(5, req.timeout or 30),
+            client_id=resolve_client_id(request, x_client_id),
+            use_cache=req.use_cache is not False,
+            shards=req.shards
+        )
+        return BaseResponse(msg="任务已提交", data={"job_id": job.job_id, "status": job.status.value})
+    except AdmissionRejected as e:
+        return error_response(e.code, e.msg, e.msg, e.reason, status="rejected")
+    except (ValueError, IOError) as e:
+        return error_response(400, f"参数错误: {str(e)}", str(e), "parameter_error")
+
+
+@core_router.get("/jobs/{job_id}", response_model=BaseResponse)
+async def get_job(job_id: str):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return BaseResponse(code=404, msg="任务不存在或已过期")
+    return job_response(job)
+
+
+@core_router.delete("/jobs/{job_id}", response_model=BaseResponse)
+async def cancel_job(job_id: str):
+    job = await get_job_manager().cancel(job_id)
+    if job is None:
+        return BaseResponse(code=404, msg="任务不存在或已过期")
+    response = job_response(job)
+    response.msg = "任务已取消" if job.status.value == "cancelled" else "任务已结束"
+    return response
+
+
+# 执行器运行统计
+@core_router.get("/executor/stats", response_model=BaseResponse)
+async def executor_stats():
+    stats = get_script_executor().get_stats()
+    stats["jobs"] = get_job_manager().stats()
+    stats["preflight_cache"] = preflight.get_preflight_cache().stats()
+    return BaseResponse(data=stats)
+
+
+class SSEResponse(StreamingResponse):
+    """
+    结束时调用 on_close 的 SSE 响应
+    客户端在事件流开始迭代前断开时，生成器内的 finally 不会执行，上游连接需要在这里关闭
+    """
+
+    def __init__(self, content, on_close=None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.on_close is not None:
+                await self.on_close()
+
+
+def sse_response(events, cache_status: str, on_close=None) -> StreamingResponse:
+    return SSEResponse(events, on_close=on_close, media_type="text/event-stream",
+                       headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Cache": cache_status})
+
+
+async def ai_chat_stream(
+    api_key: Optional[str], model: str, messages: list, request_start: float, cache_key: str, bypass: bool,
+    provider: Optional[str] = None, priority: str = "normal", session_id: Optional[str] = None
+):
+    """
+    流式聊天：等待上游响应头后开始推送，上游状态码错误仍按非流式的 JSON 错误返回
+    事件类型: delta（data 为 {"content": 增量内容}），done（data 为 {"content": 完整内容, "ttfb", "total_time", "cached"}），
+    error（data 为 {"error", "code"}，流开始后上游出错、网络中断或其他异常时推送）
+    命中响应缓存时一次推送完整内容；完整结束的流式结果写入缓存，使用会话时 done 附带 session_id
+    """
+    cache = get_llm_cache()
+    session = {"session_id": session_id} if session_id else {}
+    cached = None if bypass else await cache.get(cache_key)
+    if cached is not None:
+        if session_id:
+            get_conversation_store().save(session_id, messages, cached, api_key)
+
+        async def cached_stream():
+            yield sse_event("delta", {"content": cached})
+            yield sse_event("done", {"content": cached, "ttfb": time.time() - request_start,
+                                     "total_time": time.time() - request_start, "cached": True, **session})
+        return sse_response(cached_stream(), "HIT")
+
+    limiter = get_llm_limiter()
+    grant = await limiter.acquire(api_key, model, estimate_tokens(messages), priority)
+    try:
+        stream = await get_llm_router().open_stream(api_key, model, messages, started_at=request_start,
+                                                    provider=provider)
+    except BaseException:
+        # 上游没有返回任何内容（含故障转移全部失败），退回预扣的输出 token
+        limiter.settle(grant, "")
+        raise
+
+    settled = False
+
+    async def close_upstream():
+        # 无论流正常结束、中途出错还是客户端断开，都按已生成的内容修正预扣的 token（只修正一次）
+        nonlocal settled
+        if not settled:
+            settled = True
+            limiter.settle(grant, "".join(stream.content))
+        await stream.response.aclose()
+
+    async def event_stream():
+        try:
+            async for content in stream.deltas():
+                yield sse_event("delta", {"content": content})
+            content = "".join(stream.content)
+            await cache.set(cache_key, content)
+            if session_id:
+                get_conversation_store().save(session_id, messages, content, api_key)
+            yield sse_event("done", {
+                "content": content,
+                "ttfb": stream.ttfb,
+                "total_time": time.time() - request_start,
+                "cached": False,
+                **session,
+            })
+        except llm_client.UpstreamError as e:
+            print(f"[AI流式] 上游错误: {e.msg}")
+            yield sse_event("error", {"error": e.msg, "code": e.code})
+        except Exception as e:
+            print(f"[AI流式] 流式响应异常: {e}")
+            yield sse_event("error", {"error": f"未知异常: {str(e)}", "code": 500})
+        finally:
+            # deltas() 未开始迭代或中途被放弃时不会关闭上游响应，这里兜底关闭（重复关闭无副作用）
+            await close_upstream()
+
+    return sse_response(event_stream(), "BYPASS" if bypass else "MISS", on_close=close_upstream)
+
+
+@core_router.get("/ai/stats", response_model=BaseResponse)
+async def ai_stats():
+    return BaseResponse(data={
+        "stream": llm_client.stream_metrics.stats(),
+        "cache": get_llm_cache().stats(),
+        "router": get_llm_router().stats(),
+        "rate_limit": get_llm_limiter().stats(),
+        "conversations": get_conversation_store().stats(),
+    })
+
+
+@core_router.get("/ai/sessions/{session_id}", response_model=BaseResponse)
+async def get_session(session_id: str, x_openrouter_key: Optional[str] = Header(None)):
+    """读取会话历史，只能读取与创建时相同 API Key（请求头 X-OpenRouter-Key）的会话"""
+    try:
+        api_key = resolve_api_key(x_openrouter_key, None)
+    except ValueError as e:
+        return BaseResponse(code=400, msg=str(e))
+    messages = get_conversation_store().history(session_id, api_key)
+    if not messages:
+        return BaseResponse(code=404, msg="会话不存在或已过期")
+    return BaseResponse(data={"session_id": session_id, "messages": messages})
+
+
+@core_router.delete("/ai/sessions/{session_id}", response_model=BaseResponse)
+async def delete_session(session_id: str, x_openrouter_key: Optional[str] = Header(None)):
+    """删除会话，只能删除与创建时相同 API Key 的会话"""
+    try:
+        api_key = resolve_api_key(x_openrouter_key, None)
+    except ValueError as e:
+        return BaseResponse(code=400, msg=str(e))
+    if not get_conversation_store().delete(session_id, api_key):
+        return BaseResponse(code=404, msg="会话不存在或已过期")
+    return BaseResponse(msg="会话已删除", data={"session_id": session_id})
+
+
+def resolve_api_key(x_openrouter_key: Optional[str], payload_key: Optional[str]) -> Optional[str]:
+    """
+    获取API Key（OpenRouter 使用；只配置了 Ollama 等无需 Key 的提供方时可以不提供）
+
+    Raises:
+        ValueError: API Key 格式错误
+    """
+    api_key = x_openrouter_key or payload_key or os.environ.get("OPENROUTER_API_KEY")
+    if api_key and not api_key.startswith('sk-or-v1-'):
+        raise ValueError("API Key 格式错误，应以 sk-or-v1- 开头")
+    return api_key
+
+
+async def generate_completion(
+    api_key: Optional[str], model: str, messages: list, cache_key: str,
+    bypass: bool = False, provider: Optional[str] = None, priority: str = "normal"
+) -> tuple:
+    """
+    非流式生成：响应缓存（并发合并）→ 限流排队 → 路由到上游
+
+    Returns:
+        tuple: (内容, 缓存状态 hit / miss / coalesced / bypass / disabled)
+
+    Raises:
+        UpstreamError: 上游调用失败
+        LLMRateLimited: 限流排队已满或超时
+    """
+    async def fetch():
+        limiter = get_llm_limiter()
+        grant = await limiter.acquire(api_key, model, estimate_tokens(messages), priority)
+        if grant.wait > 0:
+            print(f"[AI聊天] 上游限流排队: {grant.wait:.2f}秒")
+        content = ""
+        try:
+            content = await get_llm_router().complete(api_key, model, messages, provider=provider)
+        finally:
+            # 上游调用失败（含故障转移全部失败）时 content 为空，预扣的输出 token 全部退回
+            limiter.settle(grant, content)
+        return content
+
+    return await get_llm_cache().get_or_fetch(cache_key, fetch, bypass=bypass)
 
 
 # AI聊天路由
 @core_router.post("/ai/chat")
-async def ai_chat(payload: dict = Body(...), x_openrouter_key: Optional[str] = Header(None)):
+async def ai_chat(
+    payload: dict = Body(...),
+    x_openrouter_key: Optional[str] = Header(None),
+    x_cache_bypass: Optional[str] = Header(None)
+):
     """
-    AI聊天接口，支持 OpenRouter API
+    AI聊天接口，支持 OpenRouter、本地 Ollama 与其他 OpenAI 兼容服务（见 llm_router）
+    默认发往最快的健康提供方并自动故障转移；payload 中 provider 可指定提供方
+    payload 中 stream 为 true 时以 SSE 逐段推送生成内容（见 ai_chat_stream）
+    调用上游前按 API Key 与模型限流，额度不足时按 payload 中的 priority（high / normal / low）排队等待
+    payload 中带 session_id（由 session 为 true 的首个请求在服务端生成）时服务端保存对话历史，messages 只需包含新增的消息，
+    会话绑定创建时的 API Key，其他 Key 无法访问；reset 为 true 时清空该会话；会话的上下文发往上游前按配置压缩（见 conversation_store），无会话的请求不做压缩
+    相同 (model, messages) 的响应会被缓存，并发的相同请求合并为一次上游调用；
+    请求头 X-Cache-Bypass: 1 时跳过缓存直接调用上游（新结果会刷新缓存），响应头 X-Cache 标明缓存状态
     """
+    request_start = time.time()
     try:
-        print(f"收到AI聊天请求: {payload}")
-
-        # 获取API Key
-        api_key = x_openrouter_key or payload.get("api_key") or os.environ.get("OPENROUTER_API_KEY")
-        if not api_key:
-            return JSONResponse({"error": "API Key 未提供"}, status_code=400)
+        print(f"收到AI聊天请求: model={payload.get('model')}, messages={len(payload.get('messages') or [])}, "
+              f"session={payload.get('session_id')}, stream={bool(payload.get('stream'))}")
 
-        # 验证API Key格式
-        if not api_key.startswith('sk-or-v1-'):
-            return JSONResponse({"error": "API Key 格式错误，应以 sk-or-v1- 开头"}, status_code=400)
+        try:
+            api_key = resolve_api_key(x_openrouter_key, payload.get("api_key"))
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
 
         # 验证必需参数
         model = payload.get("model")
@@ -210,68 +598,42 @@ async def ai_chat(payload: dict = Body(...), x_openrouter_key: Optional[str] = H
         if not messages:
             return JSONResponse({"error": "messages 参数缺失"}, status_code=400)
 
-        url = "https://openrouter.ai/api/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "http://localhost",
-            "X-Title": "FIRST_MIX"
-        }
-
-        data = {
-            "model": model,
-            "messages": messages,
-        }
-
-        print(f"发送到OpenRouter: {data}")
-        print(f"使用API Key: {api_key[:20]}...")
-
-        response = requests.post(url, headers=headers, json=data, timeout=90)
-
-        print(f"OpenRouter响应状态: {response.status_code}")
-        print(f"响应时间: {response.elapsed.total_seconds():.2f}秒")
-
-        # 详细的错误处理
-        if response.status_code == 401:
-            return JSONResponse({"error": "API Key 无效或已过期，请检查后重试"}, status_code=401)
-        elif response.status_code == 403:
-            return JSONResponse({"error": "API Key 权限不足或余额不足"}, status_code=403)
-        elif response.status_code == 429:
-            return JSONResponse({"error": "请求过于频繁，请稍后重试"}, status_code=429)
-        elif response.status_code != 200:
-            try:
-                error_detail = response.json()
-                error_msg = error_detail.get('error', {}).get('message', response.text)
-            except:
-                error_msg = response.text
-            return JSONResponse({"error": f"OpenRouter错误: {error_msg}"}, status_code=response.status_code)
-
-        response_json = response.json()
-        print(f"OpenRouter响应内容: {response_json}")
-
-        # 安全地提取内容
-        if 'choices' not in response_json or not response_json['choices']:
-            return JSONResponse({"error": "OpenRouter响应格式异常：缺少choices"}, status_code=500)
-
-        choice = response_json['choices'][0]
-        if 'message' not in choice or 'content' not in choice['message']:
-            return JSONResponse({"error": "OpenRouter响应格式异常：缺少message内容"}, status_code=500)
-
-        content = choice['message']['content']
-        return JSONResponse({"content": content})
-
-    except requests.exceptions.Timeout:
-        error_msg = "请求超时，请检查网络连接"
-        print(error_msg)
-        return JSONResponse({"error": error_msg}, status_code=408)
-    except requests.exceptions.ConnectionError:
-        error_msg = "网络连接失败，请检查网络或代理设置"
-        print(error_msg)
-        return JSONResponse({"error": error_msg}, status_code=503)
-    except requests.exceptions.RequestException as e:
-        error_msg = f"网络请求异常: {str(e)}"
-        print(error_msg)
-        return JSONResponse({"error": error_msg}, status_code=500)
+        store = get_conversation_store()
+        session_id = payload.get("session_id")
+        if session_id is None and payload.get("session"):
+            session_id = store.new_session_id()
+        if session_id is not None and not store.valid_session_id(session_id):
+            return JSONResponse({"error": "session_id 无效"}, status_code=400)
+        if session_id and not store.accessible(session_id, api_key):
+            # 会话属于其他 API Key 时按不存在处理，不泄露会话是否存在
+            return JSONResponse({"error": "会话不存在或已过期"}, status_code=404)
+        if session_id and payload.get("reset"):
+            store.delete(session_id, api_key)
+        if session_id:
+            # 只压缩服务端保存的会话历史；无会话的请求由客户端自行管理上下文，原样发往上游
+            messages = await store.prepare(messages, session_id, api_key)
+        session = {"session_id": session_id} if session_id else {}
+
+        provider = payload.get("provider")
+        priority = payload.get("priority", "normal")
+        cache_key = llm_cache_key(f"{provider}:{model}" if provider else model, messages)
+        bypass = (x_cache_bypass or "").strip().lower() in ("1", "true", "yes", "on")
+        if payload.get("stream"):
+            return await ai_chat_stream(api_key, model, messages, request_start, cache_key, bypass,
+                                        provider, priority, session_id)
+
+        content, cache_status = await generate_completion(
+            api_key, model, messages, cache_key, bypass=bypass, provider=provider, priority=priority
+        )
+        if cache_status in ("hit", "coalesced"):
+            print(f"[AI聊天] 响应缓存: {cache_status}, 耗时: {time.time() - request_start:.2f}秒")
+        if session_id:
+            store.save(session_id, messages, content, api_key)
+        return JSONResponse({"content": content, **session}, headers={"X-Cache": cache_status.upper()})
+
+    except (llm_client.UpstreamError, LLMRateLimited) as e:
+        print(e.msg)
+        return JSONResponse({"error": e.msg}, status_code=e.code)
     except KeyError as e:
         error_msg = f"响应格式异常: {str(e)}"
         print(error_msg)
@@ -281,14 +643,186 @@ async def ai_chat(payload: dict = Body(...), x_openrouter_key: Optional[str] = H
         print(error_msg)
         return JSONResponse({"error": error_msg}, status_code=500)
 
+PIPELINE_MAX_VARIANTS = env_int("PIPELINE_MAX_VARIANTS", 5)
+
+
+async def run_pipeline_variant(req: PipelineRequest, api_key: Optional[str], messages: list, variant: int,
+                               client_id: Optional[str], bypass: bool, emit) -> dict:
+    """
+    执行流水线中的一个候选：生成 → 清理（提取代码，同前端 sanitize）→ 预检（中文比例 + 编译检查）→ 执行
+    每个阶段开始与结束时通过 emit 推送 stage 事件，返回该候选的报告
+    """
+    timings = {}
+    report = {"variant": variant, "passed": False, "code": None, "timings": timings}
+
+    async def stage(name: str, status: str, **extra):
+        timings[name] = time.time() - started
+        await emit("stage", {"variant": variant, "stage": name, "status": status, "elapsed": timings[name], **extra})
+
+    # 多个候选各自缓存：重复提交同一流水线时复用已生成的候选，X-Cache-Bypass 时重新生成
+    cache_model = f"{req.provider}:{req.model}" if req.provider else req.model
+    cache_key = llm_cache_key(f"{cache_model}#{variant}" if variant else cache_model, messages)
+
+    started = time.time()
+    await emit("stage", {"variant": variant, "stage": "generate", "status": "started"})
+    try:
+        content, cache_status = await generate_completion(
+            api_key, req.model, messages, cache_key, bypass=bypass,
+            provider=req.provider, priority=req.priority or "normal"
+        )
+    except (llm_client.UpstreamError, LLMRateLimited) as e:
+        await stage("generate", "error", error=e.msg, code=e.code)
+        report["result"] = error_response(e.code, e.msg, e.msg, "generate_error").dict()
+        return report
+    await stage("generate", "done", cache=cache_status, chars=len(content or ""))
+
+    # 模型回复中的说明文字与 Markdown 围栏先清理掉，再按 /run-code 的规则预检
+    started = time.time()
+    code = clean_code_content(content or "")
+    await stage("sanitize", "done", chars=len(code))
+
+    started = time.time()
+    try:
+        runner, cleaned_code = preflight.prepare_code(code, req.runner)
+    except SyntaxError as e:
+        await stage("preflight", "error", error=f"语法错误: {e.msg}", code=400)
+        report["result"] = syntax_error_response(e).dict()
+        return report
+    except ValueError as e:
+        await stage("preflight", "error", error=str(e), code=400)
+        report["result"] = error_response(400, f"参数错误: {str(e)}", str(e), "parameter_error").dict()
+        return report
+    report["code"] = cleaned_code
+    await stage("preflight", "done", runner=runner, chars=len(cleaned_code))
+
+    started = time.time()
+    await emit("stage", {"variant": variant, "stage": "execute", "status": "started"})
+    timeout_value = max(5, req.timeout or 30)
+    try:
+        result = await get_script_executor().execute_script_async(
+            code=cleaned_code,
+            runner=runner,
+            timeout=timeout_value,
+            client_id=client_id,
+            use_cache=req.use_cache is not False
+        )
+    except AdmissionRejected as e:
+        await stage("execute", "error", error=e.msg, code=e.code)
+        report["result"] = error_response(e.code, e.msg, e.msg, e.reason, status="rejected").dict()
+        return report
+    response = execution_response(result, timeout_value, req.include_output is not False)
+    report["passed"] = response.code == 200
+    report["result"] = response.dict()
+    await stage("execute", "done", status_code=response.code, execution_time=result.execution_time)
+    return report
+
+
+def pipeline_rank(report: dict) -> tuple:
+    """候选排序：通过的优先，其次通过的用例多、执行时间短"""
+    data = (report.get("result") or {}).get("data") or {}
+    summary = data.get("test_summary") or {}
+    return (not report["passed"], -(summary.get("passed") or 0), data.get("execution_time") or float("inf"))
+
+
+# AI 测试流水线路由 - 生成 → 清理/编译检查 → 执行 → 报告，一次请求完成，以 SSE 推送各阶段进度
+@core_router.post("/ai/pipeline")
+async def ai_pipeline(
+    req: PipelineRequest,
+    request: Request,
+    x_openrouter_key: Optional[str] = Header(None),
+    x_client_id: Optional[str] = Header(None),
+    x_cache_bypass: Optional[str] = Header(None)
+):
+    """
+    AI 测试流水线接口，代替前端 /ai/chat → 本地清理 → /run-code 的多次往返
+    variants 大于 1 时并发生成并执行多个候选脚本
+    事件类型: stage（data 为 {"variant", "stage": generate / sanitize / preflight / execute, "status": started / done / error, ...}），
+    report（data 为 {"variants": 各候选的代码与 /run-code 结构的结果, "passed", "best", "total_time"}）
+    参数错误时直接返回 JSON 错误（与 /ai/chat 一致）
+    """
+    request_start = time.time()
+    print(f"[AI流水线] 收到请求: model={req.model}, messages={len(req.messages)}, variants={req.variants}")
+    try:
+        api_key = resolve_api_key(x_openrouter_key, req.api_key)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if not req.model:
+        return JSONResponse({"error": "model 参数缺失"}, status_code=400)
+    if not req.messages:
+        return JSONResponse({"error": "messages 参数缺失"}, status_code=400)
+    variants = req.variants or 1
+    if not 1 <= variants <= PIPELINE_MAX_VARIANTS:
+        return JSONResponse({"error": f"variants 应在 1 到 {PIPELINE_MAX_VARIANTS} 之间"}, status_code=400)
+
+    # 流水线不使用服务端会话，客户端提供的上下文原样发往上游（与无会话的 /ai/chat 一致）
+    messages = list(req.messages)
+    client_id = resolve_client_id(request, x_client_id)
+    bypass = (x_cache_bypass or "").strip().lower() in ("1", "true", "yes", "on")
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def emit(event: str, data: dict):
+        await events.put(sse_event(event, data))
+
+    async def event_stream():
+        tasks = [
+            asyncio.ensure_future(run_pipeline_variant(req, api_key, messages, i, client_id, bypass, emit))
+            for i in range(variants)
+        ]
+        gathered = asyncio.ensure_future(asyncio.gather(*tasks, return_exceptions=True))
+        try:
+            while not (gathered.done() and events.empty()):
+                getter = asyncio.ensure_future(events.get())
+                await asyncio.wait({getter, gathered}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+
+            reports = []
+            for i, report in enumerate(gathered.result()):
+                if isinstance(report, BaseException):
+                    print(f"[AI流水线] 候选 {i} 异常: {report}")
+                    report = {"variant": i, "passed": False, "code": None, "timings": {},
+                              "result": error_response(500, f"执行失败: {str(report)}", str(report),
+                                                       "pipeline_error").dict()}
+                reports.append(report)
+            best = min(reports, key=pipeline_rank)
+            passed = sum(1 for report in reports if report["passed"])
+            print(f"[AI流水线] 完成: {passed}/{len(reports)} 个候选通过, 耗时: {time.time() - request_start:.2f}秒")
+            yield sse_event("report", {
+                "variants": reports,
+                "passed": passed,
+                "best": best["variant"],
+                "total_time": time.time() - request_start,
+            })
+        finally:
+            # 客户端中途断开时取消仍在进行的生成与执行
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # ============== 七、挂载蓝图 ==============
 app.include_router(core_router)
 
-# ============== 八、启动入口 ==============
-if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+@app.on_event("startup")
+async def startup():
+    # 预热脚本执行工作进程池
+    await get_script_executor().start()
+    # 创建共享 HTTP 客户端（连接池）与上游 LLM 路由
+    get_http_client()
+    get_llm_router()
 
 
 @app.on_event("shutdown")
-def shutdown():
+async def shutdown():
+    cleanup_job_manager()
+    cleanup_batch_runner()
     cleanup_executor()
+    await cleanup_llm_router()
+    await cleanup_http_client()
+
+# ============== 八、启动入口 ==============
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=8000)
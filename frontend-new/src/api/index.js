@@ -41,6 +41,62 @@ export const testAPI = {
     return api.post('/run-code', { code, runner, timeout }, {
       timeout: 90000  // 前端超时时间设为90秒，给后端足够时间
     })
+  },
+
+  // 流式执行：通过 SSE 逐块接收 stdout/stderr，onEvent(event, data)，返回最终结果
+  runCodeStream: async (code, runner = 'python', timeout = 60, onEvent = () => {}) => {
+    const response = await fetch('/api/run-code/stream', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ code, runner, timeout })
+    })
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    let result = null
+    while (true) {
+      const { done, value } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+      const events = buffer.split('\n\n')
+      buffer = events.pop()
+      for (const raw of events) {
+        const event = raw.match(/^event: (.*)$/m)?.[1]
+        const data = raw.match(/^data: (.*)$/m)?.[1]
+        if (!event || data === undefined) continue
+        const payload = JSON.parse(data)
+        if (event === 'result') result = payload
+        onEvent(event, payload)
+      }
+    }
+    return result
+  },
+
+  // 异步任务：提交后立即返回任务ID，通过轮询获取结果
+  submitJob: (code, runner = 'python', timeout = 60) => {
+    return api.post('/jobs', { code, runner, timeout })
+  },
+
+  getJob: (jobId) => {
+    return api.get(`/jobs/${jobId}`)
+  },
+
+  cancelJob: (jobId) => {
+    return api.delete(`/jobs/${jobId}`)
+  },
+
+  // 以任务方式执行并轮询，返回与 runCode 相同结构的结果
+  runCodeAsJob: async (code, runner = 'python', timeout = 60, interval = 1000) => {
+    const submitted = await testAPI.submitJob(code, runner, timeout)
+    const jobId = submitted.data?.data?.job_id
+    if (!jobId) return submitted.data
+    while (true) {
+      await new Promise(resolve => setTimeout(resolve, interval))
+      const response = await testAPI.getJob(jobId)
+      const job = response.data?.data
+      if (!job) return response.data
+      if (job.status !== 'pending' && job.status !== 'running') return job.result
+    }
   }
 }
 
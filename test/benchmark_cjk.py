@@ -0,0 +1,74 @@
+"""
+汉字计数性能基准
+对比 len(re.findall(...)) 与 count_cjk 在纯 ASCII、中英混合、纯中文文本上的耗时，并校验计数一致
+
+用法: python test/benchmark_cjk.py [字符数 ...]   （默认 10000 100000 1000000）
+"""
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from app.sanitizer import count_cjk
+
+_LEGACY_CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+
+
+def legacy_count_cjk(text: str) -> int:
+    """原实现：为每个匹配的汉字创建一个字符串对象"""
+    return len(_LEGACY_CJK_RE.findall(text))
+
+
+def generate(kind: str, size: int, seed: int = 0) -> str:
+    """生成指定类型的文本：ascii 纯 ASCII 代码、mixed 中英混合（约 10% 汉字）、cjk 纯中文"""
+    rng = random.Random(seed)
+    if kind == "ascii":
+        return "".join(rng.choice("abcdefghij (){}[]:=._'\n    ") for _ in range(size))
+    ratio = 0.1 if kind == "mixed" else 1.0
+    return "".join(
+        chr(rng.randint(0x4E00, 0x9FFF)) if rng.random() < ratio else rng.choice("abc xyz=()\n")
+        for _ in range(size)
+    )
+
+
+def fuzz(cases: int = 2000, seed: int = 1) -> int:
+    """随机组合边界字符校验计数一致性，返回不一致的用例数"""
+    rng = random.Random(seed)
+    alphabet = ["a", " ", "\n", "一", "鿿", "䷿", "ꀀ", "　", "é", "\U0001f600",
+                "\U00024e00", "\U0009e000", "\ud800", "\udc00", "，", "中文"]
+    mismatches = 0
+    for _ in range(cases):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        if count_cjk(text) != legacy_count_cjk(text):
+            mismatches += 1
+    return mismatches
+
+
+def bench(func, text: str, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(sizes):
+    print(f"fuzz mismatches: {fuzz()}")
+    print(f"{'kind':>6} {'chars':>8} {'findall(ms)':>12} {'count(ms)':>10} {'speedup':>8} identical")
+    for kind in ("ascii", "mixed", "cjk"):
+        for size in sizes:
+            text = generate(kind, size)
+            identical = count_cjk(text) == legacy_count_cjk(text)
+            legacy = bench(legacy_count_cjk, text)
+            engine = bench(count_cjk, text)
+            print(f"{kind:>6} {size:>8} {legacy * 1000:>12.3f} {engine * 1000:>10.3f} "
+                  f"{legacy / max(engine, 1e-9):>7.1f}x {identical}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000])
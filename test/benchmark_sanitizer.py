@@ -0,0 +1,152 @@
+"""
+clean_code_content 性能基准
+对比逐行多次正则的原实现与预编译单遍实现，并校验两者输出逐字节一致
+
+用法: python test/benchmark_sanitizer.py [行数 ...]   （默认 10000 50000 100000）
+"""
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from app.sanitizer import clean_code_content
+
+
+def legacy_clean_code_content(code: str) -> str:
+    """原实现（作为正确性与性能基准，请勿修改）"""
+    if not code:
+        return ""
+    
+    # 移除代码块标记（```html, ```python等）
+    code = re.sub(r'^```\w*\s*\n?', '', code, flags=re.MULTILINE)
+    # 修复未闭合的正则：删除任意位置的 ``` 及后续可选换行
+    code = re.sub(r'```\n?', '', code)
+    
+    lines = code.split('\n')
+    cleaned_lines = []
+    
+    # AI生成建议的模式
+    ai_suggestion_patterns = [
+        r'这段代码',
+        r'以上代码',
+        r'这个.*实现了',
+        r'注意.*事项',
+        r'建议.*使用',
+        r'可以.*优化',
+        r'推荐.*方式',
+        r'另外.*可以',
+        r'如果.*需要',
+        r'当.*时候',
+        r'为了.*安全',
+        r'确保.*正确',
+        r'避免.*问题'
+    ]
+    
+    for line in lines:
+        stripped_line = line.strip()
+        
+        # 跳过空行
+        if not stripped_line:
+            continue
+        
+        # 跳过AI生成的建议行（中文字符占比超过30%且包含建议模式）
+        chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', stripped_line))
+        if chinese_chars > len(stripped_line) * 0.3:
+            # 检查是否包含AI建议模式
+            if any(re.search(pattern, stripped_line) for pattern in ai_suggestion_patterns):
+                continue
+        
+        # 跳过纯中文注释行（中文字符占比超过60%的行）
+        if chinese_chars > len(stripped_line) * 0.6 and not stripped_line.startswith('#'):
+            continue
+        
+        # 移除不可见字符和问题字符（保留常用空白字符）
+        # 移除控制字符
+        cleaned_line = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', line)
+        # 移除零宽字符和其他问题字符
+        cleaned_line = re.sub(r'[\u200B-\u200D\uFEFF\u00A0\u2000-\u200A\u2028\u2029]', '', cleaned_line)
+        # 移除可能导致编码问题的字符
+        cleaned_line = re.sub(r'[\uFFFD\uFFFE\uFFFF]', '', cleaned_line)
+        # 移除非打印字符（除了常见的空白字符）
+        cleaned_line = re.sub(r'[^\x20-\x7E\u4e00-\u9fff\t\n\r]', '', cleaned_line)
+        
+        cleaned_lines.append(cleaned_line)
+    
+    # 合并行并移除多余的连续空行
+    result = '\n'.join(cleaned_lines)
+    result = re.sub(r'\n{3,}', '\n\n', result)
+    
+    # 移除首尾空白
+    result = result.strip()
+    
+    return result
+
+
+# 典型的 AI 生成测试脚本片段：代码、中文注释、建议说明、代码块标记与问题字符
+SAMPLE_LINES = [
+    "import pytest",
+    "import requests",
+    "",
+    "class TestUserApi:",
+    "    def test_login(self):",
+    "        resp = requests.post(BASE_URL + '/login', json={'user': 'admin'})",
+    "        assert resp.status_code == 200  # 登录成功",
+    "        # 校验返回的令牌",
+    "        assert 'token' in resp.json()",
+    "这段代码实现了用户登录接口的测试",
+    "注意：运行前需要启动后端服务事项",
+    "测试用例说明文字测试用例说明文字",
+    "```python",
+    "```",
+    "    value = 'a\u200bb\u00a0c'\x07",
+    "    text = '中文字符串'  ",
+    "   \t  ",
+    "\x00\x01",
+    "print('done')\r",
+]
+
+
+def generate(lines: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    return "\n".join(rng.choice(SAMPLE_LINES) for _ in range(lines))
+
+
+def fuzz(cases: int = 2000, seed: int = 1) -> int:
+    """随机组合字符校验一致性，返回不一致的用例数"""
+    rng = random.Random(seed)
+    alphabet = ["a", "1", " ", "\t", "\n", "\r", "#", "`", "```", "```py\n", "\n\n\n", "中", "这段代码", "实现了",
+                "这个", "\x00", "\x0b", "\x1c", "\x7f", "\u200b", "\u00a0", "\u3000", "\ufffd", "é", "😀", "\u2028"]
+    mismatches = 0
+    for _ in range(cases):
+        code = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        if clean_code_content(code) != legacy_clean_code_content(code):
+            mismatches += 1
+    return mismatches
+
+
+def bench(func, code: str, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(code)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(sizes):
+    print(f"fuzz mismatches: {fuzz()}")
+    print(f"{'lines':>8} {'legacy(s)':>10} {'engine(s)':>10} {'speedup':>8} identical")
+    for lines in sizes:
+        code = generate(lines)
+        identical = clean_code_content(code) == legacy_clean_code_content(code)
+        legacy = bench(legacy_clean_code_content, code)
+        engine = bench(clean_code_content, code)
+        print(f"{lines:>8} {legacy:>10.4f} {engine:>10.4f} {legacy / engine:>7.1f}x {identical}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 50000, 100000])
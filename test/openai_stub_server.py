@@ -0,0 +1,93 @@
+"""
+本地 OpenAI 兼容桩服务
+实现 POST /v1/chat/completions（完整响应与 SSE 流式响应），可配置延迟、状态码与回复内容，
+作为 LLM 路由（故障转移、对冲、延迟选路）测试的上游；也可以单独启动，把 /ai/chat 指向它做联调
+
+用法: python test/openai_stub_server.py [端口]   （默认 8001）
+      LLM_PROVIDERS=stub LLM_PROVIDER_STUB_URL=http://127.0.0.1:8001/v1 python backend/main.py
+"""
+
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer:
+    """
+    在后台线程运行的桩服务，属性可在测试中随时修改
+
+    Attributes:
+        reply (str): 回复内容，默认为 "<name>:<model>"
+        delay (float): 返回响应前等待的秒数
+        status (int): 非 200 时返回 {"error": {"message": ...}}
+        requests (list): 收到的请求体
+    """
+
+    def __init__(self, name: str = "stub", port: int = 0):
+        self.name = name
+        self.reply = None
+        self.delay = 0.0
+        self.status = 200
+        self.requests = []
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                stub.requests.append(body)
+                if self.path.rstrip("/") != "/v1/chat/completions":
+                    return self._send(404, json.dumps({"error": {"message": "not found"}}).encode("utf-8"))
+                time.sleep(stub.delay)
+                if stub.status != 200:
+                    error = {"error": {"message": f"{stub.name} returned {stub.status}"}}
+                    return self._send(stub.status, json.dumps(error).encode("utf-8"))
+                content = stub.reply if stub.reply is not None else f"{stub.name}:{body.get('model')}"
+                if not body.get("stream"):
+                    response = {"choices": [{"message": {"role": "assistant", "content": content}}]}
+                    return self._send(200, json.dumps(response).encode("utf-8"))
+                events = [{"choices": [{"delta": {"content": content[i:i + 4]}}]} for i in range(0, len(content), 4)]
+                stream = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+                self._send(200, stream.encode("utf-8"), "text/event-stream")
+
+        return Handler
+
+    def start(self) -> "StubServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    server = StubServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8001)
+    print(f"OpenAI 兼容桩服务: {server.url}/chat/completions")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
@@ -2,6 +2,8 @@
 后端 API 单元测试
 测试后端核心功能模块
 """
+import asyncio
+import time
 import pytest
 import sys
 import os
@@ -9,7 +11,22 @@ import os
 # 添加后端模块路径
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
 
-from app.sanitizer import clean_code_content, validate_chinese_ratio, sanitize_input, detect_code_language
+from app.sanitizer import clean_code_content, count_cjk, iter_clean_code, validate_chinese_ratio, sanitize_input, detect_code_language
+from app.script_executor import ScriptExecutor, ExecutionStatus, ExecutionResult, OutputChunk
+from app.worker_pool import WorkerPool, WorkerPoolConfig
+from app.admission import AdmissionController, AdmissionConfig, AdmissionRejected
+from app.output_buffer import OutputBuffer
+from app.preflight import PreflightCache, PreflightConfig, prepare_code
+from app.code_analysis import analyze_code
+from app.import_stats import ImportStats
+from app.cache import LRUCache
+from app.result_cache import ResultCacheConfig, result_cache_key
+from app.job_store import JobManager
+from app.batch_runner import BatchRunner, BatchConfig, BatchItem
+from app.pytest_report import TestCaseResult, summarize_results
+from app.pytest_sharding import PytestSharder, ShardingConfig, parse_collected_ids
+from app.resource_limits import ResourceLimitsConfig
+from app.process_reaper import GROUP_KILL_SUPPORTED, ReaperConfig, SessionReaper, process_groups, process_identity
 
 
 class TestCleanCodeContent:
@@ -34,6 +51,58 @@ class TestCleanCodeContent:
         assert "```" not in result
         assert "print" in result
 
+    def test_matches_legacy_implementation(self):
+        """测试预编译单遍实现与原实现输出逐字节一致"""
+        from benchmark_sanitizer import fuzz, generate, legacy_clean_code_content
+        assert fuzz(cases=500) == 0
+        code = generate(2000)
+        assert clean_code_content(code) == legacy_clean_code_content(code)
+
+    @pytest.mark.parametrize("size", [1, 7, 64])
+    def test_streaming_matches_full_clean(self, size):
+        """测试流式清理在任意切分下与整体清理结果一致"""
+        from benchmark_sanitizer import generate
+        code = generate(500, seed=size) + "\n```python   \n\n  \tx = 1\nprint(x)```\n```py\nz()"
+        chunks = [code[i:i + size] for i in range(0, len(code), size)]
+        assert "".join(iter_clean_code(chunks)) == clean_code_content(code)
+        assert "".join(iter_clean_code(code.splitlines(keepends=True))) == clean_code_content(code)
+        assert "".join(iter_clean_code([])) == ""
+
+    def test_streaming_is_lazy(self):
+        """测试流式清理边读边产出，不等待全部输入"""
+        consumed = []
+
+        def source():
+            for i in range(10000):
+                consumed.append(i)
+                yield f"print({i})\n"
+
+        stream = iter_clean_code(source())
+        assert next(stream) == "print(0)"
+        assert len(consumed) < 10
+
+    def test_streaming_indented_block_is_bounded(self):
+        """测试缩进的代码块（如很长的类体）同样边读边产出，缓存不随代码块长度增长"""
+        consumed = []
+
+        def source():
+            yield "```python\nclass TestX:\n"
+            for i in range(10000):
+                consumed.append(i)
+                yield f"    def test_{i}(self):\n        assert {i}\n"
+            yield "```\n"
+
+        lag = 0
+        pieces = []
+        for piece in iter_clean_code(source()):
+            pieces.append(piece)
+            if piece.startswith("\n    def test_"):
+                lag = max(lag, len(consumed) - int(piece[len("\n    def test_"):].split("(")[0]))
+        assert lag <= 2
+        code = "```python\nclass TestX:\n" + "".join(
+            f"    def test_{i}(self):\n        assert {i}\n" for i in range(10000)) + "```\n"
+        assert "".join(pieces) == clean_code_content(code)
+
     def test_clean_multiline_code(self):
         """测试多行代码清理"""
         code = """
@@ -117,6 +186,15 @@ class TestValidateChineseRatio:
         is_valid, ratio = validate_chinese_ratio(code, max_ratio=0.2)
         assert is_valid is False
 
+    def test_count_cjk_matches_regex(self):
+        """测试汉字计数与正则计数一致（含代理对、全角空格等边界字符）"""
+        from benchmark_cjk import fuzz, generate, legacy_count_cjk
+        assert fuzz(cases=500) == 0
+        for kind in ("ascii", "mixed", "cjk"):
+            text = generate(kind, 5000)
+            assert count_cjk(text) == legacy_count_cjk(text)
+        assert count_cjk("中文abc\U00024e00") == 2
+
 
 class TestSanitizeInput:
     """测试输入净化功能"""
@@ -260,3 +338,1804 @@ def test_parametrized(x, y, expected):
         except SyntaxError:
             valid = False
         assert valid is True
+
+
+class TestPreflightCache:
+    """测试预检结果缓存"""
+
+    def test_resubmission_hits_cache(self):
+        """测试重复提交命中缓存，结果与首次一致"""
+        cache = PreflightCache(PreflightConfig(max_entries=8))
+        code = "```python\nprint('hi')\n```"
+        assert prepare_code(code, "pytest", cache=cache) == ("pytest", "print('hi')")
+        assert prepare_code(code, None, cache=cache) == ("python", "print('hi')")
+        stats = cache.stats()
+        assert stats["hits"] == 1 and stats["misses"] == 1 and stats["entries"] == 1
+
+    def test_failures_are_cached(self):
+        """测试语法错误与中文比例过高的结果同样缓存，每次抛出新的异常对象"""
+        cache = PreflightCache(PreflightConfig(max_entries=8))
+        errors = []
+        for _ in range(2):
+            with pytest.raises(SyntaxError) as exc_info:
+                prepare_code("def f(:\n    pass", cache=cache)
+            errors.append(exc_info.value)
+            with pytest.raises(ValueError, match="中文字符比例过高"):
+                prepare_code("中文中文中文 = 1", cache=cache)
+        assert errors[0] is not errors[1]
+        assert errors[1].lineno == errors[0].lineno
+        assert cache.stats()["hits"] == 2
+
+    def test_bounded_memory(self):
+        """测试按条目数与总大小淘汰"""
+        cache = PreflightCache(PreflightConfig(max_entries=100, max_bytes=4096))
+        for i in range(50):
+            prepare_code(f"x = {i}\n" + "# padding\n" * 50, cache=cache)
+        stats = cache.stats()
+        assert stats["bytes"] <= 4096
+        assert stats["evictions"] > 0
+
+    def test_disabled(self):
+        """测试条目数为 0 时不缓存"""
+        cache = PreflightCache(PreflightConfig(max_entries=0))
+        prepare_code("print(1)", cache=cache)
+        prepare_code("print(1)", cache=cache)
+        assert cache.stats()["enabled"] is False
+        assert cache.stats()["entries"] == 0
+
+
+class TestCodeAnalysis:
+    """测试基于 AST 的脚本结构分析"""
+
+    def test_detects_pytest_tests(self):
+        """测试识别测试函数、测试类与 pytest 导入"""
+        assert analyze_code("def test_a():\n    pass").has_pytest_tests
+        assert analyze_code("async def test_a():\n    pass").has_pytest_tests
+        assert analyze_code("class TestApi:\n    pass").has_pytest_tests
+        assert analyze_code("from pytest import fixture").has_pytest_tests
+        assert analyze_code("import pytest.mark").has_pytest_tests
+
+    def test_ignores_text_in_strings(self):
+        """测试字符串中的 def test_ 不会被误判为测试"""
+        analysis = analyze_code('doc = """\ndef test_x():\n"""\nprint(doc)')
+        assert analysis.has_pytest_tests is False
+        assert analysis.language == "python"
+
+    def test_main_guard_and_imports(self):
+        """测试识别 __main__ 入口与顶层模块名"""
+        code = ("import os.path, json\nfrom requests.adapters import HTTPAdapter\nfrom . import x\n"
+                "def f():\n    import yaml\nif '__main__' == __name__:\n    f()\n")
+        analysis = analyze_code(code)
+        assert analysis.has_main_guard is True
+        assert analysis.imports == ("json", "os", "requests", "yaml")
+        assert analyze_code("def f():\n    if __name__ == '__main__':\n        pass").has_main_guard is False
+
+    def test_unparsable_code_falls_back(self):
+        """测试语法错误的代码回退到文本匹配"""
+        analysis = analyze_code("def test_a(:\n    pass")
+        assert analysis.parsed is False
+        assert analysis.has_pytest_tests is True
+
+    def test_preflight_reuses_analysis(self):
+        """测试预检时生成的分析结果按清理后代码缓存，执行器查询时直接命中"""
+        cache = PreflightCache(PreflightConfig(max_entries=8))
+        _, cleaned = prepare_code("```python\nimport pytest\ndef test_a():\n    assert 1\n```", "pytest", cache=cache)
+        analysis = cache.analysis(cleaned)
+        assert analysis.has_pytest_tests and analysis.imports == ("pytest",)
+        assert cache.stats()["analysis"]["hits"] == 1
+        assert cache.stats()["analysis"]["misses"] == 0
+
+
+@pytest.mark.skipif(not WorkerPool.supported(), reason="预热工作进程池仅支持 POSIX 平台")
+class TestWorkerPool:
+    """测试预热工作进程池"""
+
+    @staticmethod
+    def _executor(**kwargs):
+        config = WorkerPoolConfig(size=1, health_interval=0, preload=["json"], **kwargs)
+        return ScriptExecutor(pool_config=config)
+
+    def test_pooled_execution_result(self):
+        """测试预热执行的输出与退出码"""
+        async def run():
+            executor = self._executor()
+            try:
+                ok = await executor.execute_script_async("print(__name__)")
+                failed = await executor.execute_script_async("import sys\nprint('bad', file=sys.stderr)\nsys.exit(3)")
+                return ok, failed, executor.get_stats()
+            finally:
+                executor.stop_all_processes()
+
+        ok, failed, stats = asyncio.run(run())
+        assert ok.status == ExecutionStatus.COMPLETED
+        assert ok.exit_code == 0
+        assert ok.stdout.strip() == "__main__"
+        assert failed.exit_code == 3
+        assert "bad" in failed.stderr
+        assert stats["worker_pool"]["jobs_served"] == 2
+
+    def test_pooled_execution_timeout(self):
+        """测试预热执行超时后终止任务进程"""
+        async def run():
+            executor = self._executor()
+            try:
+                return await executor.execute_script_async("import time\nprint('started', flush=True)\ntime.sleep(30)",
+                                                            timeout=1)
+            finally:
+                executor.stop_all_processes()
+
+        result = asyncio.run(run())
+        assert result.status == ExecutionStatus.TIMEOUT
+        # 超时前的输出保留，超时说明附在错误输出中
+        assert result.stdout == "started\n"
+        assert "执行超时" in result.stderr
+        assert result.exit_code == -1
+
+    def test_worker_recycled_after_max_jobs(self):
+        """测试工作进程达到任务上限后被回收"""
+        async def run():
+            executor = self._executor(max_jobs=1)
+            try:
+                await executor.execute_script_async("print(1)")
+                await asyncio.sleep(0.5)
+                return executor.get_stats()["worker_pool"]
+            finally:
+                executor.stop_all_processes()
+
+        stats = asyncio.run(run())
+        assert stats["recycled"] == 1
+        assert stats["spawned"] == 2
+
+    def test_preload_reports_import_time_saved(self):
+        """测试脚本导入已预导入的模块时上报节省的导入耗时，冷启动为 0"""
+        async def run():
+            config = WorkerPoolConfig(size=1, health_interval=0, preload=["decimal"], adaptive_preload=0)
+            executor = ScriptExecutor(pool_config=config)
+            try:
+                warm = await executor.execute_script_async("import decimal\nprint(decimal.Decimal(1))")
+                busy = executor.worker_pool.acquire()
+                cold = await executor.execute_script_async("import decimal\nprint(2)", use_cache=False)
+                executor.worker_pool.release(busy)
+                return warm, cold, executor.get_stats()["worker_pool"]
+            finally:
+                executor.stop_all_processes()
+
+        warm, cold, stats = asyncio.run(run())
+        assert warm.stdout.strip() == "1"
+        assert warm.import_time_saved > 0
+        assert cold.import_time_saved == 0
+        assert stats["import_time_saved"] == warm.import_time_saved
+
+    def test_adaptive_preload_follows_imports(self):
+        """测试常见导入被追加到预导入列表，健康检查时替换预导入过时的工作进程"""
+        async def run():
+            config = WorkerPoolConfig(size=1, health_interval=0, preload=[], adaptive_preload=2,
+                                      preload_min_share=0.5)
+            executor = ScriptExecutor(pool_config=config)
+            try:
+                await executor.start()
+                first = await executor.execute_script_async("import decimal, no_such_module_xyz")
+                await executor.worker_pool.check_health()
+                second = await executor.execute_script_async("import decimal\nprint(3)")
+                return first, second, executor.get_stats()["worker_pool"], executor.worker_pool.import_stats
+            finally:
+                executor.stop_all_processes()
+
+        first, second, stats, import_stats = asyncio.run(run())
+        # 可导入判断使用工作进程上报的 sys.path（首项为 pool_worker.py 所在目录）
+        assert os.path.basename(import_stats.search_path[0]) == "app"
+        assert first.import_time_saved == 0
+        assert second.import_time_saved > 0
+        assert stats["adaptive_preload"] == ["decimal"]
+        assert stats["recycled"] == 1
+
+
+class TestImportStats:
+    """测试导入统计"""
+
+    def test_sliding_window_and_top(self):
+        """测试按窗口计数，只返回可导入且出现比例达标的模块"""
+        stats = ImportStats(window=4)
+        for modules in (["json", "os"], ["json", "this"], ["json", "not_installed_xyz"], ["os", "json"], ["os", "this"]):
+            stats.record(modules)
+        assert stats.counts == {"json": 3, "this": 2, "not_installed_xyz": 1, "os": 2}
+        assert stats.top(5, min_share=0.5) == ["json", "os"]
+        assert stats.top(5, min_share=0.75) == ["json"]
+        assert stats.top(1) == ["json"]
+        assert stats.top(0) == []
+
+    def test_candidates_limited_to_stdlib_and_allow_list(self):
+        """测试候选只限标准库与允许列表，是否可导入按工作进程的 sys.path 判断"""
+        backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+        worker_path = [os.path.join(backend_dir, "app")] + [
+            p for p in sys.path if p and os.path.abspath(p) != os.path.abspath(backend_dir)]
+        stats = ImportStats(window=10, allow=["pytest", "main"], search_path=worker_path)
+        for _ in range(3):
+            stats.record(["json", "pytest", "requests", "main", "app"])
+        # requests 未在允许列表中；main/app 只在服务进程（backend/ 在 sys.path 上）可导入
+        assert sorted(stats.top(10)) == ["json", "pytest"]
+
+        stats.set_search_path([backend_dir] + worker_path)
+        assert sorted(stats.top(10)) == ["json", "main", "pytest"]
+
+
+class TestAdmissionController:
+    """测试脚本执行准入控制"""
+
+    def test_global_limit_fifo_order(self):
+        """测试超出全局并发时按到达顺序放行"""
+        async def run():
+            controller = AdmissionController(AdmissionConfig(max_concurrent=1, per_client=1, queue_timeout=5))
+            order = []
+
+            async def job(client_id):
+                async with controller.slot(client_id):
+                    order.append(client_id)
+                    await asyncio.sleep(0.01)
+
+            await asyncio.gather(*(job(f"c{i}") for i in range(4)))
+            return order, controller.stats()
+
+        order, stats = asyncio.run(run())
+        assert order == ["c0", "c1", "c2", "c3"]
+        assert stats["admitted"] == 4
+        assert stats["running"] == 0
+
+    def test_per_client_limit_lets_other_clients_pass(self):
+        """测试单客户端达到上限时其他客户端不被阻塞"""
+        async def run():
+            controller = AdmissionController(AdmissionConfig(max_concurrent=4, per_client=1, queue_timeout=5))
+            await controller.acquire("a")
+            waiting = asyncio.ensure_future(controller.acquire("a"))
+            await asyncio.sleep(0)
+            other_wait = await controller.acquire("b")
+            queued = controller.stats()["queued"]
+            controller.release("a")
+            first_wait = await waiting
+            return other_wait, queued, first_wait
+
+        other_wait, queued, first_wait = asyncio.run(run())
+        assert other_wait == 0.0
+        assert queued == 1
+        assert first_wait > 0
+
+    def test_queue_full_rejected(self):
+        """测试队列已满时快速返回 503"""
+        async def run():
+            controller = AdmissionController(AdmissionConfig(max_concurrent=1, max_queue=1, queue_timeout=5))
+            await controller.acquire("a")
+            pending = asyncio.ensure_future(controller.acquire("b"))
+            await asyncio.sleep(0)
+            try:
+                await controller.acquire("c")
+            finally:
+                pending.cancel()
+
+        with pytest.raises(AdmissionRejected) as exc_info:
+            asyncio.run(run())
+        assert exc_info.value.code == 503
+
+    def test_queue_timeout(self):
+        """测试排队超时"""
+        async def run():
+            controller = AdmissionController(AdmissionConfig(max_concurrent=1, queue_timeout=0.05))
+            await controller.acquire("a")
+            try:
+                await controller.acquire("b")
+            finally:
+                assert controller.stats()["queued"] == 0
+
+        with pytest.raises(AdmissionRejected) as exc_info:
+            asyncio.run(run())
+        assert exc_info.value.reason == "queue_timeout"
+
+    def test_executor_reports_queue_wait_time(self):
+        """测试执行结果单独记录排队时间"""
+        async def run():
+            executor = ScriptExecutor(
+                pool_config=WorkerPoolConfig(size=0),
+                admission_config=AdmissionConfig(max_concurrent=1, per_client=1)
+            )
+            return await asyncio.gather(
+                executor.execute_script_async("import time\ntime.sleep(0.3)"),
+                executor.execute_script_async("print('second')"),
+            )
+
+        first, second = asyncio.run(run())
+        assert first.queue_wait_time == 0.0
+        assert second.queue_wait_time >= 0.2
+        assert second.execution_time < second.queue_wait_time + first.execution_time
+
+
+class TestStreamingExecution:
+    """测试流式执行"""
+
+    @staticmethod
+    def _executor():
+        return ScriptExecutor(pool_config=WorkerPoolConfig(size=0), admission_config=AdmissionConfig(max_concurrent=0))
+
+    def test_chunks_arrive_before_exit(self):
+        """测试进程运行期间即可收到输出片段"""
+        code = "import time\nprint('first', flush=True)\ntime.sleep(0.5)\nprint('second')"
+
+        async def run():
+            executor = self._executor()
+            events = []
+            start = asyncio.get_running_loop().time()
+            async for item in executor.stream_script_async(code, timeout=10):
+                events.append((asyncio.get_running_loop().time() - start, item))
+            return events
+
+        events = asyncio.run(run())
+        chunks = [(t, item) for t, item in events if isinstance(item, OutputChunk)]
+        result = events[-1][1]
+        assert isinstance(result, ExecutionResult)
+        assert result.status == ExecutionStatus.COMPLETED
+        assert "".join(item.text for _, item in chunks if item.stream == "stdout") == "first\nsecond\n"
+        first_at = next(t for t, item in chunks if "first" in item.text)
+        assert first_at < events[-1][0] - 0.3
+
+    def test_closing_stream_kills_process(self):
+        """测试消费方提前退出时终止进程"""
+        async def run():
+            executor = self._executor()
+            stream = executor.stream_script_async("import time\nwhile True:\n    print('x', flush=True)\n    time.sleep(0.05)")
+            async for _ in stream:
+                break
+            await stream.aclose()
+            return executor.running_processes
+
+        assert asyncio.run(run()) == {}
+
+
+class TestOutputBuffer:
+    """测试输出截断缓冲"""
+
+    def test_within_limit_passthrough(self):
+        """测试未超过上限时原样透传"""
+        buffer = OutputBuffer(100)
+        assert buffer.feed(b"hello ") == b"hello "
+        assert buffer.feed(b"world") == b"world"
+        assert buffer.finish() == b""
+        assert buffer.truncated is False
+
+    def test_keeps_head_and_tail(self):
+        """测试超过上限时保留头尾并统计丢弃字节"""
+        buffer = OutputBuffer(10)
+        passthrough = b"".join(buffer.feed(bytes([c])) for c in b"abcdefghijklmnopqrstuvwxyz")
+        assert passthrough == b"abcde"
+        assert buffer.bytes_dropped == 16
+        rest = buffer.finish()
+        assert rest.endswith(b"vwxyz")
+        assert "16".encode() in rest
+
+    def test_executor_output_bounded(self):
+        """测试执行器输出受字节上限约束"""
+        async def run():
+            executor = ScriptExecutor(
+                pool_config=WorkerPoolConfig(size=0),
+                admission_config=AdmissionConfig(max_concurrent=0),
+                output_limits={"stdout": 1000, "stderr": 1000}
+            )
+            return await executor.execute_script_async("for i in range(100000):\n    print(i)\nprint('END')")
+
+        result = asyncio.run(run())
+        assert result.truncated is True
+        assert result.bytes_dropped > 500000
+        assert result.stdout.startswith("0\n1\n")
+        assert result.stdout.endswith("END\n")
+        assert len(result.stdout.encode()) < 1100
+
+
+class TestLRUCache:
+    """测试内存 LRU 缓存"""
+
+    def test_evicts_least_recently_used(self):
+        """测试超过条目上限时淘汰最久未使用的条目"""
+        cache = LRUCache(max_entries=2, ttl=0)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.stats()["evictions"] == 1
+
+    def test_expired_entry_removed(self):
+        """测试过期条目不再返回"""
+        cache = LRUCache(max_entries=2, ttl=0.01)
+        cache.set("a", 1)
+        import time
+        time.sleep(0.02)
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_max_bytes(self):
+        """测试总大小上限"""
+        cache = LRUCache(max_entries=10, ttl=0, max_bytes=10, sizeof=len)
+        cache.set("a", "12345")
+        cache.set("b", "12345")
+        cache.set("c", "12345")
+        assert cache.get("a") is None
+        assert cache.stats()["bytes"] == 10
+
+
+class TestResultCache:
+    """测试执行结果缓存"""
+
+    @staticmethod
+    def _executor():
+        return ScriptExecutor(
+            pool_config=WorkerPoolConfig(size=0),
+            admission_config=AdmissionConfig(max_concurrent=0),
+            result_cache_config=ResultCacheConfig(enabled=True)
+        )
+
+    def test_key_uses_timeout_bucket(self):
+        """测试相近超时时间归入同一档位"""
+        assert result_cache_key("print(1)", "python", 25) == result_cache_key("print(1)", "python", 30)
+        assert result_cache_key("print(1)", "python", 30) != result_cache_key("print(1)", "python", 60)
+        assert result_cache_key("print(1)", "python", 30) != result_cache_key("print(1)", "pytest", 30)
+
+    def test_repeated_run_served_from_cache(self):
+        """测试重复提交命中缓存，可按请求跳过缓存"""
+        code = "import time\nprint(time.time())"
+
+        async def run():
+            executor = self._executor()
+            first = await executor.execute_script_async(code)
+            second = await executor.execute_script_async(code)
+            bypass = await executor.execute_script_async(code, use_cache=False)
+            return first, second, bypass
+
+        first, second, bypass = asyncio.run(run())
+        assert first.cached is False
+        assert second.cached is True
+        assert second.stdout == first.stdout
+        assert bypass.cached is False
+        assert bypass.stdout != first.stdout
+
+    def test_timeout_not_cached(self):
+        """测试超时结果不写入缓存"""
+        async def run():
+            executor = self._executor()
+            await executor.execute_script_async("import time\ntime.sleep(5)", timeout=1)
+            return executor.get_stats()["result_cache"]["memory"]["entries"]
+
+        assert asyncio.run(run()) == 0
+
+    def test_memory_bounded_by_output_bytes(self):
+        """测试内存缓存按输出字节数淘汰最早的结果"""
+        async def run():
+            executor = ScriptExecutor(
+                pool_config=WorkerPoolConfig(size=0),
+                admission_config=AdmissionConfig(max_concurrent=0),
+                result_cache_config=ResultCacheConfig(enabled=True, max_bytes=3000)
+            )
+            for i in range(3):
+                await executor.execute_script_async(f"print('{i}' * 1200)")
+            return executor.get_stats()["result_cache"]["memory"]
+
+        memory = asyncio.run(run())
+        assert memory["entries"] == 2
+        assert memory["bytes"] <= 3000
+
+
+class TestJobManager:
+    """测试异步执行任务"""
+
+    @staticmethod
+    def _manager(max_concurrent=0):
+        executor = ScriptExecutor(
+            pool_config=WorkerPoolConfig(size=0),
+            admission_config=AdmissionConfig(max_concurrent=max_concurrent, per_client=1)
+        )
+        return JobManager(executor)
+
+    def test_submit_and_poll(self):
+        """测试提交后立即返回，轮询得到执行结果"""
+        async def run():
+            manager = self._manager()
+            job = manager.submit("print('job done')", timeout=10)
+            initial = job.status
+            while manager.get(job.job_id).status in (ExecutionStatus.PENDING, ExecutionStatus.RUNNING):
+                await asyncio.sleep(0.05)
+            return initial, manager.get(job.job_id)
+
+        initial, job = asyncio.run(run())
+        assert initial == ExecutionStatus.PENDING
+        assert job.status == ExecutionStatus.COMPLETED
+        assert job.result.stdout == "job done\n"
+
+    def test_cancel_running_job(self):
+        """测试取消运行中的任务会终止进程"""
+        async def run():
+            manager = self._manager()
+            job = manager.submit("import time\ntime.sleep(30)", timeout=60)
+            while manager.get(job.job_id).status != ExecutionStatus.RUNNING:
+                await asyncio.sleep(0.02)
+            cancelled = await manager.cancel(job.job_id)
+            return cancelled, manager.executor.running_processes
+
+        job, running = asyncio.run(run())
+        assert job.status == ExecutionStatus.CANCELLED
+        assert running == {}
+
+    def test_cancel_keeps_partial_output(self):
+        """测试取消已产生输出的任务时保留部分输出"""
+        async def run():
+            manager = self._manager()
+            job = manager.submit("import sys, time\nprint('before', flush=True)\n"
+                                 "print('oops', file=sys.stderr, flush=True)\ntime.sleep(30)", timeout=60)
+            while manager.get(job.job_id).status != ExecutionStatus.RUNNING:
+                await asyncio.sleep(0.02)
+            await asyncio.sleep(1)
+            return await manager.cancel(job.job_id)
+
+        job = asyncio.run(run())
+        assert job.status == ExecutionStatus.CANCELLED
+        assert job.result.stdout == "before\n"
+        assert job.result.stderr == "oops\n"
+
+    def test_cancel_queued_job(self):
+        """测试取消仍在排队的任务"""
+        async def run():
+            manager = self._manager(max_concurrent=1)
+            blocker = manager.submit("import time\ntime.sleep(0.5)", timeout=10)
+            queued = manager.submit("print('never')", timeout=10)
+            await asyncio.sleep(0.1)
+            cancelled = await manager.cancel(queued.job_id)
+            await manager.cancel(blocker.job_id)
+            return cancelled
+
+        job = asyncio.run(run())
+        assert job.status == ExecutionStatus.CANCELLED
+        assert job.result is None
+
+
+class TestBatchRunner:
+    """测试批量执行"""
+
+    @staticmethod
+    def _runner(**kwargs):
+        executor = ScriptExecutor(pool_config=WorkerPoolConfig(size=0), admission_config=AdmissionConfig(max_concurrent=0))
+        return BatchRunner(executor, BatchConfig(**kwargs))
+
+    def test_report_totals(self):
+        """测试汇总通过、失败与预检错误"""
+        items = [
+            BatchItem(code="print('ok')", name="ok"),
+            BatchItem(code="import sys\nsys.exit(1)", name="fail"),
+            BatchItem(code="def broken(:", name="syntax"),
+        ]
+        runner = self._runner()
+        try:
+            report = asyncio.run(runner.run(items))
+        finally:
+            runner.close()
+        assert report.passed == 1
+        assert report.failed == 2
+        assert report.errors == 1
+        assert [i.name for i in report.items] == ["ok", "fail", "syntax"]
+        assert "语法错误" in report.items[2].error
+        assert len(report.slowest) == 2
+
+    def test_runs_concurrently(self):
+        """测试并发执行缩短总耗时"""
+        items = [BatchItem(code="import time\ntime.sleep(0.5)") for _ in range(3)]
+        runner = self._runner(max_parallel=3)
+        try:
+            report = asyncio.run(runner.run(items))
+        finally:
+            runner.close()
+        assert report.passed == 3
+        assert report.parallelism == 3
+        assert report.wall_time < report.total_execution_time
+
+    def test_rejects_too_many_scripts(self):
+        """测试脚本数量超过上限"""
+        runner = self._runner(max_scripts=1)
+        try:
+            with pytest.raises(ValueError):
+                asyncio.run(runner.run([BatchItem(code="print(1)"), BatchItem(code="print(2)")]))
+        finally:
+            runner.close()
+
+
+class TestPytestSharding:
+    """测试 pytest 分片执行"""
+
+    SUITE = """
+import time
+
+class TestSlow:
+    def test_a(self):
+        time.sleep(0.4)
+
+    def test_b(self):
+        time.sleep(0.4)
+
+def test_c():
+    time.sleep(0.4)
+
+def test_d():
+    time.sleep(0.4)
+
+def test_e():
+    assert 1 == 2
+"""
+
+    def test_parse_collected_ids(self):
+        """测试解析 --collect-only -q 输出"""
+        output = "script_x.py::test_a\nscript_x.py::TestA::test_b[1 2]\nother.py::test_c\n\n3 tests collected in 0.01s\n"
+        assert parse_collected_ids(output, "script_x.py") == [
+            "script_x.py::test_a", "script_x.py::TestA::test_b[1 2]"
+        ]
+
+    def test_plan_balances_by_history(self):
+        """测试按历史耗时均衡分配，历史按去掉文件名的用例路径匹配"""
+        sharder = PytestSharder(ShardingConfig(max_shards=4, min_tests=2))
+        sharder.record([
+            TestCaseResult("old.py::test_slow", "passed", 5.0),
+            TestCaseResult("old.py::test_mid", "passed", 2.0),
+            TestCaseResult("old.py::test_fast", "passed", 1.0),
+        ])
+        ids = ["new.py::test_fast", "new.py::test_mid", "new.py::test_slow", "new.py::test_other"]
+        plan = sharder.plan(ids, 2)
+        assert sorted(sum(plan, [])) == sorted(ids)
+        assert ["new.py::test_slow"] in plan
+
+    def test_shard_count(self):
+        """测试分片数受上限与最少用例数限制"""
+        sharder = PytestSharder(ShardingConfig(default_shards=1, max_shards=4, min_tests=4))
+        assert sharder.shard_count(None, 10) == 1
+        assert sharder.shard_count(8, 10) == 4
+        assert sharder.shard_count(4, 3) == 1
+
+    def _executor(self):
+        return ScriptExecutor(
+            pool_config=WorkerPoolConfig(size=0),
+            admission_config=AdmissionConfig(max_concurrent=0),
+            sharding_config=ShardingConfig(max_shards=4, min_tests=2)
+        )
+
+    def test_sharded_run_merges_results(self):
+        """测试分片执行合并用例结果，退出码取各分片最大值"""
+        executor = self._executor()
+        result = asyncio.run(executor.execute_script_async(self.SUITE, runner="pytest", timeout=30, shards=2))
+        assert result.status == ExecutionStatus.COMPLETED
+        assert result.shards == 2
+        assert result.exit_code == 1
+        outcomes = {case.nodeid.split("::", 1)[1]: case.outcome for case in result.test_results}
+        assert outcomes == {
+            "TestSlow::test_a": "passed", "TestSlow::test_b": "passed",
+            "test_c": "passed", "test_d": "passed", "test_e": "failed",
+        }
+        assert "test_e" in result.stdout
+        assert len(executor.sharder.history) == 5
+
+    def test_sharded_run_is_faster(self):
+        """测试分片执行的总耗时小于各用例耗时之和"""
+        executor = self._executor()
+        result = asyncio.run(executor.execute_script_async(self.SUITE, runner="pytest", timeout=30, shards=4))
+        assert result.shards == 4
+        assert sum(case.duration for case in result.test_results) >= 1.6
+        assert max(case.duration for case in result.test_results) < 1.0
+
+    def test_sharding_respects_admission_limits(self):
+        """测试每个分片进程占用一个执行名额，并发进程数不超过 max_concurrent，名额不足时不分片"""
+        executor = ScriptExecutor(
+            pool_config=WorkerPoolConfig(size=0),
+            admission_config=AdmissionConfig(max_concurrent=3, per_client=3),
+            sharding_config=ShardingConfig(max_shards=4, min_tests=2)
+        )
+        peak = {"processes": 0}
+
+        def live_processes():
+            return sum(len(getattr(p, "processes", [p])) for p in executor.running_processes.values())
+
+        async def run():
+            async def sample():
+                while True:
+                    peak["processes"] = max(peak["processes"], live_processes())
+                    await asyncio.sleep(0.02)
+
+            sampler = asyncio.ensure_future(sample())
+            try:
+                return await asyncio.gather(*(
+                    executor.execute_script_async(self.SUITE, runner="pytest", timeout=30, shards=4, use_cache=False)
+                    for _ in range(2)
+                ))
+            finally:
+                sampler.cancel()
+
+        results = asyncio.run(run())
+        # 分片受 max_concurrent=3 限制（请求 4 个），第二个请求排队到第一个结束后才执行
+        assert [result.shards for result in results] == [3, 3]
+        assert peak["processes"] <= 3
+        assert executor.admission.running == 0
+
+        single = ScriptExecutor(
+            pool_config=WorkerPoolConfig(size=0),
+            admission_config=AdmissionConfig(max_concurrent=1, per_client=1),
+            sharding_config=ShardingConfig(max_shards=4, min_tests=2)
+        )
+        result = asyncio.run(single.execute_script_async(self.SUITE, runner="pytest", timeout=30, shards=4))
+        assert result.shards == 1
+        assert len(result.test_results) == 5
+        assert single.admission.running == 0
+
+    def test_small_suite_runs_unsharded(self):
+        """测试用例数不足时回退到单进程执行"""
+        executor = self._executor()
+        code = "def test_only():\n    assert True\n"
+        result = asyncio.run(executor.execute_script_async(code, runner="pytest", timeout=30, shards=4))
+        assert result.exit_code == 0
+        assert result.shards == 1
+        assert [case.outcome for case in result.test_results] == ["passed"]
+
+
+class TestPytestReport:
+    """测试 pytest 结构化结果"""
+
+    def test_structured_results(self):
+        """测试用例结果、失败信息与统计"""
+        code = """
+import pytest
+
+class TestMath:
+    def test_add(self):
+        assert 1 + 1 == 2
+
+    def test_sub(self):
+        assert 2 - 1 == 0
+
+@pytest.mark.skip(reason="not ready")
+def test_skipped():
+    pass
+"""
+        executor = ScriptExecutor(pool_config=WorkerPoolConfig(size=0), admission_config=AdmissionConfig(max_concurrent=0))
+        result = asyncio.run(executor.execute_script_async(code, runner="pytest", timeout=30))
+        assert result.exit_code == 1
+        cases = {case.nodeid.split("::", 1)[1]: case for case in result.test_results}
+        assert cases["TestMath::test_add"].outcome == "passed"
+        assert cases["TestMath::test_add"].message is None
+        assert cases["TestMath::test_sub"].outcome == "failed"
+        assert "assert 2 - 1 == 0" in cases["TestMath::test_sub"].message
+        assert cases["test_skipped"].outcome == "skipped"
+        assert cases["test_skipped"].message == "not ready"
+        assert all(case.nodeid.startswith(os.path.basename(result.file_path)) for case in result.test_results)
+
+        summary = summarize_results(result.test_results)
+        assert (summary["total"], summary["passed"], summary["failed"], summary["skipped"]) == (3, 1, 1, 1)
+
+    def test_python_runner_has_no_results(self):
+        """测试 python 执行不返回用例结果"""
+        executor = ScriptExecutor(pool_config=WorkerPoolConfig(size=0), admission_config=AdmissionConfig(max_concurrent=0))
+        result = asyncio.run(executor.execute_script_async("print(1)", runner="python", timeout=30))
+        assert result.test_results is None
+
+
+class TestScratchDir:
+    """测试脚本临时目录不残留 pytest 缓存并在停止时移除"""
+
+    def test_no_pytest_cache_and_removed_on_stop(self, tmp_path, monkeypatch):
+        """测试 pytest 执行不写 .pytest_cache，stop_all_processes 移除目录及残留文件"""
+        scratch = tmp_path / "scratch"
+        monkeypatch.setenv("SCRIPT_SCRATCH_DIR", str(scratch))
+        executor = ScriptExecutor(pool_config=WorkerPoolConfig(size=0), admission_config=AdmissionConfig(max_concurrent=0))
+        result = asyncio.run(executor.execute_script_async(
+            "def test_ok():\n    assert True\n", runner="pytest", timeout=30, use_cache=False))
+        assert result.exit_code == 0
+        assert not (scratch / ".pytest_cache").exists()
+        (scratch / "leftover.txt").write_text("x")
+        executor.stop_all_processes()
+        assert not scratch.exists()
+
+
+class TestInMemoryDelivery:
+    """测试 python 脚本源码不落盘执行"""
+
+    CODE = """import os, sys
+print(os.path.exists(__file__), __name__, sys.argv[0] == __file__)
+def fail():
+    raise ValueError("boom")
+fail()
+"""
+
+    @pytest.mark.parametrize("pool_size", [0, 1])
+    def test_source_not_written_and_traceback_kept(self, pool_size):
+        """测试源码经标准输入传入，回溯保留文件名与代码行"""
+        if pool_size and not WorkerPool.supported():
+            pytest.skip("当前平台不支持预热工作进程池")
+
+        async def run():
+            executor = ScriptExecutor(pool_config=WorkerPoolConfig(size=pool_size),
+                                      admission_config=AdmissionConfig(max_concurrent=0))
+            try:
+                await executor.start()
+                return await executor.execute_script_async(self.CODE, runner="python", timeout=30)
+            finally:
+                executor.stop_all_processes()
+
+        result = asyncio.run(run())
+        assert result.exit_code == 1
+        assert result.stdout.strip() == "False __main__ True"
+        assert f'File "{result.file_path}", line 5' in result.stderr
+        assert 'raise ValueError("boom")' in result.stderr
+        assert "script_runner" not in result.stderr
+
+
+@pytest.mark.skipif(not WorkerPool.supported(), reason="资源限制依赖 POSIX 工作进程")
+class TestResourceLimits:
+    """测试资源限制与用量统计"""
+
+    @staticmethod
+    def _run(code, limits=None, pool_size=0, timeout=30):
+        async def run():
+            executor = ScriptExecutor(pool_config=WorkerPoolConfig(size=pool_size),
+                                      admission_config=AdmissionConfig(max_concurrent=0),
+                                      resource_limits=limits or ResourceLimitsConfig())
+            try:
+                await executor.start()
+                return await executor.execute_script_async(code, runner="python", timeout=timeout)
+            finally:
+                executor.stop_all_processes()
+        return asyncio.run(run())
+
+    @pytest.mark.parametrize("pool_size", [0, 1])
+    def test_usage_reported(self, pool_size):
+        """测试冷启动与预热执行都上报 CPU 时间与峰值内存"""
+        result = self._run("data = bytearray(64 * 1024 * 1024)\nsum(range(3000000))", pool_size=pool_size)
+        assert result.exit_code == 0
+        assert result.cpu_user_time + result.cpu_system_time > 0
+        assert result.peak_rss >= 64 * 1024 * 1024
+        assert result.limit_exceeded is None
+
+    def test_cpu_limit(self):
+        """测试 CPU 时间限制通过 SIGXCPU 终止进程"""
+        result = self._run("while True:\n    pass", ResourceLimitsConfig(cpu_seconds=1), timeout=20)
+        assert result.status == ExecutionStatus.COMPLETED
+        assert result.exit_code < 0
+        assert result.limit_exceeded == "cpu"
+        assert result.execution_time < 10
+
+    def test_memory_limit(self):
+        """测试地址空间限制触发 MemoryError"""
+        result = self._run("data = bytearray(2 * 1024 * 1024 * 1024)", ResourceLimitsConfig(memory_mb=512))
+        assert result.exit_code == 1
+        assert "MemoryError" in result.stderr
+        assert result.limit_exceeded == "memory"
+
+    def test_open_files_limit(self):
+        """测试打开文件数限制"""
+        code = "import os\nfiles = [open(os.devnull) for _ in range(200)]"
+        result = self._run(code, ResourceLimitsConfig(open_files=64))
+        assert result.exit_code == 1
+        assert result.limit_exceeded == "open_files"
+
+    def test_timeout_marks_wall(self):
+        """测试超时标记为 wall 限制"""
+        result = self._run("import time\ntime.sleep(30)", timeout=1)
+        assert result.status == ExecutionStatus.TIMEOUT
+        assert result.limit_exceeded == "wall"
+
+
+@pytest.mark.skipif(not GROUP_KILL_SUPPORTED or not os.path.isdir("/proc"), reason="需要进程组与 /proc")
+class TestProcessGroupKill:
+    """测试按进程组终止与残留进程清理"""
+
+    # 派生一个不等待的孙进程并打印其 pid（孙进程不持有输出管道，否则读取会一直等到超时）
+    SPAWN = """import subprocess, sys
+child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"],
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+print(child.pid, flush=True)
+"""
+
+    @staticmethod
+    def _alive(pid):
+        return any(pid in pids for pids in process_groups().values())
+
+    @pytest.mark.parametrize("pool_size", [0, 1])
+    def test_timeout_kills_grandchildren(self, pool_size):
+        """测试超时终止整个进程组"""
+        async def run():
+            executor = ScriptExecutor(pool_config=WorkerPoolConfig(size=pool_size),
+                                      admission_config=AdmissionConfig(max_concurrent=0),
+                                      reaper_config=ReaperConfig(interval=0, kill_grace=1))
+            try:
+                await executor.start()
+                chunks = []
+                async for item in executor.stream_script_async(self.SPAWN + "import time\ntime.sleep(60)\n",
+                                                               timeout=2):
+                    if isinstance(item, OutputChunk):
+                        chunks.append(item.text)
+                    else:
+                        return item, int("".join(chunks).split()[0])
+            finally:
+                executor.stop_all_processes()
+
+        result, grandchild = asyncio.run(run())
+        assert result.status == ExecutionStatus.TIMEOUT
+        time.sleep(0.2)
+        assert not self._alive(grandchild)
+
+    def test_reaper_reclaims_orphans(self):
+        """测试执行结束后残留的后台进程由清理任务回收"""
+        async def run():
+            executor = ScriptExecutor(pool_config=WorkerPoolConfig(size=0),
+                                      admission_config=AdmissionConfig(max_concurrent=0),
+                                      reaper_config=ReaperConfig(interval=0))
+            try:
+                result = await executor.execute_script_async(self.SPAWN, timeout=10)
+                grandchild = int(result.stdout.split()[0])
+                assert self._alive(grandchild)
+                reclaimed = executor.reaper.sweep()
+                await asyncio.sleep(0.2)
+                return grandchild, reclaimed, executor.get_stats()["reaper"]
+            finally:
+                executor.stop_all_processes()
+
+        grandchild, reclaimed, stats = asyncio.run(run())
+        assert reclaimed == 1
+        assert stats["reclaimed"] == 1
+        assert not self._alive(grandchild)
+
+    def test_reaper_skips_reused_pid(self):
+        """测试进程组组长的启动时间与登记时不同（pid 已复用）时不发送信号"""
+        import subprocess
+        if process_identity(os.getpid()) is None:
+            pytest.skip("需要 /proc")
+        child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"], start_new_session=True)
+        try:
+            reaper = SessionReaper(ReaperConfig(interval=0))
+            reaper.track(child.pid)
+            session_id, started = reaper.identities[child.pid]
+            reaper.identities[child.pid] = (session_id, started - 1)
+            reaper.release(child.pid)
+            assert reaper.sweep() == 0
+            assert child.poll() is None
+            assert reaper.sessions == {}
+
+            reaper.track(child.pid)
+            reaper.release(child.pid)
+            assert reaper.sweep() == 1
+            assert child.wait(timeout=5) == -9
+        finally:
+            child.kill()
+            child.wait()
+
+
+class TestHttpClient:
+    """测试共享异步 HTTP 客户端"""
+
+    def test_client_lifecycle(self):
+        """测试按需创建、复用与关闭，未安装 h2 时不启用 HTTP/2"""
+        pytest.importorskip("httpx")
+        from app import http_client
+
+        async def run():
+            client = http_client.get_http_client()
+            same = http_client.get_http_client() is client
+            await http_client.cleanup_http_client()
+            return client, same
+
+        client, same = asyncio.run(run())
+        assert same
+        assert client.is_closed
+        assert http_client._http_client is None
+
+    def test_config_from_env(self, monkeypatch):
+        """测试从环境变量读取连接池配置"""
+        pytest.importorskip("httpx")
+        from app.http_client import HttpClientConfig
+        monkeypatch.setenv("HTTP_MAX_CONNECTIONS", "7")
+        monkeypatch.setenv("HTTP_HTTP2", "0")
+        config = HttpClientConfig.from_env()
+        assert config.max_connections == 7
+        assert config.http2 is False
+        assert config.timeout == 90.0
+
+    def test_concurrent_chat_not_serialized(self):
+        """测试并发的 /ai/chat 请求共用客户端并行等待上游，不阻塞事件循环"""
+        httpx = pytest.importorskip("httpx")
+        pytest.importorskip("fastapi")
+        import main
+        from app import http_client, llm_limiter
+
+        async def upstream(request):
+            await asyncio.sleep(0.5)
+            return httpx.Response(200, json={"choices": [{"message": {"content": "hi"}}]})
+
+        async def run():
+            http_client._http_client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+            llm_limiter._llm_limiter = None
+            payloads = [{"model": "m", "messages": [{"role": "user", "content": f"x{i}"}], "api_key": "sk-or-v1-test"}
+                        for i in range(5)]
+            start = time.time()
+            try:
+                responses = await asyncio.gather(*(main.ai_chat(payload, None, None) for payload in payloads))
+            finally:
+                await http_client.cleanup_http_client()
+            return responses, time.time() - start
+
+        responses, elapsed = asyncio.run(run())
+        assert all(r.status_code == 200 and b'"hi"' in r.body for r in responses)
+        assert elapsed < 2.0
+
+
+class TestChatStreaming:
+    """测试 /ai/chat 流式模式"""
+
+    PAYLOAD = {"model": "m", "messages": [{"role": "user", "content": "x"}], "api_key": "sk-or-v1-test", "stream": True}
+
+    @staticmethod
+    def _chat(handler, limiter=None):
+        httpx = pytest.importorskip("httpx")
+        pytest.importorskip("fastapi")
+        import main
+        from app import http_client, llm_cache, llm_limiter
+
+        async def run():
+            http_client._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            llm_cache._llm_cache = None
+            llm_limiter._llm_limiter = limiter
+            try:
+                response = await main.ai_chat(dict(TestChatStreaming.PAYLOAD), None, None)
+                body = b""
+                if hasattr(response, "body_iterator"):
+                    async for chunk in response.body_iterator:
+                        body += chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+                else:
+                    body = response.body
+                return response, body.decode("utf-8")
+            finally:
+                await http_client.cleanup_http_client()
+
+        return asyncio.run(run())
+
+    @staticmethod
+    def _sse(*events):
+        return "".join(f"data: {event}\n\n" for event in events).encode("utf-8")
+
+    def test_relays_deltas(self):
+        """测试逐段转发上游 token，结束时推送完整内容与 TTFB"""
+        import json
+        from app import llm_client
+
+        def handler(request):
+            assert json.loads(request.content)["stream"] is True
+            return pytest.importorskip("httpx").Response(200, content=b": OPENROUTER PROCESSING\n\n" + self._sse(
+                json.dumps({"choices": [{"delta": {"content": "Hel"}}]}),
+                json.dumps({"choices": [{"delta": {"content": "lo"}}]}),
+                "[DONE]",
+            ))
+
+        completed = llm_client.stream_metrics.completed
+        response, body = self._chat(handler)
+        assert response.media_type == "text/event-stream"
+        assert body.count("event: delta") == 2
+        done = json.loads(body.split("event: done\ndata: ")[1])
+        assert done["content"] == "Hello"
+        assert done["ttfb"] is not None and done["ttfb"] <= done["total_time"]
+        assert llm_client.stream_metrics.completed == completed + 1
+        assert llm_client.stream_metrics.stats()["ttfb"]["count"] >= 1
+
+    def test_status_errors_keep_codes(self):
+        """测试上游状态码错误按非流式接口的状态码返回"""
+        httpx = pytest.importorskip("httpx")
+        response, body = self._chat(lambda request: httpx.Response(429, json={"error": {"message": "slow"}}))
+        assert response.status_code == 429
+        assert "请求过于频繁" in body
+
+    def test_midstream_error_event(self):
+        """测试流开始后上游报告错误时推送 error 事件"""
+        import json
+        httpx = pytest.importorskip("httpx")
+        response, body = self._chat(lambda request: httpx.Response(200, content=self._sse(
+            json.dumps({"choices": [{"delta": {"content": "a"}}]}),
+            json.dumps({"error": {"code": 502, "message": "provider down"}}),
+        )))
+        error = json.loads(body.split("event: error\ndata: ")[1])
+        assert error["code"] == 502
+        assert "provider down" in error["error"]
+        assert "event: done" not in body
+
+    def test_midstream_error_settles_reserved_tokens(self):
+        """测试流中途出错时按已生成的内容退回预扣的输出 token"""
+        import json
+        httpx = pytest.importorskip("httpx")
+        from app.llm_limiter import LLMLimiterConfig, LLMRateLimiter
+        limiter = LLMRateLimiter(LLMLimiterConfig(key_rpm=0, key_tpm=0, model_rpm=0, model_tpm=600,
+                                                  completion_tokens=100))
+        self._chat(lambda request: httpx.Response(200, content=self._sse(
+            json.dumps({"choices": [{"delta": {"content": "a"}}]}),
+            json.dumps({"error": {"code": 502, "message": "provider down"}}),
+        )), limiter)
+        # 预扣 5（输入）+ 100（输出），实际只生成 1 个 token，其余 99 个退回
+        assert limiter.buckets[("model", "m", "tokens")].tokens > 590
+
+    def test_unexpected_error_event(self, monkeypatch):
+        """测试流结束后的处理（写缓存等）抛出非上游异常时同样推送 error 事件"""
+        import json
+        httpx = pytest.importorskip("httpx")
+        from app.llm_cache import LLMResponseCache
+
+        async def broken_set(self, key, value):
+            raise RuntimeError("cache down")
+
+        monkeypatch.setattr(LLMResponseCache, "set", broken_set)
+        response, body = self._chat(lambda request: httpx.Response(200, content=self._sse(
+            json.dumps({"choices": [{"delta": {"content": "a"}}]}), "[DONE]")))
+        error = json.loads(body.split("event: error\ndata: ")[1])
+        assert error["code"] == 500
+        assert "cache down" in error["error"]
+
+    @pytest.mark.parametrize("stream", [True, False])
+    def test_upstream_failure_refunds_reserved_tokens(self, stream):
+        """测试上游调用失败（流式建立连接失败或非流式调用失败）时退回预扣的 token"""
+        httpx = pytest.importorskip("httpx")
+        pytest.importorskip("fastapi")
+        import main
+        from app import http_client, llm_cache, llm_limiter
+        from app.llm_limiter import LLMLimiterConfig, LLMRateLimiter
+        limiter = LLMRateLimiter(LLMLimiterConfig(key_rpm=0, key_tpm=0, model_rpm=0, model_tpm=600,
+                                                  completion_tokens=100))
+
+        async def run():
+            http_client._http_client = httpx.AsyncClient(transport=httpx.MockTransport(
+                lambda request: httpx.Response(503, json={"error": {"message": "down"}})))
+            llm_cache._llm_cache = None
+            llm_limiter._llm_limiter = limiter
+            try:
+                response = await main.ai_chat(dict(TestChatStreaming.PAYLOAD, stream=stream), None, None)
+                return response.status_code
+            finally:
+                await http_client.cleanup_http_client()
+                llm_limiter._llm_limiter = None
+
+        assert asyncio.run(run()) == 503
+        # 预扣 5（输入）+ 100（输出），上游没有返回内容，输出部分全部退回
+        assert limiter.buckets[("model", "m", "tokens")].tokens > 590
+
+    def test_disconnect_before_iteration_closes_upstream(self):
+        """测试客户端在事件流开始迭代前断开时关闭上游响应"""
+        import json
+        httpx = pytest.importorskip("httpx")
+        pytest.importorskip("fastapi")
+        import main
+        from app import http_client, llm_cache, llm_limiter
+
+        upstream = []
+
+        async def body():
+            yield self._sse(json.dumps({"choices": [{"delta": {"content": "a"}}]}), "[DONE]")
+
+        def handler(request):
+            upstream.append(httpx.Response(200, content=body()))
+            return upstream[-1]
+
+        async def send(message):
+            raise OSError("client gone")
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def run():
+            http_client._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            llm_cache._llm_cache = None
+            llm_limiter._llm_limiter = None
+            try:
+                response = await main.ai_chat(dict(TestChatStreaming.PAYLOAD), None, None)
+                with pytest.raises(Exception):
+                    await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+                return [r.is_closed for r in upstream]
+            finally:
+                await http_client.cleanup_http_client()
+
+        assert asyncio.run(run()) == [True]
+
+
+class TestLLMCache:
+    """测试 /ai/chat 响应缓存"""
+
+    @staticmethod
+    def _cache(**kwargs):
+        from app.llm_cache import LLMCacheConfig, LLMResponseCache
+        return LLMResponseCache(LLMCacheConfig(**kwargs))
+
+    def test_key_normalization(self):
+        """测试空白、全角字符与角色大小写差异得到相同的键，行首缩进与内容差异得到不同的键"""
+        from app.llm_cache import llm_cache_key
+        base = llm_cache_key("m", [{"role": "user", "content": "写一个 add 函数\n测试 1+1"}])
+        assert llm_cache_key(" m ", [{"role": "User", "content": "  写一个   add\t函数  \r\n\r\n\r\n测试 １＋１\n"}]) != base
+        assert llm_cache_key(" m ", [{"role": "User", "content": "  写一个   add\t函数  \r\n测试 １＋１\n"}]) == base
+        assert llm_cache_key("m", [{"role": "user", "content": "def f():\n    return 1"}]) != \
+            llm_cache_key("m", [{"role": "user", "content": "def f():\n return 1"}])
+        assert llm_cache_key("m2", [{"role": "user", "content": "写一个 add 函数\n测试 1+1"}]) != base
+
+    def test_hit_miss_and_bypass(self):
+        """测试未命中时调用上游，命中时直接返回，bypass 时重新调用并刷新缓存"""
+        cache = self._cache()
+        answers = iter(["a", "b"])
+
+        async def fetch():
+            return next(answers)
+
+        async def run():
+            return [await cache.get_or_fetch("k", fetch),
+                    await cache.get_or_fetch("k", fetch),
+                    await cache.get_or_fetch("k", fetch, bypass=True),
+                    await cache.get_or_fetch("k", fetch)]
+
+        assert asyncio.run(run()) == [("a", "miss"), ("a", "hit"), ("b", "bypass"), ("b", "hit")]
+        assert cache.stats()["upstream_calls"] == 2
+
+    def test_single_flight(self):
+        """测试相同请求并发到达时只调用一次上游"""
+        cache = self._cache()
+
+        async def fetch():
+            await asyncio.sleep(0.1)
+            return "answer"
+
+        async def run():
+            return await asyncio.gather(*(cache.get_or_fetch("k", fetch) for _ in range(5)))
+
+        results = asyncio.run(run())
+        assert {content for content, _ in results} == {"answer"}
+        assert sorted(source for _, source in results) == ["coalesced"] * 4 + ["miss"]
+        assert cache.stats()["upstream_calls"] == 1
+        assert cache.stats()["inflight"] == 0
+
+    def test_errors_are_shared_not_cached(self):
+        """测试上游失败时合并的请求收到同一异常，且失败结果不写入缓存"""
+        from app.llm_client import UpstreamError
+        cache = self._cache()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            raise UpstreamError(429, "slow")
+
+        async def run():
+            return await asyncio.gather(*(cache.get_or_fetch("k", fetch) for _ in range(3)), return_exceptions=True)
+
+        errors = asyncio.run(run())
+        assert all(isinstance(e, UpstreamError) and e.code == 429 for e in errors)
+        assert cache.stats()["upstream_calls"] == 1
+        assert cache.memory.get("k") is None
+
+    def test_chat_endpoint_cache_header(self):
+        """测试 /ai/chat 重复请求命中缓存，X-Cache-Bypass 跳过缓存"""
+        httpx = pytest.importorskip("httpx")
+        pytest.importorskip("fastapi")
+        import main
+        from app import http_client, llm_cache, llm_limiter
+        calls = []
+
+        def upstream(request):
+            calls.append(request)
+            return httpx.Response(200, json={"choices": [{"message": {"content": "hi"}}]})
+
+        async def run():
+            http_client._http_client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+            llm_cache._llm_cache = None
+            llm_limiter._llm_limiter = None
+            payload = {"model": "m", "messages": [{"role": "user", "content": "x"}], "api_key": "sk-or-v1-test"}
+            try:
+                return [await main.ai_chat(dict(payload), None, None),
+                        await main.ai_chat(dict(payload), None, None),
+                        await main.ai_chat(dict(payload), None, "1")]
+            finally:
+                await http_client.cleanup_http_client()
+                llm_cache._llm_cache = None
+
+        responses = asyncio.run(run())
+        assert [r.headers["x-cache"] for r in responses] == ["MISS", "HIT", "BYPASS"]
+        assert all(b'"hi"' in r.body for r in responses)
+        assert len(calls) == 2
+
+
+class TestLLMRouter:
+    """测试多提供方 LLM 路由（以本地 OpenAI 兼容桩服务为上游）"""
+
+    MESSAGES = [{"role": "user", "content": "x"}]
+
+    @pytest.fixture
+    def stubs(self):
+        pytest.importorskip("httpx")
+        from openai_stub_server import StubServer
+        servers = [StubServer("a").start(), StubServer("b").start()]
+        yield servers
+        for server in servers:
+            server.stop()
+
+    @staticmethod
+    def _router(stubs, **kwargs):
+        from app.llm_router import LLMRouter, ProviderConfig, RouterConfig
+        providers = [ProviderConfig(name=s.name, url=s.url + "/chat/completions") for s in stubs]
+        return LLMRouter(RouterConfig(providers=providers, **kwargs))
+
+    @staticmethod
+    def _run(router, *calls):
+        async def run():
+            try:
+                return [await call(router) for call in calls]
+            finally:
+                await router.close()
+        return asyncio.run(run())
+
+    def test_routes_to_fastest(self, stubs):
+        """测试每个提供方都被尝试后，请求固定发往延迟最低的提供方"""
+        stubs[0].delay = 0.2
+        router = self._router(stubs)
+        call = lambda r: r.complete(None, "m", self.MESSAGES)
+        assert self._run(router, call, call, call, call) == ["a:m", "b:m", "b:m", "b:m"]
+        routes = router.stats()["providers"]
+        assert routes["a"]["routes"]["m"]["latency"] > routes["b"]["routes"]["m"]["latency"]
+
+    def test_no_provider_errors(self):
+        """测试没有提供方支持模型与缺少 API Key 时返回不同的错误"""
+        from app.llm_client import UpstreamError
+        from app.llm_router import LLMRouter, ProviderConfig, RouterConfig
+        router = LLMRouter(RouterConfig(providers=[
+            ProviderConfig(name="openrouter", kind="openrouter", url="http://127.0.0.1:9/v1/chat/completions",
+                           models=("gpt-*",)),
+        ]))
+        with pytest.raises(UpstreamError) as unknown:
+            router.candidates("llama3", "sk-or-v1-test")
+        with pytest.raises(UpstreamError) as no_key:
+            router.candidates("gpt-4o", None)
+        asyncio.run(router.close())
+        assert (unknown.value.code, unknown.value.msg) == (400, "没有可用的提供方支持模型 llama3")
+        assert (no_key.value.code, no_key.value.msg) == (400, "API Key 未提供")
+        assert [p.name for p in router.candidates("gpt-4o", "sk-or-v1-test")] == ["openrouter"]
+
+    def test_failover_and_cooldown(self, stubs):
+        """测试 5xx / 429 时切换提供方，连续失败后首选提供方进入冷却"""
+        stubs[0].status = 503
+        router = self._router(stubs, failure_threshold=2)
+        call = lambda r: r.complete(None, "m", self.MESSAGES)
+        assert self._run(router, call, call) == ["b:m", "b:m"]
+        assert router.failovers >= 1
+        assert router.stats()["providers"]["a"]["routes"]["m"]["healthy"] is False
+        assert [p.name for p in router.candidates("m", None)] == ["b", "a"]
+
+    def test_non_retryable_error_not_failed_over(self, stubs):
+        """测试 401 等请求错误直接返回，不切换提供方"""
+        from app.llm_client import UpstreamError
+        stubs[0].status = 401
+        router = self._router(stubs)
+        with pytest.raises(UpstreamError) as error:
+            self._run(router, lambda r: r.complete(None, "m", self.MESSAGES))
+        assert error.value.code == 401
+        assert stubs[1].requests == []
+
+    def test_all_failed_returns_last_error(self, stubs):
+        """测试所有提供方都失败时返回最后一个错误"""
+        from app.llm_client import UpstreamError
+        stubs[0].status = 500
+        stubs[1].status = 429
+        with pytest.raises(UpstreamError) as error:
+            self._run(self._router(stubs), lambda r: r.complete(None, "m", self.MESSAGES))
+        assert error.value.code == 429
+
+    def test_hedged_request(self, stubs):
+        """测试首选提供方过慢时对冲请求下一个提供方，先返回的结果生效"""
+        stubs[0].delay = 1.5
+        router = self._router(stubs, hedge_delay=0.1)
+        start = time.time()
+        assert self._run(router, lambda r: r.complete(None, "m", self.MESSAGES)) == ["b:m"]
+        assert time.time() - start < 1.0
+        assert router.hedged == 1
+
+    def test_stream_failover(self, stubs):
+        """测试流式调用在建立连接前切换提供方"""
+        stubs[0].status = 502
+        stubs[1].reply = "hello world"
+
+        async def call(router):
+            stream = await router.open_stream(None, "m", self.MESSAGES)
+            return "".join([delta async for delta in stream.deltas()])
+
+        assert self._run(self._router(stubs), call) == ["hello world"]
+
+    def test_model_patterns_and_keys(self, monkeypatch):
+        """测试按模型名通配符与 API Key 筛选提供方，读取环境变量配置"""
+        pytest.importorskip("httpx")
+        from app.llm_client import UpstreamError
+        from app.llm_router import LLMRouter, RouterConfig
+        monkeypatch.setenv("LLM_PROVIDERS", "openrouter,ollama,lab")
+        monkeypatch.setenv("LLM_PROVIDER_OLLAMA_MODELS", "llama*,qwen*")
+        monkeypatch.setenv("LLM_PROVIDER_LAB_URL", "http://lab:9000/v1/")
+        monkeypatch.setenv("LLM_PROVIDER_LAB_MODELS", "gpt-*")
+        router = LLMRouter(RouterConfig.from_env())
+        assert router.providers["ollama"].config.url == "http://localhost:11434/v1/chat/completions"
+        assert router.providers["lab"].config.kind == "openai"
+        assert router.providers["lab"].config.url == "http://lab:9000/v1/chat/completions"
+        assert [p.name for p in router.candidates("llama3", None)] == ["ollama"]
+        assert [p.name for p in router.candidates("llama3", "sk-or-v1-x")] == ["openrouter", "ollama"]
+        assert [p.name for p in router.candidates("gpt-4o", None, provider="lab")] == ["lab"]
+        with pytest.raises(UpstreamError):
+            router.candidates("openai/gpt-4o", None)
+
+
+class TestLLMLimiter:
+    """测试上游调用令牌桶限流与优先级排队"""
+
+    @staticmethod
+    def _limiter(**kwargs):
+        from app.llm_limiter import LLMLimiterConfig, LLMRateLimiter
+        config = dict(key_rpm=0, key_tpm=0, model_rpm=0, model_tpm=600, completion_tokens=0)
+        config.update(kwargs)
+        return LLMRateLimiter(LLMLimiterConfig(**config))
+
+    def test_estimate_tokens(self):
+        """测试按字符估算 token：汉字 1 个/字，其他字符 4 个/token，每条消息另计格式开销"""
+        from app.llm_limiter import estimate_tokens
+        assert estimate_tokens([{"role": "user", "content": "a" * 400}]) == 104
+        assert estimate_tokens([{"role": "system", "content": "写一个加法函数"}, {"role": "user", "content": ""}]) == 15
+        assert estimate_tokens([{"role": "user", "content": [{"type": "text", "text": "abcd"}]}]) == 5
+
+    def test_burst_is_delayed_not_rejected(self):
+        """测试额度用完后的请求排队等待补充，而不是被拒绝"""
+        limiter = self._limiter()
+
+        async def run():
+            first = await limiter.acquire("k", "m", 600)
+            second = await limiter.acquire("k", "m", 3)
+            return first.wait, second.wait
+
+        first, second = asyncio.run(run())
+        assert first == 0.0
+        assert 0.2 < second < 1.0
+        assert limiter.stats()["delayed"] == 1
+        assert limiter.stats()["wait"]["max"] == second
+
+    def test_priority_order(self):
+        """测试同一个桶上排队的请求按优先级放行"""
+        limiter = self._limiter()
+        order = []
+
+        async def request(priority):
+            await limiter.acquire("k", "m", 3, priority)
+            order.append(priority)
+
+        async def run():
+            await limiter.acquire("k", "m", 600)
+            tasks = []
+            for priority in ("low", "normal", "high"):
+                tasks.append(asyncio.ensure_future(request(priority)))
+                await asyncio.sleep(0.01)
+            assert limiter.stats()["queued_by_priority"] == {"high": 1, "normal": 1, "low": 1}
+            await asyncio.gather(*tasks)
+
+        asyncio.run(run())
+        assert order == ["high", "normal", "low"]
+
+    def test_independent_buckets_not_blocked(self):
+        """测试某个模型的额度用完时，其他模型的请求不受影响"""
+        limiter = self._limiter()
+
+        async def run():
+            await limiter.acquire("k", "m", 600)
+            waiting = asyncio.ensure_future(limiter.acquire("k", "m", 300))
+            await asyncio.sleep(0.01)
+            other = await limiter.acquire("k", "n", 10)
+            waiting.cancel()
+            return other.wait
+
+        assert asyncio.run(run()) < 0.1
+        assert limiter.stats()["queued"] == 0
+
+    def test_queue_full_and_timeout(self):
+        """测试排队已满与排队超时时返回 429"""
+        from app.llm_limiter import LLMRateLimited
+        limiter = self._limiter(max_queue=1, queue_timeout=0.1)
+
+        async def run():
+            await limiter.acquire("k", "m", 600)
+            waiting = asyncio.ensure_future(limiter.acquire("k", "m", 300))
+            await asyncio.sleep(0.01)
+            with pytest.raises(LLMRateLimited) as full:
+                await limiter.acquire("k", "m", 1)
+            with pytest.raises(LLMRateLimited) as timeout:
+                await waiting
+            return full.value, timeout.value
+
+        full, timeout = asyncio.run(run())
+        assert (full.code, full.reason) == (429, "queue_full")
+        assert (timeout.code, timeout.reason) == (429, "queue_timeout")
+        assert limiter.stats()["rejected"] == 1 and limiter.stats()["timed_out"] == 1
+
+    def test_settle_refunds_unused_completion(self):
+        """测试按实际输出退回预留的输出 token"""
+        limiter = self._limiter(completion_tokens=200)
+
+        async def run():
+            return await limiter.acquire("k", "m", 100)
+
+        grant = asyncio.run(run())
+        bucket = limiter.buckets[("model", "m", "tokens")]
+        assert bucket.tokens == pytest.approx(300, abs=1)
+        limiter.settle(grant, "a" * 400)
+        assert bucket.tokens == pytest.approx(400, abs=1)
+
+
+class TestConversationStore:
+    """测试服务端会话存储与上下文压缩"""
+
+    @staticmethod
+    def _store(summarizer=None, **kwargs):
+        from app.conversation_store import ConversationConfig, ConversationStore
+        return ConversationStore(ConversationConfig(**kwargs), summarizer)
+
+    def test_dedup_and_window(self):
+        """测试重复的 system 提示只保留一次，超出条数的最早对话被截掉"""
+        from app.conversation_store import split_window, dedup_system
+        messages = [{"role": "system", "content": "s"}, {"role": "user", "content": "u1"},
+                    {"role": "assistant", "content": "a1"}, {"role": "system", "content": "s"},
+                    {"role": "user", "content": "u2"}]
+        kept, dropped = split_window(dedup_system(messages), max_messages=2, max_chars=0)
+        assert [m["content"] for m in kept] == ["s", "a1", "u2"]
+        assert [m["content"] for m in dropped] == ["u1"]
+
+    def test_char_budget_keeps_last_message(self):
+        """测试按总字符数截断最早的消息，最后一条消息即使超出预算也保留"""
+        from app.conversation_store import split_window
+        messages = [{"role": "user", "content": "a" * 50}, {"role": "assistant", "content": "b" * 50},
+                    {"role": "user", "content": "c" * 200}]
+        kept, dropped = split_window(messages, max_messages=0, max_chars=120)
+        assert [m["content"][0] for m in kept] == ["c"]
+        assert len(dropped) == 2
+
+    def test_rolling_summary(self):
+        """测试被截掉的消息交给摘要钩子，旧摘要参与下一次摘要"""
+        seen = []
+
+        async def summarize(messages):
+            seen.append([m["content"] for m in messages])
+            return f"{len(messages)}条"
+
+        store = self._store(summarize, max_messages=2, max_chars=0)
+
+        async def run():
+            first = await store.prepare([{"role": "system", "content": "s"}] +
+                                        [{"role": "user", "content": str(i)} for i in range(4)], "sid")
+            store.save("sid", first, "r")
+            return first, await store.prepare([{"role": "user", "content": "4"}], "sid")
+
+        first, second = asyncio.run(run())
+        assert [m["content"] for m in first] == ["s", "此前对话摘要：2条", "2", "3"]
+        assert [m["content"] for m in second] == ["s", "此前对话摘要：3条", "r", "4"]
+        assert seen[1] == ["此前对话摘要：2条", "2", "3"]
+        assert store.stats()["compactions"] == 2
+
+    def test_stateless_chat_not_compacted(self):
+        """测试不带会话的请求原样发往上游，不按会话配置截断客户端自带的历史"""
+        import json
+        httpx = pytest.importorskip("httpx")
+        pytest.importorskip("fastapi")
+        import main
+        from app import conversation_store, http_client, llm_cache, llm_limiter
+        sent = []
+
+        def upstream(request):
+            sent.append(json.loads(request.content)["messages"])
+            return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+        messages = [{"role": "system", "content": "s"}, {"role": "system", "content": "s"}] + \
+            [{"role": "user", "content": str(i)} for i in range(60)]
+
+        async def run():
+            http_client._http_client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+            llm_cache._llm_cache = None
+            llm_limiter._llm_limiter = None
+            conversation_store._conversation_store = None
+            try:
+                payload = {"model": "m", "messages": messages, "api_key": "sk-or-v1-test"}
+                return (await main.ai_chat(payload, None, None)).status_code
+            finally:
+                await http_client.cleanup_http_client()
+                llm_cache._llm_cache = None
+                conversation_store._conversation_store = None
+
+        assert asyncio.run(run()) == 200
+        assert sent == [messages]
+
+    def test_chat_session_sends_deltas(self):
+        """测试 /ai/chat 会话模式：客户端只发新增消息，服务端拼接历史；上游失败时不写入会话"""
+        import json
+        httpx = pytest.importorskip("httpx")
+        pytest.importorskip("fastapi")
+        import main
+        from app import conversation_store, http_client, llm_cache, llm_limiter
+        sent = []
+        status = {"code": 200}
+
+        def upstream(request):
+            body = json.loads(request.content)
+            sent.append([m["content"] for m in body["messages"]])
+            if status["code"] != 200:
+                return httpx.Response(status["code"], json={"error": {"message": "down"}})
+            return httpx.Response(200, json={"choices": [{"message": {"content": f"r{len(sent)}"}}]})
+
+        async def chat(content, **extra):
+            payload = {"model": "m", "messages": [{"role": "user", "content": content}],
+                       "api_key": "sk-or-v1-test", **extra}
+            response = await main.ai_chat(payload, None, None)
+            return response.status_code, json.loads(response.body)
+
+        async def run():
+            http_client._http_client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+            llm_cache._llm_cache = None
+            llm_limiter._llm_limiter = None
+            conversation_store._conversation_store = None
+            try:
+                _, first = await chat("hi", session=True)
+                session_id = first["session_id"]
+                status["code"] = 503
+                failed, _ = await chat("again", session_id=session_id)
+                status["code"] = 200
+                _, second = await chat("again", session_id=session_id)
+                history = await main.get_session(session_id, "sk-or-v1-test")
+                deleted = await main.delete_session(session_id, "sk-or-v1-test")
+                missing = await main.get_session(session_id, "sk-or-v1-test")
+                return failed, second, history, deleted, missing
+            finally:
+                await http_client.cleanup_http_client()
+                llm_cache._llm_cache = None
+                conversation_store._conversation_store = None
+
+        failed, second, history, deleted, missing = asyncio.run(run())
+        assert failed == 503
+        assert sent[-1] == ["hi", "r1", "again"]
+        assert second["content"] == "r3"
+        assert [m["content"] for m in history.data["messages"]] == ["hi", "r1", "again", "r3"]
+        assert deleted.code == 200 and missing.code == 404
+
+    def test_sessions_bound_to_api_key(self, monkeypatch):
+        """测试会话只接受服务端生成的 ID，其他 API Key 无法读取、追加或删除"""
+        import json
+        httpx = pytest.importorskip("httpx")
+        pytest.importorskip("fastapi")
+        import main
+        from app import conversation_store, http_client, llm_cache, llm_limiter
+        monkeypatch.delenv("OPENROUTER_API_KEY", raising=False)
+        owner, other = "sk-or-v1-owner", "sk-or-v1-other"
+
+        def upstream(request):
+            return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+        async def chat(api_key, **extra):
+            payload = {"model": "m", "messages": [{"role": "user", "content": "hi"}], "api_key": api_key, **extra}
+            response = await main.ai_chat(payload, None, None)
+            return response.status_code, json.loads(response.body)
+
+        async def run():
+            http_client._http_client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+            llm_cache._llm_cache = None
+            llm_limiter._llm_limiter = None
+            conversation_store._conversation_store = None
+            try:
+                chosen, _ = await chat(owner, session_id="alice")
+                _, first = await chat(owner, session=True)
+                session_id = first["session_id"]
+                appended, _ = await chat(other, session_id=session_id, reset=True)
+                read = await main.get_session(session_id, other)
+                deleted = await main.delete_session(session_id, other)
+                anonymous = await main.get_session(session_id, None)
+                kept = await main.get_session(session_id, owner)
+                return chosen, appended, read, deleted, anonymous, kept
+            finally:
+                await http_client.cleanup_http_client()
+                llm_cache._llm_cache = None
+                conversation_store._conversation_store = None
+
+        chosen, appended, read, deleted, anonymous, kept = asyncio.run(run())
+        assert chosen == 400
+        assert appended == 404
+        assert read.code == 404 and deleted.code == 404 and anonymous.code == 404
+        assert [m["content"] for m in kept.data["messages"]] == ["hi", "ok"]
+
+
+class TestAIPipeline:
+    """测试 /ai/pipeline 生成 → 清理 → 预检 → 执行 → 报告流水线"""
+
+    GOOD = "这是生成的测试：\n```python\ndef test_add():\n    assert 1 + 1 == 2\n```"
+    BROKEN = "```python\ndef test_add(:\n    pass\n```"
+
+    @staticmethod
+    def _pipeline(handler, headers=None, **fields):
+        import json
+        httpx = pytest.importorskip("httpx")
+        pytest.importorskip("fastapi")
+        import main
+        from app import http_client, llm_cache, llm_limiter, script_executor
+
+        class FakeRequest:
+            client = None
+
+        async def run():
+            http_client._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            llm_cache._llm_cache = None
+            llm_limiter._llm_limiter = None
+            script_executor._script_executor = ScriptExecutor(
+                pool_config=WorkerPoolConfig(size=0), admission_config=AdmissionConfig(max_concurrent=0)
+            )
+            payload = {"model": "m", "messages": [{"role": "user", "content": "写一个测试"}],
+                       "api_key": "sk-or-v1-test", **fields}
+            try:
+                response = await main.ai_pipeline(main.PipelineRequest(**payload), FakeRequest(), None, None,
+                                                  (headers or {}).get("bypass"))
+                if not hasattr(response, "body_iterator"):
+                    return response, []
+                events = []
+                async for chunk in response.body_iterator:
+                    event, data = chunk.split("\n", 1)
+                    events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+                return response, events
+            finally:
+                await http_client.cleanup_http_client()
+                llm_cache._llm_cache = None
+                script_executor.cleanup_executor()
+
+        return asyncio.run(run())
+
+    def test_messages_not_compacted(self):
+        """测试流水线把客户端提供的完整上下文原样发往上游"""
+        import json
+        httpx = pytest.importorskip("httpx")
+        sent = []
+        messages = [{"role": "user", "content": str(i)} for i in range(60)]
+
+        def handler(request):
+            sent.append(json.loads(request.content)["messages"])
+            return httpx.Response(200, json={"choices": [{"message": {"content": self.GOOD}}]})
+
+        self._pipeline(handler, messages=messages)
+        assert sent == [messages]
+
+    def test_single_variant_report(self):
+        """测试单个候选依次推送 generate / preflight / execute 阶段，最后推送报告"""
+        httpx = pytest.importorskip("httpx")
+        _, events = self._pipeline(
+            lambda request: httpx.Response(200, json={"choices": [{"message": {"content": self.GOOD}}]}))
+        stages = [(data["stage"], data["status"]) for event, data in events if event == "stage"]
+        assert stages == [("generate", "started"), ("generate", "done"), ("sanitize", "done"),
+                          ("preflight", "done"), ("execute", "started"), ("execute", "done")]
+        event, report = events[-1]
+        assert event == "report"
+        assert report["passed"] == 1 and report["best"] == 0
+        variant = report["variants"][0]
+        assert variant["code"].startswith("def test_add")
+        assert variant["result"]["data"]["test_summary"]["passed"] == 1
+        assert set(variant["timings"]) == {"generate", "sanitize", "preflight", "execute"}
+
+    def test_fan_out_picks_passing_variant(self):
+        """测试并发生成多个候选，预检失败的候选不执行，报告选出通过的候选"""
+        httpx = pytest.importorskip("httpx")
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            content = self.GOOD if len(calls) == 2 else self.BROKEN
+            return httpx.Response(200, json={"choices": [{"message": {"content": content}}]})
+
+        _, events = self._pipeline(handler, variants=3)
+        report = events[-1][1]
+        assert len(calls) == 3
+        assert report["passed"] == 1
+        assert report["variants"][report["best"]]["passed"]
+        errors = [data for event, data in events if event == "stage" and data["status"] == "error"]
+        assert len(errors) == 2 and all(data["stage"] == "preflight" for data in errors)
+
+    def test_generate_error_and_validation(self):
+        """测试上游错误作为阶段错误推送，参数错误直接返回 JSON"""
+        httpx = pytest.importorskip("httpx")
+        _, events = self._pipeline(lambda request: httpx.Response(429, json={}))
+        assert events[0][1]["stage"] == "generate" and events[1][1]["status"] == "error"
+        assert events[-1][1]["variants"][0]["result"]["code"] == 429
+
+        response, _ = self._pipeline(lambda request: httpx.Response(500), variants=99)
+        assert response.status_code == 400